@@ -1,4 +1,4 @@
-import React, { useEffect, useRef } from 'react';
+import React, { useEffect } from 'react';
 
 interface BackendLogDrawerProps {
   open: boolean;
@@ -44,32 +44,72 @@ const preStyle: React.CSSProperties = {
   maxHeight: 'calc(100% - 48px)',
 };
 
+const MAX_LINES = 500;
+const API_KEY = import.meta.env.VITE_API_KEY || 'blackbox-api-key-2024';
+
+interface LogRecord {
+  seq?: number;
+  ts: string;
+  level: string;
+  logger: string;
+  msg: string;
+  exc?: string;
+}
+
+const formatRecord = (record: LogRecord) =>
+  `${record.ts} ${record.level} ${record.logger} - ${record.msg}${record.exc ? `\n${record.exc}` : ''}`;
+
 const BackendLogDrawer: React.FC<BackendLogDrawerProps> = ({ open, onClose }) => {
-  const [logs, setLogs] = React.useState('');
+  const [lines, setLines] = React.useState<string[]>([]);
   const [loading, setLoading] = React.useState(false);
-  const intervalRef = useRef<NodeJS.Timeout | null>(null);
 
+  const appendLines = (newLines: string[]) => {
+    setLines(prev => [...prev, ...newLines].slice(-MAX_LINES));
+    setLoading(false);
+  };
+
+  // Without EventSource (or when the stream fails) show the tail of the log file once
   const fetchLogs = async () => {
-    setLoading(true);
     try {
-      const res = await fetch('/api/logs');
+      const res = await fetch('/api/logs?lines=200', {
+        headers: { 'X-API-Key': API_KEY }
+      });
       const text = await res.text();
-      setLogs(text);
+      appendLines(text.split('\n').filter(Boolean).map(line => {
+        try {
+          return formatRecord(JSON.parse(line));
+        } catch {
+          return line;
+        }
+      }));
     } catch (err) {
-      setLogs('Failed to fetch logs.');
+      appendLines(['Failed to fetch logs.']);
     }
-    setLoading(false);
   };
 
   useEffect(() => {
-    if (open) {
+    if (!open) return;
+    setLines([]);
+    setLoading(true);
+    if (typeof EventSource === 'undefined') {
       fetchLogs();
-      intervalRef.current = setInterval(fetchLogs, 2000); // Poll every 2s
-    } else if (intervalRef.current) {
-      clearInterval(intervalRef.current);
+      return;
     }
+    // Recent records first, then each new one as the backend logs it.
+    // EventSource cannot send headers, so the API key goes in the query string.
+    const source = new EventSource(`/api/logs/stream?token=${encodeURIComponent(API_KEY)}`);
+    source.onopen = () => setLoading(false);
+    source.addEventListener('log', (event) => {
+      appendLines([formatRecord(JSON.parse((event as MessageEvent).data))]);
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself; only fall back if it gave up
+      if (source.readyState === EventSource.CLOSED) {
+        fetchLogs();
+      }
+    };
     return () => {
-      if (intervalRef.current) clearInterval(intervalRef.current);
+      source.close();
     };
     // eslint-disable-next-line
   }, [open]);
@@ -82,7 +122,7 @@ const BackendLogDrawer: React.FC<BackendLogDrawerProps> = ({ open, onClose }) =>
         <span>Backend Console Log</span>
         <button onClick={onClose} style={{background: '#333', color: '#fff', border: 'none', borderRadius: 4, padding: '2px 12px', cursor: 'pointer', fontWeight: 700}}>Close</button>
       </div>
-      <pre style={preStyle}>{loading ? 'Loading...' : logs}</pre>
+      <pre style={preStyle}>{loading ? 'Loading...' : lines.join('\n')}</pre>
     </div>
   );
 };
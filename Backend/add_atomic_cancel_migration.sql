@@ -0,0 +1,69 @@
+-- Migration for atomic order cancellation
+-- Run this in your Supabase SQL Editor
+--
+-- cancel_order_and_restore_inventory() moves a pending order to 'cancelled'
+-- and adds its line item quantities back to inventory in one transaction.
+-- Stock is incremented in place (quantity = quantity + delta), so concurrent
+-- cancels or admin edits cannot lose updates. The payment_status = 'pending'
+-- guard makes repeated cancels no-ops.
+
+CREATE OR REPLACE FUNCTION cancel_order_and_restore_inventory(p_machine_id TEXT, p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_items JSONB;
+    v_status TEXT;
+    v_restored JSON;
+BEGIN
+    UPDATE orders
+    SET payment_status = 'cancelled',
+        updated_at = NOW()
+    WHERE machine_id = p_machine_id
+      AND order_id = p_order_id
+      AND payment_status = 'pending'
+    RETURNING items INTO v_items;
+
+    IF NOT FOUND THEN
+        SELECT payment_status INTO v_status
+        FROM orders
+        WHERE machine_id = p_machine_id AND order_id = p_order_id;
+
+        RETURN json_build_object(
+            'found', FOUND,
+            'cancelled', FALSE,
+            'status', v_status,
+            'restored', '[]'::JSON
+        );
+    END IF;
+
+    WITH deltas AS (
+        SELECT li->>'id' AS item_id,
+               SUM(COALESCE((li->>'quantity')::INTEGER, 0)) AS quantity
+        FROM jsonb_array_elements(COALESCE(v_items, '[]'::JSONB)) li
+        WHERE li->>'id' IS NOT NULL
+        GROUP BY li->>'id'
+    ),
+    restored AS (
+        UPDATE inventory i
+        SET quantity = i.quantity + d.quantity,
+            updated_at = NOW()
+        FROM deltas d
+        WHERE i.machine_id = p_machine_id
+          AND i.id::TEXT = d.item_id
+        RETURNING i.id, i.quantity, d.quantity AS delta
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', id, 'quantity', quantity, 'delta', delta)), '[]'::JSON)
+    INTO v_restored
+    FROM restored;
+
+    RETURN json_build_object(
+        'found', TRUE,
+        'cancelled', TRUE,
+        'status', 'cancelled',
+        'restored', v_restored
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION cancel_order_and_restore_inventory(TEXT, TEXT) TO service_role;
@@ -0,0 +1,97 @@
+-- Migration for GET /api/dashboard/stats
+-- Run this in your Supabase SQL Editor
+--
+-- dashboard_stats() aggregates everything the dashboard shows in one call, so
+-- the backend transfers a single small JSON document regardless of how many
+-- orders a machine has. Day windows start at midnight in the machine's timezone.
+
+CREATE OR REPLACE FUNCTION dashboard_stats(
+    p_machine_id TEXT,
+    p_timezone TEXT DEFAULT 'Asia/Kolkata',
+    p_low_stock INTEGER DEFAULT 5,
+    p_critical_stock INTEGER DEFAULT 2
+)
+RETURNS JSON
+LANGUAGE sql
+STABLE
+AS $$
+WITH bounds AS (
+    SELECT date_trunc('day', NOW() AT TIME ZONE p_timezone) AT TIME ZONE p_timezone AS today_start
+),
+order_stats AS (
+    SELECT
+        COUNT(*) AS total,
+        COUNT(*) FILTER (WHERE o.created_at >= b.today_start) AS today,
+        COUNT(*) FILTER (WHERE o.created_at >= b.today_start - INTERVAL '6 days') AS last_7d,
+        COUNT(*) FILTER (WHERE o.created_at >= b.today_start - INTERVAL '29 days') AS last_30d,
+        COALESCE(SUM(o.total_amount) FILTER (WHERE o.payment_status = 'paid'), 0) AS total_sales,
+        COALESCE(SUM(o.total_amount) FILTER (
+            WHERE o.payment_status = 'paid' AND o.created_at >= b.today_start), 0) AS sales_today,
+        COALESCE(SUM(o.total_amount) FILTER (
+            WHERE o.payment_status = 'paid' AND o.created_at >= b.today_start - INTERVAL '6 days'), 0) AS sales_7d,
+        COALESCE(SUM(o.total_amount) FILTER (
+            WHERE o.payment_status = 'paid' AND o.created_at >= b.today_start - INTERVAL '29 days'), 0) AS sales_30d
+    FROM orders o
+    CROSS JOIN bounds b
+    WHERE o.machine_id = p_machine_id
+),
+status_stats AS (
+    SELECT COALESCE(
+        json_object_agg(s.payment_status, json_build_object('count', s.order_count, 'amount', s.amount)),
+        '{}'::json
+    ) AS by_status
+    FROM (
+        SELECT COALESCE(payment_status, 'unknown') AS payment_status,
+               COUNT(*) AS order_count,
+               COALESCE(SUM(total_amount), 0) AS amount
+        FROM orders
+        WHERE machine_id = p_machine_id
+        GROUP BY COALESCE(payment_status, 'unknown')
+    ) s
+),
+inventory_stats AS (
+    SELECT
+        COUNT(*) AS total_items,
+        COUNT(*) FILTER (WHERE quantity <= p_low_stock) AS low_stock,
+        COUNT(*) FILTER (WHERE quantity <= p_critical_stock) AS critical_stock,
+        COUNT(*) FILTER (WHERE quantity = 0) AS out_of_stock,
+        COUNT(*) FILTER (WHERE quantity > p_low_stock) AS in_stock
+    FROM inventory
+    WHERE machine_id = p_machine_id
+),
+recent AS (
+    SELECT COALESCE(json_agg(r ORDER BY r.created_at DESC), '[]'::json) AS recent_orders
+    FROM (
+        SELECT *
+        FROM orders
+        WHERE machine_id = p_machine_id
+        ORDER BY created_at DESC
+        LIMIT 4
+    ) r
+)
+SELECT json_build_object(
+    'orders', json_build_object(
+        'total', os.total,
+        'today', os.today,
+        'last_7d', os.last_7d,
+        'last_30d', os.last_30d,
+        'total_sales', os.total_sales,
+        'sales_today', os.sales_today,
+        'sales_7d', os.sales_7d,
+        'sales_30d', os.sales_30d,
+        'by_status', ss.by_status
+    ),
+    'inventory', json_build_object(
+        'total_items', inv.total_items,
+        'low_stock', inv.low_stock,
+        'critical_stock', inv.critical_stock,
+        'out_of_stock', inv.out_of_stock,
+        'in_stock', inv.in_stock
+    ),
+    'recent_orders', rc.recent_orders,
+    'timezone', p_timezone
+)
+FROM order_stats os, status_stats ss, inventory_stats inv, recent rc;
+$$;
+
+GRANT EXECUTE ON FUNCTION dashboard_stats(TEXT, TEXT, INTEGER, INTEGER) TO service_role;
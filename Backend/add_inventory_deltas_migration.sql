@@ -0,0 +1,184 @@
+-- Migration: return changed inventory rows from the stock functions
+-- Run this in your Supabase SQL Editor (after add_inventory_reservations_migration.sql)
+--
+-- The backend pushes the changed rows to clients over Socket.IO instead of
+-- telling every client to refetch the whole inventory, so each stock function
+-- now reports the rows it touched as {id, quantity, reserved_quantity}.
+
+CREATE OR REPLACE FUNCTION create_order_with_reservation(p_order JSONB, p_hold_seconds INTEGER DEFAULT 180)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_machine_id TEXT := p_order->>'machine_id';
+    v_expires_at TIMESTAMP WITH TIME ZONE := NOW() + make_interval(secs => p_hold_seconds);
+    v_unavailable JSON;
+    v_inventory JSON;
+    v_order JSON;
+BEGIN
+    -- Lock the affected rows in a fixed order so concurrent checkouts cannot deadlock
+    PERFORM 1
+    FROM inventory i
+    JOIN order_item_deltas(p_order->'items') d ON i.id::TEXT = d.item_id
+    WHERE i.machine_id = v_machine_id
+    ORDER BY i.id
+    FOR UPDATE OF i;
+
+    SELECT json_agg(json_build_object(
+               'id', d.item_id,
+               'requested', d.quantity,
+               'available', COALESCE(i.quantity, 0)))
+    INTO v_unavailable
+    FROM order_item_deltas(p_order->'items') d
+    LEFT JOIN inventory i ON i.machine_id = v_machine_id AND i.id::TEXT = d.item_id
+    WHERE i.id IS NULL OR i.quantity < d.quantity;
+
+    IF v_unavailable IS NOT NULL THEN
+        RETURN json_build_object('success', FALSE, 'unavailable', v_unavailable);
+    END IF;
+
+    WITH reserved AS (
+        UPDATE inventory i
+        SET quantity = i.quantity - d.quantity,
+            reserved_quantity = i.reserved_quantity + d.quantity,
+            updated_at = NOW()
+        FROM order_item_deltas(p_order->'items') d
+        WHERE i.machine_id = v_machine_id
+          AND i.id::TEXT = d.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity)), '[]'::JSON)
+    INTO v_inventory
+    FROM reserved;
+
+    INSERT INTO orders (
+        order_id, machine_id, items, total_amount, payment_status,
+        customer_name, customer_phone, created_at, updated_at, hold_expires_at
+    )
+    VALUES (
+        p_order->>'order_id', v_machine_id, p_order->'items', (p_order->>'total_amount')::NUMERIC, 'pending',
+        p_order->>'customer_name', p_order->>'customer_phone', NOW(), NOW(), v_expires_at
+    )
+    RETURNING row_to_json(orders.*) INTO v_order;
+
+    INSERT INTO inventory_reservations (order_id, machine_id, item_id, quantity, expires_at)
+    SELECT p_order->>'order_id', v_machine_id, d.item_id, d.quantity, v_expires_at
+    FROM order_item_deltas(p_order->'items') d;
+
+    RETURN json_build_object('success', TRUE, 'order', v_order, 'expires_at', v_expires_at, 'inventory', v_inventory);
+END;
+$$;
+
+-- Now returns the inventory rows it changed (empty when nothing was held)
+DROP FUNCTION IF EXISTS commit_order_reservation(TEXT);
+
+CREATE FUNCTION commit_order_reservation(p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_committed JSONB;
+    v_late JSONB;
+BEGIN
+    WITH committed AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING machine_id, item_id, quantity
+    ),
+    changed AS (
+        UPDATE inventory i
+        SET reserved_quantity = GREATEST(i.reserved_quantity - c.quantity, 0),
+            updated_at = NOW()
+        FROM committed c
+        WHERE i.machine_id = c.machine_id AND i.id::TEXT = c.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity)), '[]'::JSONB)
+    INTO v_committed
+    FROM changed;
+
+    -- A hold that had already been released (payment arrived after expiry) is taken from stock again
+    WITH late AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'released'
+        RETURNING machine_id, item_id, quantity
+    ),
+    changed AS (
+        UPDATE inventory i
+        SET quantity = GREATEST(i.quantity - l.quantity, 0),
+            updated_at = NOW()
+        FROM late l
+        WHERE i.machine_id = l.machine_id AND i.id::TEXT = l.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity)), '[]'::JSONB)
+    INTO v_late
+    FROM changed;
+
+    RETURN (v_committed || v_late)::JSON;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION cancel_order_and_restore_inventory(p_machine_id TEXT, p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_restored JSON;
+BEGIN
+    UPDATE orders
+    SET payment_status = 'cancelled',
+        updated_at = NOW()
+    WHERE machine_id = p_machine_id
+      AND order_id = p_order_id
+      AND payment_status = 'pending';
+
+    IF NOT FOUND THEN
+        SELECT payment_status INTO v_status
+        FROM orders
+        WHERE machine_id = p_machine_id AND order_id = p_order_id;
+
+        RETURN json_build_object(
+            'found', FOUND,
+            'cancelled', FALSE,
+            'status', v_status,
+            'restored', '[]'::JSON
+        );
+    END IF;
+
+    WITH released AS (
+        UPDATE inventory_reservations
+        SET status = 'released', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING item_id, quantity
+    ),
+    restored AS (
+        UPDATE inventory i
+        SET quantity = i.quantity + r.quantity,
+            reserved_quantity = GREATEST(i.reserved_quantity - r.quantity, 0),
+            updated_at = NOW()
+        FROM released r
+        WHERE i.machine_id = p_machine_id
+          AND i.id::TEXT = r.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity, r.quantity AS delta
+    )
+    SELECT COALESCE(json_agg(json_build_object(
+               'id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity, 'delta', delta)), '[]'::JSON)
+    INTO v_restored
+    FROM restored;
+
+    RETURN json_build_object(
+        'found', TRUE,
+        'cancelled', TRUE,
+        'status', 'cancelled',
+        'restored', v_restored
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION create_order_with_reservation(JSONB, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION commit_order_reservation(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_order_and_restore_inventory(TEXT, TEXT) TO service_role;
@@ -0,0 +1,203 @@
+-- Migration for inventory reservations held during checkout
+-- Run this in your Supabase SQL Editor (after add_atomic_cancel_migration.sql)
+--
+-- Stock is reserved when an order is created: inventory.quantity drops to the
+-- quantity still available to other customers and inventory.reserved_quantity
+-- tracks units held for unpaid orders. A hold is committed when the QR code is
+-- paid and released when the order is cancelled or its hold expires.
+
+ALTER TABLE inventory ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS hold_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS inventory_reservations (
+    order_id VARCHAR(100) NOT NULL,
+    machine_id VARCHAR(50) NOT NULL,
+    item_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    status VARCHAR(20) NOT NULL DEFAULT 'held', -- held | committed | released
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (order_id, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_inventory_reservations_held_expiry
+    ON inventory_reservations(expires_at) WHERE status = 'held';
+CREATE INDEX IF NOT EXISTS idx_orders_pending_hold_expiry
+    ON orders(hold_expires_at) WHERE payment_status = 'pending';
+
+-- Requested quantity per inventory item for an order's line items
+CREATE OR REPLACE FUNCTION order_item_deltas(p_items JSONB)
+RETURNS TABLE (item_id TEXT, quantity INTEGER)
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT li->>'id', SUM(COALESCE((li->>'quantity')::INTEGER, 0))::INTEGER
+    FROM jsonb_array_elements(COALESCE(p_items, '[]'::JSONB)) li
+    WHERE li->>'id' IS NOT NULL
+    GROUP BY li->>'id'
+    HAVING SUM(COALESCE((li->>'quantity')::INTEGER, 0)) > 0
+$$;
+
+-- Create a pending order and reserve its items in one transaction.
+-- Either every line item is reserved or nothing is written and the
+-- unavailable items are returned.
+CREATE OR REPLACE FUNCTION create_order_with_reservation(p_order JSONB, p_hold_seconds INTEGER DEFAULT 180)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_machine_id TEXT := p_order->>'machine_id';
+    v_expires_at TIMESTAMP WITH TIME ZONE := NOW() + make_interval(secs => p_hold_seconds);
+    v_unavailable JSON;
+    v_order JSON;
+BEGIN
+    -- Lock the affected rows in a fixed order so concurrent checkouts cannot deadlock
+    PERFORM 1
+    FROM inventory i
+    JOIN order_item_deltas(p_order->'items') d ON i.id::TEXT = d.item_id
+    WHERE i.machine_id = v_machine_id
+    ORDER BY i.id
+    FOR UPDATE OF i;
+
+    SELECT json_agg(json_build_object(
+               'id', d.item_id,
+               'requested', d.quantity,
+               'available', COALESCE(i.quantity, 0)))
+    INTO v_unavailable
+    FROM order_item_deltas(p_order->'items') d
+    LEFT JOIN inventory i ON i.machine_id = v_machine_id AND i.id::TEXT = d.item_id
+    WHERE i.id IS NULL OR i.quantity < d.quantity;
+
+    IF v_unavailable IS NOT NULL THEN
+        RETURN json_build_object('success', FALSE, 'unavailable', v_unavailable);
+    END IF;
+
+    UPDATE inventory i
+    SET quantity = i.quantity - d.quantity,
+        reserved_quantity = i.reserved_quantity + d.quantity,
+        updated_at = NOW()
+    FROM order_item_deltas(p_order->'items') d
+    WHERE i.machine_id = v_machine_id
+      AND i.id::TEXT = d.item_id;
+
+    INSERT INTO orders (
+        order_id, machine_id, items, total_amount, payment_status,
+        customer_name, customer_phone, created_at, updated_at, hold_expires_at
+    )
+    VALUES (
+        p_order->>'order_id', v_machine_id, p_order->'items', (p_order->>'total_amount')::NUMERIC, 'pending',
+        p_order->>'customer_name', p_order->>'customer_phone', NOW(), NOW(), v_expires_at
+    )
+    RETURNING row_to_json(orders.*) INTO v_order;
+
+    INSERT INTO inventory_reservations (order_id, machine_id, item_id, quantity, expires_at)
+    SELECT p_order->>'order_id', v_machine_id, d.item_id, d.quantity, v_expires_at
+    FROM order_item_deltas(p_order->'items') d;
+
+    RETURN json_build_object('success', TRUE, 'order', v_order, 'expires_at', v_expires_at);
+END;
+$$;
+
+-- The order was paid: the held units have left the machine. A hold that had
+-- already been released (payment arrived after expiry) is taken from stock again.
+CREATE OR REPLACE FUNCTION commit_order_reservation(p_order_id TEXT)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_committed INTEGER;
+    v_late INTEGER;
+BEGIN
+    WITH committed AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING machine_id, item_id, quantity
+    )
+    UPDATE inventory i
+    SET reserved_quantity = GREATEST(i.reserved_quantity - c.quantity, 0),
+        updated_at = NOW()
+    FROM committed c
+    WHERE i.machine_id = c.machine_id AND i.id::TEXT = c.item_id;
+    GET DIAGNOSTICS v_committed = ROW_COUNT;
+
+    WITH late AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'released'
+        RETURNING machine_id, item_id, quantity
+    )
+    UPDATE inventory i
+    SET quantity = GREATEST(i.quantity - l.quantity, 0),
+        updated_at = NOW()
+    FROM late l
+    WHERE i.machine_id = l.machine_id AND i.id::TEXT = l.item_id;
+    GET DIAGNOSTICS v_late = ROW_COUNT;
+
+    RETURN v_committed + v_late;
+END;
+$$;
+
+-- Cancellation now releases the order's held reservations instead of adding
+-- its line items back: stock is only returned if it was actually taken.
+CREATE OR REPLACE FUNCTION cancel_order_and_restore_inventory(p_machine_id TEXT, p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_restored JSON;
+BEGIN
+    UPDATE orders
+    SET payment_status = 'cancelled',
+        updated_at = NOW()
+    WHERE machine_id = p_machine_id
+      AND order_id = p_order_id
+      AND payment_status = 'pending';
+
+    IF NOT FOUND THEN
+        SELECT payment_status INTO v_status
+        FROM orders
+        WHERE machine_id = p_machine_id AND order_id = p_order_id;
+
+        RETURN json_build_object(
+            'found', FOUND,
+            'cancelled', FALSE,
+            'status', v_status,
+            'restored', '[]'::JSON
+        );
+    END IF;
+
+    WITH released AS (
+        UPDATE inventory_reservations
+        SET status = 'released', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING item_id, quantity
+    ),
+    restored AS (
+        UPDATE inventory i
+        SET quantity = i.quantity + r.quantity,
+            reserved_quantity = GREATEST(i.reserved_quantity - r.quantity, 0),
+            updated_at = NOW()
+        FROM released r
+        WHERE i.machine_id = p_machine_id
+          AND i.id::TEXT = r.item_id
+        RETURNING i.id, i.quantity, r.quantity AS delta
+    )
+    SELECT COALESCE(json_agg(json_build_object('id', id, 'quantity', quantity, 'delta', delta)), '[]'::JSON)
+    INTO v_restored
+    FROM restored;
+
+    RETURN json_build_object(
+        'found', TRUE,
+        'cancelled', TRUE,
+        'status', 'cancelled',
+        'restored', v_restored
+    );
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION create_order_with_reservation(JSONB, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION commit_order_reservation(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_order_and_restore_inventory(TEXT, TEXT) TO service_role;
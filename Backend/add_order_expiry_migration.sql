@@ -0,0 +1,55 @@
+-- Migration for the order expiry scheduler
+-- Run this in your Supabase SQL Editor (after add_inventory_reservations_migration.sql)
+
+-- Leases elect one process (across gunicorn workers and nodes) to run a
+-- background job. A holder keeps the lease by renewing it before it expires.
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+    name VARCHAR(100) PRIMARY KEY,
+    holder VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Take or renew a lease; returns TRUE when p_holder owns it afterwards
+CREATE OR REPLACE FUNCTION try_acquire_scheduler_lease(p_name TEXT, p_holder TEXT, p_ttl_seconds INTEGER)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO scheduler_leases AS l (name, holder, expires_at, updated_at)
+    VALUES (p_name, p_holder, NOW() + make_interval(secs => p_ttl_seconds), NOW())
+    ON CONFLICT (name) DO UPDATE SET
+        holder = EXCLUDED.holder,
+        expires_at = EXCLUDED.expires_at,
+        updated_at = NOW()
+    WHERE l.holder = EXCLUDED.holder OR l.expires_at < NOW();
+
+    RETURN FOUND;
+END;
+$$;
+
+-- Cancel many expired orders in one call. p_orders is a JSON array of
+-- {"machine_id": ..., "order_id": ...}; each order is cancelled with the
+-- same guarded, idempotent logic as cancel_order_and_restore_inventory().
+CREATE OR REPLACE FUNCTION cancel_orders_and_restore_inventory(p_orders JSONB)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_entry JSONB;
+    v_results JSONB := '[]'::JSONB;
+BEGIN
+    FOR v_entry IN SELECT * FROM jsonb_array_elements(COALESCE(p_orders, '[]'::JSONB))
+    LOOP
+        v_results := v_results || jsonb_build_array(
+            jsonb_build_object('machine_id', v_entry->>'machine_id', 'order_id', v_entry->>'order_id')
+            || cancel_order_and_restore_inventory(v_entry->>'machine_id', v_entry->>'order_id')::JSONB
+        );
+    END LOOP;
+
+    RETURN v_results::JSON;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION try_acquire_scheduler_lease(TEXT, TEXT, INTEGER) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_orders_and_restore_inventory(JSONB) TO service_role;
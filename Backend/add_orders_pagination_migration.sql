@@ -0,0 +1,14 @@
+-- Migration for keyset pagination and filtering on GET /api/orders
+-- Run this in your Supabase SQL Editor
+
+-- Keyset pagination walks (created_at, order_id) newest-first within a machine
+CREATE INDEX IF NOT EXISTS idx_orders_machine_created_order
+    ON orders(machine_id, created_at DESC, order_id DESC);
+
+-- Status filter (e.g. ?status=paid) combined with the same ordering
+CREATE INDEX IF NOT EXISTS idx_orders_machine_status_created
+    ON orders(machine_id, payment_status, created_at DESC);
+
+-- Customer phone lookups (?phone=...)
+CREATE INDEX IF NOT EXISTS idx_orders_machine_customer_phone
+    ON orders(machine_id, customer_phone);
@@ -0,0 +1,170 @@
+-- Migration: lock inventory rows in a fixed order when committing or releasing holds
+-- Run this in your Supabase SQL Editor (after add_inventory_deltas_migration.sql
+-- and add_order_expiry_migration.sql)
+--
+-- create_order_with_reservation() locks the inventory rows it touches in id
+-- order before updating them. Commit and cancel updated the same rows in
+-- whatever order the join produced, so a payment or cancellation racing a
+-- checkout over overlapping items could deadlock. Each function now takes the
+-- inventory row locks first, with ORDER BY id FOR UPDATE; the batch cancel locks
+-- the rows of every order in the batch at once, since it holds them until it ends.
+
+CREATE OR REPLACE FUNCTION commit_order_reservation(p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_committed JSONB;
+    v_late JSONB;
+BEGIN
+    -- Same lock order as create_order_with_reservation(): inventory rows by id
+    PERFORM 1
+    FROM inventory i
+    JOIN inventory_reservations r ON r.machine_id = i.machine_id AND r.item_id = i.id::TEXT
+    WHERE r.order_id = p_order_id
+      AND r.status IN ('held', 'released')
+    ORDER BY i.id
+    FOR UPDATE OF i;
+
+    WITH committed AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING machine_id, item_id, quantity
+    ),
+    changed AS (
+        UPDATE inventory i
+        SET reserved_quantity = GREATEST(i.reserved_quantity - c.quantity, 0),
+            updated_at = NOW()
+        FROM committed c
+        WHERE i.machine_id = c.machine_id AND i.id::TEXT = c.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity)), '[]'::JSONB)
+    INTO v_committed
+    FROM changed;
+
+    -- A hold that had already been released (payment arrived after expiry) is taken from stock again
+    WITH late AS (
+        UPDATE inventory_reservations
+        SET status = 'committed', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'released'
+        RETURNING machine_id, item_id, quantity
+    ),
+    changed AS (
+        UPDATE inventory i
+        SET quantity = GREATEST(i.quantity - l.quantity, 0),
+            updated_at = NOW()
+        FROM late l
+        WHERE i.machine_id = l.machine_id AND i.id::TEXT = l.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object('id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity)), '[]'::JSONB)
+    INTO v_late
+    FROM changed;
+
+    RETURN (v_committed || v_late)::JSON;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION cancel_order_and_restore_inventory(p_machine_id TEXT, p_order_id TEXT)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_status TEXT;
+    v_restored JSON;
+BEGIN
+    -- Inventory rows first, then the order row, as in create_order_with_reservation()
+    PERFORM 1
+    FROM inventory i
+    JOIN inventory_reservations r ON r.item_id = i.id::TEXT
+    WHERE i.machine_id = p_machine_id
+      AND r.order_id = p_order_id
+      AND r.status = 'held'
+    ORDER BY i.id
+    FOR UPDATE OF i;
+
+    UPDATE orders
+    SET payment_status = 'cancelled',
+        updated_at = NOW()
+    WHERE machine_id = p_machine_id
+      AND order_id = p_order_id
+      AND payment_status = 'pending';
+
+    IF NOT FOUND THEN
+        SELECT payment_status INTO v_status
+        FROM orders
+        WHERE machine_id = p_machine_id AND order_id = p_order_id;
+
+        RETURN json_build_object(
+            'found', FOUND,
+            'cancelled', FALSE,
+            'status', v_status,
+            'restored', '[]'::JSON
+        );
+    END IF;
+
+    WITH released AS (
+        UPDATE inventory_reservations
+        SET status = 'released', updated_at = NOW()
+        WHERE order_id = p_order_id AND status = 'held'
+        RETURNING item_id, quantity
+    ),
+    restored AS (
+        UPDATE inventory i
+        SET quantity = i.quantity + r.quantity,
+            reserved_quantity = GREATEST(i.reserved_quantity - r.quantity, 0),
+            updated_at = NOW()
+        FROM released r
+        WHERE i.machine_id = p_machine_id
+          AND i.id::TEXT = r.item_id
+        RETURNING i.id, i.quantity, i.reserved_quantity, r.quantity AS delta
+    )
+    SELECT COALESCE(json_agg(json_build_object(
+               'id', id, 'quantity', quantity, 'reserved_quantity', reserved_quantity, 'delta', delta)), '[]'::JSON)
+    INTO v_restored
+    FROM restored;
+
+    RETURN json_build_object(
+        'found', TRUE,
+        'cancelled', TRUE,
+        'status', 'cancelled',
+        'restored', v_restored
+    );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION cancel_orders_and_restore_inventory(p_orders JSONB)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_entry JSONB;
+    v_results JSONB := '[]'::JSONB;
+BEGIN
+    -- The whole batch runs in one transaction, so lock every order's rows up front
+    PERFORM 1
+    FROM inventory i
+    JOIN inventory_reservations r ON r.machine_id = i.machine_id AND r.item_id = i.id::TEXT
+    JOIN jsonb_array_elements(COALESCE(p_orders, '[]'::JSONB)) o
+      ON r.machine_id = o->>'machine_id' AND r.order_id = o->>'order_id'
+    WHERE r.status = 'held'
+    ORDER BY i.id
+    FOR UPDATE OF i;
+
+    FOR v_entry IN SELECT * FROM jsonb_array_elements(COALESCE(p_orders, '[]'::JSONB))
+    LOOP
+        v_results := v_results || jsonb_build_array(
+            jsonb_build_object('machine_id', v_entry->>'machine_id', 'order_id', v_entry->>'order_id')
+            || cancel_order_and_restore_inventory(v_entry->>'machine_id', v_entry->>'order_id')::JSONB
+        );
+    END LOOP;
+
+    RETURN v_results::JSON;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION commit_order_reservation(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_order_and_restore_inventory(TEXT, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION cancel_orders_and_restore_inventory(JSONB) TO service_role;
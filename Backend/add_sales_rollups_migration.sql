@@ -0,0 +1,182 @@
+-- Migration for incrementally maintained sales rollups
+-- Run this in your Supabase SQL Editor, then backfill existing orders with:
+--   python backfill_sales_rollups.py
+--
+-- Rollups hold revenue, units and order counts per machine and per inventory
+-- item, bucketed by hour and by day in the machine's local timezone. The row
+-- with item_id = '*' carries the machine-wide totals for the bucket.
+
+-- Orders are counted into the rollups exactly once; this marks when
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS rolled_up_at TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS sales_rollup_hourly (
+    machine_id VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    item_id TEXT NOT NULL,
+    item_name TEXT,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (machine_id, item_id, bucket_start)
+);
+
+CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+    machine_id VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP WITH TIME ZONE NOT NULL,
+    item_id TEXT NOT NULL,
+    item_name TEXT,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    order_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (machine_id, item_id, bucket_start)
+);
+
+-- Per-item line totals for one order, plus the '*' machine total row
+CREATE OR REPLACE FUNCTION sales_rollup_lines(p_items JSONB, p_total_amount NUMERIC)
+RETURNS TABLE (item_id TEXT, item_name TEXT, revenue NUMERIC, units INTEGER)
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT
+        li->>'id',
+        MAX(li->>'name'),
+        SUM(COALESCE((li->>'price')::NUMERIC, 0) * COALESCE((li->>'quantity')::INTEGER, 0)),
+        SUM(COALESCE((li->>'quantity')::INTEGER, 0))::INTEGER
+    FROM jsonb_array_elements(COALESCE(p_items, '[]'::JSONB)) li
+    WHERE li->>'id' IS NOT NULL
+    GROUP BY li->>'id'
+    UNION ALL
+    SELECT
+        '*',
+        NULL,
+        COALESCE(p_total_amount, 0),
+        (SELECT COALESCE(SUM(COALESCE((li->>'quantity')::INTEGER, 0)), 0)::INTEGER
+         FROM jsonb_array_elements(COALESCE(p_items, '[]'::JSONB)) li)
+$$;
+
+-- Add one paid order to the hourly and daily rollups. Returns FALSE when the
+-- order is not paid or was already counted, so webhook retries and the
+-- webhook/verify-payment race cannot double count.
+CREATE OR REPLACE FUNCTION apply_order_to_sales_rollups(p_order_id TEXT, p_timezone TEXT DEFAULT 'Asia/Kolkata')
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_machine_id VARCHAR(50);
+    v_created_at TIMESTAMP WITH TIME ZONE;
+    v_items JSONB;
+    v_total_amount NUMERIC;
+BEGIN
+    UPDATE orders
+    SET rolled_up_at = NOW()
+    WHERE order_id = p_order_id
+      AND payment_status = 'paid'
+      AND rolled_up_at IS NULL
+    RETURNING machine_id, created_at, items, total_amount
+    INTO v_machine_id, v_created_at, v_items, v_total_amount;
+
+    IF NOT FOUND THEN
+        RETURN FALSE;
+    END IF;
+
+    INSERT INTO sales_rollup_hourly AS r (machine_id, bucket_start, item_id, item_name, revenue, units, order_count)
+    SELECT v_machine_id,
+           date_trunc('hour', v_created_at AT TIME ZONE p_timezone) AT TIME ZONE p_timezone,
+           li.item_id, li.item_name, li.revenue, li.units, 1
+    FROM sales_rollup_lines(v_items, v_total_amount) li
+    ON CONFLICT (machine_id, item_id, bucket_start) DO UPDATE SET
+        item_name = COALESCE(EXCLUDED.item_name, r.item_name),
+        revenue = r.revenue + EXCLUDED.revenue,
+        units = r.units + EXCLUDED.units,
+        order_count = r.order_count + EXCLUDED.order_count,
+        updated_at = NOW();
+
+    INSERT INTO sales_rollup_daily AS r (machine_id, bucket_start, item_id, item_name, revenue, units, order_count)
+    SELECT v_machine_id,
+           date_trunc('day', v_created_at AT TIME ZONE p_timezone) AT TIME ZONE p_timezone,
+           li.item_id, li.item_name, li.revenue, li.units, 1
+    FROM sales_rollup_lines(v_items, v_total_amount) li
+    ON CONFLICT (machine_id, item_id, bucket_start) DO UPDATE SET
+        item_name = COALESCE(EXCLUDED.item_name, r.item_name),
+        revenue = r.revenue + EXCLUDED.revenue,
+        units = r.units + EXCLUDED.units,
+        order_count = r.order_count + EXCLUDED.order_count,
+        updated_at = NOW();
+
+    RETURN TRUE;
+END;
+$$;
+
+-- Rebuild rollups from the orders table in bulk (one machine, or all when
+-- p_machine_id is NULL). p_timezones maps machine ids to timezones, e.g.
+-- '{"VM-002": "Asia/Dubai"}'; other machines use p_default_timezone.
+-- Returns the number of paid orders counted.
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups(
+    p_machine_id TEXT DEFAULT NULL,
+    p_default_timezone TEXT DEFAULT 'Asia/Kolkata',
+    p_timezones JSONB DEFAULT '{}'::JSONB
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    -- Block incremental updates while the rollups are rebuilt
+    LOCK TABLE sales_rollup_hourly, sales_rollup_daily IN EXCLUSIVE MODE;
+
+    DELETE FROM sales_rollup_hourly WHERE p_machine_id IS NULL OR machine_id = p_machine_id;
+    DELETE FROM sales_rollup_daily WHERE p_machine_id IS NULL OR machine_id = p_machine_id;
+
+    UPDATE orders
+    SET rolled_up_at = NOW()
+    WHERE payment_status = 'paid'
+      AND (p_machine_id IS NULL OR machine_id = p_machine_id);
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    UPDATE orders
+    SET rolled_up_at = NULL
+    WHERE payment_status <> 'paid'
+      AND rolled_up_at IS NOT NULL
+      AND (p_machine_id IS NULL OR machine_id = p_machine_id);
+
+    WITH lines AS (
+        SELECT o.machine_id,
+               o.created_at AT TIME ZONE COALESCE(p_timezones->>o.machine_id, p_default_timezone) AS local_created_at,
+               COALESCE(p_timezones->>o.machine_id, p_default_timezone) AS tz,
+               li.*
+        FROM orders o
+        CROSS JOIN LATERAL sales_rollup_lines(o.items, o.total_amount) li
+        WHERE o.payment_status = 'paid'
+          AND (p_machine_id IS NULL OR o.machine_id = p_machine_id)
+    )
+    INSERT INTO sales_rollup_hourly (machine_id, bucket_start, item_id, item_name, revenue, units, order_count)
+    SELECT machine_id, date_trunc('hour', local_created_at) AT TIME ZONE tz, item_id,
+           MAX(item_name), SUM(revenue), SUM(units), COUNT(*)
+    FROM lines
+    GROUP BY machine_id, date_trunc('hour', local_created_at) AT TIME ZONE tz, item_id;
+
+    WITH lines AS (
+        SELECT o.machine_id,
+               o.created_at AT TIME ZONE COALESCE(p_timezones->>o.machine_id, p_default_timezone) AS local_created_at,
+               COALESCE(p_timezones->>o.machine_id, p_default_timezone) AS tz,
+               li.*
+        FROM orders o
+        CROSS JOIN LATERAL sales_rollup_lines(o.items, o.total_amount) li
+        WHERE o.payment_status = 'paid'
+          AND (p_machine_id IS NULL OR o.machine_id = p_machine_id)
+    )
+    INSERT INTO sales_rollup_daily (machine_id, bucket_start, item_id, item_name, revenue, units, order_count)
+    SELECT machine_id, date_trunc('day', local_created_at) AT TIME ZONE tz, item_id,
+           MAX(item_name), SUM(revenue), SUM(units), COUNT(*)
+    FROM lines
+    GROUP BY machine_id, date_trunc('day', local_created_at) AT TIME ZONE tz, item_id;
+
+    RETURN v_count;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION apply_order_to_sales_rollups(TEXT, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION rebuild_sales_rollups(TEXT, TEXT, JSONB) TO service_role;
@@ -0,0 +1,25 @@
+-- Migration for the Razorpay webhook queue
+-- Run this in your Supabase SQL Editor
+--
+-- Webhooks are acknowledged before they are applied and handled by a pool of
+-- background workers. An event that still fails after every retry is kept here
+-- with its payload so it can be inspected and replayed.
+CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+    id BIGSERIAL PRIMARY KEY,
+    event_id VARCHAR(255) NOT NULL,
+    event VARCHAR(100),
+    payload JSONB NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    received_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    resolved_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_dead_letters_unresolved
+    ON webhook_dead_letters (created_at)
+    WHERE resolved_at IS NULL;
+
+ALTER TABLE webhook_dead_letters ENABLE ROW LEVEL SECURITY;
+GRANT ALL ON webhook_dead_letters TO service_role;
+GRANT USAGE, SELECT ON SEQUENCE webhook_dead_letters_id_seq TO service_role;
@@ -0,0 +1,60 @@
+-- Migration for durable Razorpay webhook ingestion
+-- Run this in your Supabase SQL Editor (after add_webhook_dead_letters_migration.sql)
+--
+-- A verified webhook is stored here before Razorpay gets its 2xx, so an event
+-- sitting in a worker's in-memory queue survives a restart, deploy or crash.
+-- The event id is the primary key, which also deduplicates Razorpay's retries.
+-- Events that no worker finished are claimed again by claim_webhook_events().
+CREATE TABLE IF NOT EXISTS webhook_events (
+    event_id VARCHAR(255) PRIMARY KEY,
+    event VARCHAR(100),
+    payload JSONB NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'processed', 'dead')),
+    claims INTEGER NOT NULL DEFAULT 1,
+    claimed_until TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    received_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+    ON webhook_events (created_at)
+    WHERE status = 'pending';
+
+-- Claim up to p_limit pending events whose claim has lapsed for p_lease_seconds.
+-- The worker that stored an event holds the first claim until created_at +
+-- p_lease_seconds. Concurrent callers skip each other's rows; an event claimed
+-- p_max_claims times without finishing (it keeps killing its worker) is marked dead.
+CREATE OR REPLACE FUNCTION claim_webhook_events(p_limit INTEGER, p_lease_seconds INTEGER, p_max_claims INTEGER)
+RETURNS SETOF webhook_events
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    UPDATE webhook_events
+    SET status = 'dead',
+        last_error = 'Claimed ' || claims || ' times without finishing',
+        finished_at = NOW()
+    WHERE status = 'pending'
+      AND claims >= p_max_claims
+      AND COALESCE(claimed_until, created_at + make_interval(secs => p_lease_seconds)) < NOW();
+
+    RETURN QUERY
+    UPDATE webhook_events e
+    SET claims = e.claims + 1,
+        claimed_until = NOW() + make_interval(secs => p_lease_seconds)
+    WHERE e.event_id IN (
+        SELECT event_id FROM webhook_events
+        WHERE status = 'pending'
+          AND COALESCE(claimed_until, created_at + make_interval(secs => p_lease_seconds)) < NOW()
+        ORDER BY created_at
+        LIMIT p_limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING e.*;
+END;
+$$;
+
+ALTER TABLE webhook_events ENABLE ROW LEVEL SECURITY;
+GRANT ALL ON webhook_events TO service_role;
+GRANT EXECUTE ON FUNCTION claim_webhook_events(INTEGER, INTEGER, INTEGER) TO service_role;
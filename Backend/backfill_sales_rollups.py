@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Backfill Sales Rollups for Black Box Project
+Rebuilds the hourly/daily sales rollup tables from the orders table in bulk.
+Run add_sales_rollups_migration.sql in Supabase first.
+
+Usage:
+    python backfill_sales_rollups.py              # all machines
+    python backfill_sales_rollups.py VM-001       # one machine
+"""
+
+import sys
+import time
+from supabase_db import rebuild_sales_rollups, DEFAULT_MACHINE_TIMEZONE, MACHINE_TIMEZONES
+
+def backfill(machine_id=None):
+    target = machine_id or 'all machines'
+    print(f"🔧 Rebuilding sales rollups for {target}...")
+    print(f"🕒 Default timezone: {DEFAULT_MACHINE_TIMEZONE}, overrides: {MACHINE_TIMEZONES or 'none'}")
+
+    started = time.time()
+    try:
+        counted = rebuild_sales_rollups(machine_id)
+    except Exception as e:
+        print(f"❌ Backfill failed: {str(e)}")
+        print("💡 Make sure add_sales_rollups_migration.sql has been run in your Supabase SQL Editor")
+        return False
+
+    print(f"✅ Counted {counted} paid orders in {time.time() - started:.1f}s")
+    return True
+
+if __name__ == "__main__":
+    ok = backfill(sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.exit(0 if ok else 1)
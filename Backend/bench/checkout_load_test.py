@@ -0,0 +1,153 @@
+"""
+Checkout load test: boots one backend worker against the mock Supabase and
+mock Razorpay servers and fires concurrent POST /api/orders requests.
+
+Every checkout makes two Supabase round trips (reserve, then nothing else on
+the hot path) and two concurrent Razorpay calls, so with cooperative I/O one
+worker should overlap hundreds of them instead of serialising on the
+upstream latency.
+
+Usage:
+  python bench/checkout_load_test.py --checkouts 500 --concurrency 100
+  python bench/checkout_load_test.py --async-mode threading   # compare
+  python bench/checkout_load_test.py --server gunicorn        # production worker
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.mock_razorpay import start_mock_razorpay
+from bench.mock_supabase import start_mock_supabase, MOCK_SUPABASE_KEY
+
+MACHINE_ID = 'VM-001'
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def start_backend(args, supabase_url, razorpay_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': supabase_url,
+        'SUPABASE_KEY': MOCK_SUPABASE_KEY,
+        'API_KEY': 'bench-api-key',
+        'RAZORPAY_KEY_ID': 'rzp_test_bench',
+        'RAZORPAY_KEY_SECRET': 'bench_secret',
+        'RAZORPAY_API_BASE_URL': razorpay_url,
+        'RAZORPAY_POOL_SIZE': str(args.concurrency),
+        'ASYNC_MODE': args.async_mode,
+        'PORT': str(args.port),
+        'WEB_CONCURRENCY': '1',
+        'PYTHONUNBUFFERED': '1'
+    })
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--pythonpath', BACKEND_DIR,
+                   '-c', os.path.join(BACKEND_DIR, 'gunicorn_config.py'), 'index:app']
+    else:
+        command = [sys.executable, os.path.join(BACKEND_DIR, 'index.py')]
+
+    log = open(os.path.join(workdir, 'backend.out'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited early, see {log.name}")
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError(f"Backend did not become healthy, see {log.name}")
+
+def run_checkouts(base_url, items, checkouts, concurrency):
+    def checkout(n):
+        item = items[n % len(items)]
+        body = {
+            'items': [{'id': item['id'], 'name': item['name'], 'price': item['price'], 'quantity': 1}],
+            'totalAmount': item['price'],
+            'customerName': f'Load {n}',
+            'customerPhone': '9999999999'
+        }
+        started = time.perf_counter()
+        try:
+            response = requests.post(f"{base_url}/api/orders", json=body,
+                                     headers={'x-tenant-id': MACHINE_ID}, timeout=60)
+            ok = response.status_code == 200 and response.json().get('success')
+        except requests.RequestException:
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(checkout, range(checkouts)))
+    return results, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent checkout load test against mocked upstreams')
+    parser.add_argument('--checkouts', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--supabase-latency-ms', type=float, default=30)
+    parser.add_argument('--razorpay-latency-ms', type=float, default=120)
+    parser.add_argument('--async-mode', choices=['gevent', 'threading'], default='gevent')
+    parser.add_argument('--server', choices=['python', 'gunicorn'], default='python')
+    parser.add_argument('--port', type=int, default=5199)
+    args = parser.parse_args()
+
+    supabase = start_mock_supabase(latency_ms=args.supabase_latency_ms)
+    razorpay = start_mock_razorpay(latency_ms=args.razorpay_latency_ms)
+    items = supabase.state.seed_inventory(MACHINE_ID, count=10, quantity=args.checkouts)
+
+    workdir = tempfile.mkdtemp(prefix='checkout-load-')
+    process, base_url = start_backend(
+        args,
+        f"http://127.0.0.1:{supabase.server_address[1]}",
+        f"http://127.0.0.1:{razorpay.server_address[1]}/v1",
+        workdir
+    )
+    try:
+        results, elapsed = run_checkouts(base_url, items, args.checkouts, args.concurrency)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    latencies = sorted(ms for _, ms in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    # Upstream time per checkout: reserve RPC, then order + QR in parallel
+    floor_ms = args.supabase_latency_ms + args.razorpay_latency_ms
+    report = {
+        'server': args.server,
+        'async_mode': args.async_mode,
+        'checkouts': args.checkouts,
+        'concurrency': args.concurrency,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 2),
+        'checkouts_per_s': round(args.checkouts / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies), 1),
+        'p95_ms': round(percentile(latencies, 95), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'upstream_floor_ms': floor_ms,
+        'serial_checkouts_per_s': round(1000 / floor_ms, 1),
+        'backend_log': os.path.join(workdir, 'backend.out')
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
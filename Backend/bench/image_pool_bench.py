@@ -0,0 +1,102 @@
+"""
+Image pool benchmark: how much concurrent image processing stalls the
+other greenlets of a gevent worker, inline vs in the image worker pool.
+
+A ticker greenlet stands in for checkout requests: it sleeps 10 ms in a
+loop and records how late it wakes up. Meanwhile several greenlets process
+product photos, either in the request worker (IMAGE_WORKERS=0) or through
+the process pool.
+
+Usage:
+  python bench/image_pool_bench.py --uploads 16 --workers 2
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import gevent
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from image_workers import ImageWorkerPool, ImagePoolSaturated
+
+def sample_photo(seed):
+    """A 3000x2000 JPEG of noise: expensive to decode and encode, like a phone photo"""
+    img = Image.effect_noise((1500, 1000), 40 + seed).convert('RGB').resize((3000, 2000))
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def run(pool, photos, concurrency):
+    lags = []
+    done = []
+
+    def ticker():
+        while len(done) < len(photos):
+            started = time.perf_counter()
+            gevent.sleep(0.01)
+            lags.append((time.perf_counter() - started - 0.01) * 1000)
+
+    def upload(photo):
+        while True:
+            try:
+                pool.process_image(photo)
+                break
+            except ImagePoolSaturated:
+                gevent.sleep(0.05)  # what a client does after a 429
+        done.append(1)
+
+    started = time.perf_counter()
+    tick = gevent.spawn(ticker)
+    queue = list(photos)
+    jobs = []
+    for _ in range(concurrency):
+        def worker():
+            while queue:
+                upload(queue.pop())
+        jobs.append(gevent.spawn(worker))
+    gevent.joinall(jobs)
+    tick.join()
+    elapsed = time.perf_counter() - started
+
+    lags.sort()
+    return {
+        'workers': pool.workers,
+        'uploads': len(photos),
+        'elapsed_s': round(elapsed, 2),
+        'uploads_per_s': round(len(photos) / elapsed, 1),
+        'loop_lag_p50_ms': round(statistics.median(lags), 1),
+        'loop_lag_p99_ms': round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 1),
+        'loop_lag_max_ms': round(lags[-1], 1),
+        'rejected': pool.stats()['rejected']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Event loop stalls from image processing, inline vs process pool')
+    parser.add_argument('--uploads', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue-size', type=int, default=4)
+    args = parser.parse_args()
+
+    photos = [sample_photo(n) for n in range(args.uploads)]
+    inline = ImageWorkerPool(workers=0, max_pending=args.concurrency)
+    pooled = ImageWorkerPool(workers=args.workers, max_pending=args.workers + args.queue_size)
+    pooled.process_image(photos[0])  # start the worker processes outside the measurement
+
+    print(json.dumps({'inline': run(inline, photos, args.concurrency),
+                      'pool': run(pooled, photos, args.concurrency)}, indent=2))
+    pooled.shutdown()
+
+if __name__ == '__main__':
+    main()
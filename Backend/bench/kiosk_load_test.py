@@ -0,0 +1,267 @@
+"""
+Kiosk traffic benchmark: boots one backend worker against the mock Supabase
+(PostgREST + storage) and mock Razorpay servers and runs ``--kiosks``
+simulated kiosks at once, each looping through customer sessions:
+
+  browse   GET  /api/inventory                 (--browse-reads per session)
+  checkout POST /api/orders
+  poll     POST /api/verify-payment            (--polls, --poll-interval apart)
+  then either the customer pays (--pay-rate): the mock QR code is marked paid
+  and a signed qr_code.credited webhook is sent, followed by one last poll;
+  or the customer walks away: POST /api/orders/<id>/cancel
+
+Reports throughput, error rate and p50/p95/p99 latency per endpoint and saves
+them as JSON (with the git commit) so runs can be compared across commits.
+
+Usage:
+  python bench/kiosk_load_test.py --kiosks 50 --duration 60
+  python bench/kiosk_load_test.py --supabase-latency-ms 80 --razorpay-latency-ms 300 --error-rate 0.01
+  python bench/kiosk_load_test.py --output before.json   # then check out another commit ...
+  python bench/kiosk_load_test.py --output after.json
+  python bench/kiosk_load_test.py --compare before.json after.json
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.checkout_load_test import start_backend, percentile
+from bench.mock_razorpay import start_mock_razorpay
+from bench.mock_supabase import start_mock_supabase
+from bench.replay_webhooks import WEBHOOK_SECRET, credited_webhook
+
+ENDPOINTS = ('inventory', 'create_order', 'verify_payment', 'webhook', 'cancel_order')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+class Recorder:
+    """Latency and status of every request, per endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {name: [] for name in ENDPOINTS}
+
+    def call(self, name, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, url, timeout=60, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._samples[name].append((elapsed_ms, status))
+        return response if status is not None and status < 400 else None
+
+    def report(self, elapsed):
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        endpoints = {}
+        for name, values in samples.items():
+            if not values:
+                continue
+            latencies = sorted(ms for ms, _ in values)
+            errors = sum(1 for _, status in values if status is None or status >= 400)
+            endpoints[name] = {
+                'requests': len(values),
+                'per_s': round(len(values) / elapsed, 1),
+                'errors': errors,
+                'error_rate': round(errors / len(values), 4),
+                'mean_ms': round(statistics.mean(latencies), 1),
+                'p50_ms': round(statistics.median(latencies), 1),
+                'p95_ms': round(percentile(latencies, 95), 1),
+                'p99_ms': round(percentile(latencies, 99), 1),
+                'max_ms': round(latencies[-1], 1),
+                'statuses': dict(Counter(str(status) for _, status in values))
+            }
+        return endpoints
+
+def run_kiosk(kiosk, args, base_url, razorpay_url, machine_id, recorder, deadline, sessions):
+    """Customer sessions on one kiosk until ``deadline``"""
+    rng = random.Random(args.seed * 1000 + kiosk)
+    headers = {'x-tenant-id': machine_id}
+    while time.time() < deadline:
+        inventory = []
+        for _ in range(args.browse_reads):
+            response = recorder.call('inventory', 'GET', f"{base_url}/api/inventory", headers=headers)
+            if response is not None:
+                inventory = response.json()
+                inventory = inventory.get('inventory', inventory) if isinstance(inventory, dict) else inventory
+        items = [item for item in inventory if (item.get('available', item.get('quantity')) or 0) > 0]
+        if not items:
+            time.sleep(args.poll_interval)
+            continue
+
+        cart = rng.sample(items, min(len(items), rng.randint(1, 3)))
+        body = {
+            'items': [{'id': item['id'], 'name': item['name'], 'price': item['price'], 'quantity': 1} for item in cart],
+            'totalAmount': sum(item['price'] for item in cart),
+            'customerName': f'Kiosk {kiosk}',
+            'customerPhone': '9999999999'
+        }
+        response = recorder.call('create_order', 'POST', f"{base_url}/api/orders", json=body, headers=headers)
+        order = response.json() if response is not None else {}
+        if not order.get('success'):
+            continue
+        order_id, qr_code_id = order['orderId'], order['qrCodeId']
+        poll = {'qrCodeId': qr_code_id, 'orderId': order_id}
+
+        for _ in range(args.polls):
+            time.sleep(args.poll_interval)
+            recorder.call('verify_payment', 'POST', f"{base_url}/api/verify-payment", json=poll, headers=headers)
+
+        if rng.random() < args.pay_rate:
+            # The customer pays: Razorpay closes the QR code and sends the webhook
+            requests.post(f"{razorpay_url}/_mock/qr_codes/{qr_code_id}/pay", auth=('rzp_test_bench', 'bench_secret'),
+                          timeout=30)
+            payload = json.dumps(credited_webhook(order_id, machine_id, int(body['totalAmount'] * 100))).encode()
+            recorder.call('webhook', 'POST', f"{base_url}/razorpay-webhook", data=payload, headers={
+                'Content-Type': 'application/json',
+                'X-Razorpay-Signature': hmac.new(WEBHOOK_SECRET.encode(), payload, hashlib.sha256).hexdigest(),
+                'X-Razorpay-Event-Id': f'evt_{uuid.uuid4().hex[:14]}'
+            })
+            recorder.call('verify_payment', 'POST', f"{base_url}/api/verify-payment", json=poll, headers=headers)
+        else:
+            recorder.call('cancel_order', 'POST', f"{base_url}/api/orders/{order_id}/cancel", headers=headers)
+        sessions[kiosk] += 1
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(base_path, new_path):
+    """Print per-endpoint changes between two saved runs"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{base['commit']} -> {new['commit']}")
+    print(f"{'endpoint':<16}{'metric':<8}{'before':>10}{'after':>10}{'change':>9}")
+    for name in ENDPOINTS + ('total',):
+        before = base['total'] if name == 'total' else base['endpoints'].get(name)
+        after = new['total'] if name == 'total' else new['endpoints'].get(name)
+        if not before or not after:
+            continue
+        for metric in ('per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            if metric not in before:
+                continue
+            old, current = before[metric], after[metric]
+            change = f"{(current - old) / old * 100:+.1f}%" if old else '-'
+            print(f"{name:<16}{metric:<8}{old:>10}{current:>10}{change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Mixed kiosk traffic benchmark against mocked upstreams')
+    parser.add_argument('--kiosks', type=int, default=20, help='kiosks running sessions at once')
+    parser.add_argument('--machines', type=int, default=5, help='tenants the kiosks are spread over')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--browse-reads', type=int, default=2)
+    parser.add_argument('--polls', type=int, default=3)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--pay-rate', type=float, default=0.7, help='share of orders paid; the rest are cancelled')
+    parser.add_argument('--supabase-latency-ms', type=float, default=30)
+    parser.add_argument('--razorpay-latency-ms', type=float, default=120)
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls answered with 503')
+    parser.add_argument('--async-mode', choices=['gevent', 'threading'], default='gevent')
+    parser.add_argument('--server', choices=['python', 'gunicorn'], default='python')
+    parser.add_argument('--port', type=int, default=5197)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help=f'JSON report path (default {RESULTS_DIR}/kiosk-<commit>-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two saved reports and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+
+    supabase = start_mock_supabase(latency_ms=args.supabase_latency_ms, jitter_ms=args.jitter_ms,
+                                   error_rate=args.error_rate)
+    razorpay = start_mock_razorpay(latency_ms=args.razorpay_latency_ms, jitter_ms=args.jitter_ms,
+                                   error_rate=args.error_rate)
+    machines = [f'VM-{n + 1:03d}' for n in range(args.machines)]
+    for machine_id in machines:
+        supabase.state.seed_inventory(machine_id, count=10, quantity=100000)
+    razorpay_url = f"http://127.0.0.1:{razorpay.server_address[1]}/v1"
+
+    os.environ.update({
+        'RAZORPAY_WEBHOOK_SECRET': WEBHOOK_SECRET,
+        'SUPABASE_POOL_SIZE': str(max(4, args.kiosks // 5)),
+        'IMAGE_WORKERS': '0'
+    })
+    args.concurrency = args.kiosks  # Razorpay connection pool size in start_backend
+    workdir = tempfile.mkdtemp(prefix='kiosk-load-')
+    process, base_url = start_backend(args, f"http://127.0.0.1:{supabase.server_address[1]}", razorpay_url, workdir)
+
+    recorder = Recorder()
+    sessions = [0] * args.kiosks
+    try:
+        started = time.perf_counter()
+        deadline = time.time() + args.duration
+        with ThreadPoolExecutor(max_workers=args.kiosks) as pool:
+            futures = [pool.submit(run_kiosk, kiosk, args, base_url, razorpay_url, machines[kiosk % len(machines)],
+                                   recorder, deadline, sessions) for kiosk in range(args.kiosks)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    endpoints = recorder.report(elapsed)
+    total_requests = sum(entry['requests'] for entry in endpoints.values())
+    total_errors = sum(entry['errors'] for entry in endpoints.values())
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'elapsed_s': round(elapsed, 2),
+        'sessions': sum(sessions),
+        'total': {
+            'requests': total_requests,
+            'per_s': round(total_requests / elapsed, 1),
+            'errors': total_errors,
+            'error_rate': round(total_errors / total_requests, 4) if total_requests else 0
+        },
+        'endpoints': endpoints,
+        'upstream_requests': {'supabase': supabase.state.requests, 'razorpay': razorpay.state.requests},
+        'backend_log': os.path.join(workdir, 'backend.out')
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"kiosk-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'endpoint':<16}{'req':>7}{'req/s':>8}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, entry in endpoints.items():
+        print(f"{name:<16}{entry['requests']:>7}{entry['per_s']:>8}{entry['error_rate'] * 100:>7.2f}"
+              f"{entry['p50_ms']:>9}{entry['p95_ms']:>9}{entry['p99_ms']:>9}")
+    print(f"{sum(sessions)} sessions, {total_requests} requests in {elapsed:.1f}s -> {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Logging overhead benchmark: per-request cost of the backend's logging on
+hot paths, measured in-process with Flask's test client so network time
+does not hide it.
+
+Runs a tenant-checked GET (/api/machine/status/<id>) and full checkouts
+(POST /api/orders) against zero-latency mock Supabase and Razorpay servers,
+and reports request times and how much log output they produced.
+
+Usage:
+  python bench/logging_overhead_bench.py
+  # before/after: run another checkout of the backend with the same workload
+  git worktree add /tmp/backend-before HEAD~1
+  python bench/logging_overhead_bench.py --compare /tmp/backend-before/Backend
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+def summarize(samples_s):
+    samples = sorted(s * 1000 for s in samples_s)
+    return {
+        'mean_ms': round(statistics.mean(samples), 3),
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3)
+    }
+
+def child(args):
+    """Import the backend in ``args.backend_dir`` and time requests through its app"""
+    sys.path.insert(0, args.backend_dir)
+    import index
+
+    client = index.app.test_client()
+    headers = {'X-Tenant-ID': args.machine_id}
+    items = json.loads(args.items)
+
+    def timed(call, count):
+        samples = []
+        for n in range(count):
+            started = time.perf_counter()
+            response = call(n)
+            samples.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return samples
+
+    status = lambda n: client.get(f'/api/machine/status/{args.machine_id}', headers=headers)
+    checkout = lambda n: client.post('/api/orders', headers=headers, json={
+        'items': [{**items[n % len(items)], 'quantity': 1}],
+        'totalAmount': items[n % len(items)]['price'],
+        'customerName': 'Bench', 'customerPhone': '9999999999'
+    })
+    timed(status, 50)
+    timed(checkout, 10)
+    report = {'status': summarize(timed(status, args.requests)), 'checkout': summarize(timed(checkout, args.checkouts))}
+    if hasattr(sys.modules.get('logging_setup'), 'stop_logging'):
+        sys.modules['logging_setup'].stop_logging()
+    print(json.dumps(report))
+
+def run_backend(backend_dir, args, supabase_url, razorpay_url, items):
+    workdir = tempfile.mkdtemp(prefix='logging-bench-')
+    env = dict(os.environ)
+    env.update({
+        'SUPABASE_URL': supabase_url,
+        'SUPABASE_KEY': 'bench-key-' + 'x' * 30,
+        'RAZORPAY_KEY_ID': 'rzp_test_bench',
+        'RAZORPAY_KEY_SECRET': 'bench_secret',
+        'RAZORPAY_API_BASE_URL': razorpay_url,
+        'ASYNC_MODE': args.async_mode,
+        'IMAGE_WORKERS': '0',
+        'PYTHONPATH': backend_dir
+    })
+    with open(os.path.join(workdir, 'console.out'), 'w') as console:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--backend-dir', backend_dir,
+             '--requests', str(args.requests), '--checkouts', str(args.checkouts),
+             '--machine-id', args.machine_id, '--items', json.dumps(items)],
+            cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=console, text=True, check=True
+        ).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+    log_files = {name: os.path.getsize(os.path.join(workdir, name))
+                 for name in os.listdir(workdir) if name.endswith('.log')}
+    report.update(backend_dir=backend_dir, log_file_bytes=log_files,
+                  console_bytes=os.path.getsize(os.path.join(workdir, 'console.out')))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-request logging overhead on hot paths')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--checkouts', type=int, default=300)
+    parser.add_argument('--async-mode', choices=['gevent', 'threading'], default='gevent')
+    parser.add_argument('--compare', help='Another Backend directory to run the same workload against')
+    parser.add_argument('--machine-id', default='VM-001')
+    parser.add_argument('--backend-dir', default=BACKEND_DIR)
+    parser.add_argument('--items', help=argparse.SUPPRESS)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args)
+
+    from bench.mock_supabase import start_mock_supabase
+    from bench.mock_razorpay import start_mock_razorpay
+    supabase = start_mock_supabase()
+    razorpay = start_mock_razorpay()
+    supabase_url = f"http://127.0.0.1:{supabase.server_address[1]}"
+    razorpay_url = f"http://127.0.0.1:{razorpay.server_address[1]}/v1"
+
+    results = {}
+    for name, backend_dir in (('current', BACKEND_DIR), ('compare', args.compare)):
+        if not backend_dir:
+            continue
+        items = supabase.state.seed_inventory(args.machine_id, count=5, quantity=args.checkouts * 10)
+        items = [{'id': item['id'], 'name': item['name'], 'price': item['price']} for item in items]
+        results[name] = run_backend(os.path.abspath(backend_dir), args, supabase_url, razorpay_url, items)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
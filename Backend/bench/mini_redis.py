@@ -0,0 +1,275 @@
+"""
+Tiny Redis-compatible server for running several backend workers locally
+without installing Redis. Supports just what the backend uses: the
+Socket.IO message queue (PUBLISH/SUBSCRIBE) and the machine presence
+registry (strings, hashes and sorted sets). Data lives in memory only.
+
+Usage:
+  python bench/mini_redis.py --port 6390
+
+Then start each worker with SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6390/0
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+class SortedSet(dict):
+    """member -> score"""
+
+def _score(raw):
+    raw = raw.decode() if isinstance(raw, bytes) else raw
+    if raw.startswith('('):
+        raise ValueError('exclusive ranges are not supported')
+    return float(raw)  # also parses -inf/+inf
+
+class MiniRedisState:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}      # key -> bytes, dict (hash) or SortedSet
+        self.expires = {}   # key -> monotonic deadline
+        self.channels = {}  # channel -> set of handlers
+
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+class MiniRedisHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscriptions = set()
+        self.transaction = None  # queued commands between MULTI and EXEC
+
+    @property
+    def state(self) -> MiniRedisState:
+        return self.server.state
+
+    # RESP encoding
+    def _encode(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, bool):
+            return b':%d\r\n' % int(value)
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, Exception):
+            return b'-ERR ' + str(value).encode() + b'\r\n'
+        if isinstance(value, str):
+            return b'+' + value.encode() + b'\r\n'
+        if isinstance(value, (list, tuple)):
+            return b'*%d\r\n' % len(value) + b''.join(self._encode(v) for v in value)
+        return b'$%d\r\n' % len(value) + value + b'\r\n'
+
+    def send(self, value):
+        with self.write_lock:
+            self.wfile.write(self._encode(value))
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.strip().split()  # inline command (redis-cli, telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        try:
+            while True:
+                args = self._read_command()
+                if args is None:
+                    break
+                if not args:
+                    continue
+                command = args[0].upper().decode()
+                if command == 'MULTI':
+                    self.transaction = []
+                    reply = 'OK'
+                elif command == 'EXEC' and self.transaction is not None:
+                    queued, self.transaction = self.transaction, None
+                    with self.state.lock:  # no other client runs in between
+                        reply = [self._run(queued_command, queued_args) for queued_command, queued_args in queued]
+                elif command == 'DISCARD' and self.transaction is not None:
+                    self.transaction = None
+                    reply = 'OK'
+                elif self.transaction is not None:
+                    self.transaction.append((command, args[1:]))
+                    reply = 'QUEUED'
+                else:
+                    reply = self._run(command, args[1:])
+                if reply is not NO_REPLY:
+                    self.send(reply)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.state.lock:
+                for channel in self.subscriptions:
+                    self.state.channels.get(channel, set()).discard(self)
+
+    def _run(self, command, args):
+        try:
+            return self.dispatch(command, args)
+        except Exception as e:
+            return e
+
+    def dispatch(self, command, args):
+        state = self.state
+        if command == 'PING':
+            if self.subscriptions:
+                return [b'pong', args[0] if args else b'']
+            return args[0] if args else 'PONG'
+        if command in ('CLIENT', 'SELECT', 'READONLY'):
+            return 'OK'
+        if command == 'ECHO':
+            return args[0]
+        if command == 'QUIT':
+            self.send('OK')
+            raise ConnectionError()
+
+        if command == 'PUBLISH':
+            channel, message = args
+            with state.lock:
+                receivers = list(state.channels.get(channel, ()))
+            delivered = 0
+            for handler in receivers:
+                try:
+                    handler.send([b'message', channel, message])
+                    delivered += 1
+                except OSError:
+                    pass
+            return delivered
+        if command == 'SUBSCRIBE':
+            for channel in args:
+                with state.lock:
+                    state.channels.setdefault(channel, set()).add(self)
+                self.subscriptions.add(channel)
+                self.send([b'subscribe', channel, len(self.subscriptions)])
+            return NO_REPLY
+        if command == 'UNSUBSCRIBE':
+            for channel in args or list(self.subscriptions):
+                with state.lock:
+                    state.channels.get(channel, set()).discard(self)
+                self.subscriptions.discard(channel)
+                self.send([b'unsubscribe', channel, len(self.subscriptions)])
+            return NO_REPLY
+
+        with state.lock:
+            if command == 'GET':
+                return state.data.get(args[0]) if state._alive(args[0]) else None
+            if command == 'SET':
+                options = [a.upper() for a in args[2:]]
+                if b'NX' in options and state._alive(args[0]):
+                    return None
+                state.data[args[0]] = args[1]
+                state.expires.pop(args[0], None)
+                if b'EX' in options:
+                    state.expires[args[0]] = time.monotonic() + int(args[2 + options.index(b'EX') + 1])
+                return 'OK'
+            if command == 'DEL':
+                return sum(1 for key in args if state._alive(key) and state.data.pop(key, None) is not None)
+            if command == 'EXISTS':
+                return sum(1 for key in args if state._alive(key))
+            if command == 'EXPIRE':
+                if not state._alive(args[0]):
+                    return 0
+                state.expires[args[0]] = time.monotonic() + int(args[1])
+                return 1
+            if command == 'INCR':
+                value = int(state.data.get(args[0], b'0')) + 1 if state._alive(args[0]) else 1
+                state.data[args[0]] = str(value).encode()
+                return value
+
+            if command in ('HSET', 'HGET', 'HDEL', 'HGETALL', 'HKEYS', 'HLEN'):
+                table = state.data.get(args[0]) if state._alive(args[0]) else None
+                if table is not None and type(table) is not dict:
+                    return Exception(WRONGTYPE)
+                if command == 'HSET':
+                    table = state.data.setdefault(args[0], {})
+                    added = 0
+                    for field, value in zip(args[1::2], args[2::2]):
+                        added += field not in table
+                        table[field] = value
+                    return added
+                table = table or {}
+                if command == 'HGET':
+                    return table.get(args[1])
+                if command == 'HDEL':
+                    removed = sum(1 for field in args[1:] if table.pop(field, None) is not None)
+                    if not table:
+                        state.data.pop(args[0], None)
+                    return removed
+                if command == 'HGETALL':
+                    return [item for pair in table.items() for item in pair]
+                if command == 'HKEYS':
+                    return list(table.keys())
+                return len(table)
+
+            if command in ('ZADD', 'ZREM', 'ZSCORE', 'ZCARD', 'ZRANGEBYSCORE'):
+                zset = state.data.get(args[0]) if state._alive(args[0]) else None
+                if zset is not None and not isinstance(zset, SortedSet):
+                    return Exception(WRONGTYPE)
+                if command == 'ZADD':
+                    zset = state.data.setdefault(args[0], SortedSet())
+                    added = 0
+                    for score, member in zip(args[1::2], args[2::2]):
+                        added += member not in zset
+                        zset[member] = _score(score)
+                    return added
+                zset = zset or SortedSet()
+                if command == 'ZREM':
+                    removed = sum(1 for member in args[1:] if zset.pop(member, None) is not None)
+                    if not zset:
+                        state.data.pop(args[0], None)
+                    return removed
+                if command == 'ZSCORE':
+                    score = zset.get(args[1])
+                    return None if score is None else repr(score).encode()
+                if command == 'ZCARD':
+                    return len(zset)
+                low, high = _score(args[1]), _score(args[2])
+                return [member for member, score in sorted(zset.items(), key=lambda kv: (kv[1], kv[0]))
+                        if low <= score <= high]
+
+        return Exception(f"unknown command '{command}'")
+
+NO_REPLY = object()
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+class MiniRedisServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, MiniRedisHandler)
+        self.state = MiniRedisState()
+
+def start_mini_redis(host='127.0.0.1', port=0):
+    """Start the server in a background thread; returns it (``server.server_address`` has the port)"""
+    server = MiniRedisServer((host, port))
+    threading.Thread(target=server.serve_forever, name='mini-redis', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Minimal Redis stand-in (pub/sub, strings, hashes)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    server = MiniRedisServer((args.host, args.port))
+    print(f"🧪 Mini Redis listening on redis://{args.host}:{args.port}/0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Mini Redis stopped")
+
+if __name__ == '__main__':
+    main()
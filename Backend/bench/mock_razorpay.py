@@ -0,0 +1,204 @@
+"""
+Local stand-in for the Razorpay REST API, for tests and load benchmarks.
+
+Implements the endpoints the backend uses:
+  POST /v1/orders
+  POST /v1/payments/qr_codes
+  GET  /v1/payments/qr_codes/<id>
+  GET  /v1/payments
+plus POST /v1/_mock/qr_codes/<id>/pay to mark a QR code as paid.
+
+Usage:
+  python bench/mock_razorpay.py --port 9100 --latency-ms 150 --error-rate 0.05
+
+Then start the backend with RAZORPAY_API_BASE_URL=http://127.0.0.1:9100/v1
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QR_CODE_PATH = re.compile(r'^/v1/payments/qr_codes/([\w-]+)$')
+PAY_PATH = re.compile(r'^/v1/_mock/qr_codes/([\w-]+)/pay$')
+
+class MockRazorpayState:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.qr_codes = {}
+        self.requests = 0
+
+class MockRazorpayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    server_version = 'MockRazorpay/1.0'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this Nagle's
+        # algorithm adds a delayed-ACK stall to every keep-alive response
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> MockRazorpayState:
+        return self.server.state
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _authorized(self):
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('Basic '):
+            return False
+        key_id, _, secret = base64.b64decode(auth[6:]).decode().partition(':')
+        return bool(key_id and secret)
+
+    def _simulate(self):
+        """Apply configured latency and failure injection; True if the request should fail"""
+        with self.state.lock:
+            self.state.requests += 1
+        delay = self.state.latency_ms + random.uniform(0, self.state.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        return random.random() < self.state.error_rate
+
+    def _error(self, status, description):
+        self._send(status, {'error': {'code': 'BAD_REQUEST_ERROR' if status < 500 else 'SERVER_ERROR',
+                                      'description': description}})
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._error(401, 'Authentication failed')
+        if self._simulate():
+            return self._error(503, 'Injected failure')
+
+        match = QR_CODE_PATH.match(self.path)
+        if match:
+            with self.state.lock:
+                qr_code = self.state.qr_codes.get(match.group(1))
+            if qr_code is None:
+                return self._error(400, 'The id provided does not exist')
+            return self._send(200, qr_code)
+
+        if self.path.split('?')[0] == '/v1/payments':
+            return self._send(200, {'entity': 'collection', 'count': 0, 'items': []})
+
+        self._error(404, 'The requested URL was not found on the server.')
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._error(401, 'Authentication failed')
+
+        match = PAY_PATH.match(self.path)
+        if match:
+            with self.state.lock:
+                qr_code = self.state.qr_codes.get(match.group(1))
+                if qr_code is None:
+                    return self._error(400, 'The id provided does not exist')
+                qr_code['status'] = 'closed'
+                qr_code['close_reason'] = 'paid'
+                qr_code['payments_amount_received'] = qr_code['payment_amount']
+                qr_code['payments_count_received'] = 1
+            return self._send(200, qr_code)
+
+        body = self._read_json()
+        if self._simulate():
+            return self._error(503, 'Injected failure')
+        now = int(time.time())
+
+        if self.path == '/v1/orders':
+            order = {
+                'id': f"order_{uuid.uuid4().hex[:14]}",
+                'entity': 'order',
+                'amount': body.get('amount'),
+                'amount_paid': 0,
+                'amount_due': body.get('amount'),
+                'currency': body.get('currency', 'INR'),
+                'receipt': body.get('receipt'),
+                'status': 'created',
+                'attempts': 0,
+                'notes': body.get('notes', []),
+                'created_at': now
+            }
+            with self.state.lock:
+                self.state.orders[order['id']] = order
+            return self._send(200, order)
+
+        if self.path == '/v1/payments/qr_codes':
+            qr_id = f"qr_{uuid.uuid4().hex[:14]}"
+            qr_code = {
+                'id': qr_id,
+                'entity': 'qr_code',
+                'created_at': now,
+                'name': body.get('name'),
+                'usage': body.get('usage'),
+                'type': body.get('type'),
+                'image_url': f"https://rzp.io/i/{qr_id[3:11]}",
+                'payment_amount': body.get('payment_amount'),
+                'status': 'active',
+                'description': body.get('description'),
+                'fixed_amount': body.get('fixed_amount'),
+                'payments_amount_received': 0,
+                'payments_count_received': 0,
+                'notes': body.get('notes', {}),
+                'close_by': body.get('close_by'),
+                'closed_at': None,
+                'close_reason': None
+            }
+            with self.state.lock:
+                self.state.qr_codes[qr_id] = qr_code
+            return self._send(200, qr_code)
+
+        self._error(404, 'The requested URL was not found on the server.')
+
+def start_mock_razorpay(host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    """Start the mock in a background thread; returns the server (``server.server_address`` has the port)"""
+    server = ThreadingHTTPServer((host, port), MockRazorpayHandler)
+    server.daemon_threads = True
+    server.state = MockRazorpayState(latency_ms, jitter_ms, error_rate)
+    threading.Thread(target=server.serve_forever, name='mock-razorpay', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Razorpay API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra random latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), MockRazorpayHandler)
+    server.daemon_threads = True
+    server.state = MockRazorpayState(args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"🧪 Mock Razorpay listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Mock Razorpay stopped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,511 @@
+"""
+In-memory stand-in for the Supabase REST API (PostgREST tables and RPCs),
+for load tests and benchmarks that should not touch a real project.
+
+Implements the subset the backend uses:
+  GET/HEAD/POST/PATCH/DELETE /rest/v1/<table>  (eq/neq/gt/gte/lt/lte/in/is
+                                                filters, order, limit, offset,
+                                                Prefer: count=exact and
+                                                resolution=merge/ignore-duplicates)
+  POST /rest/v1/rpc/<function>                  (checkout, cancel, expiry, webhook RPCs)
+  POST /storage/v1/object/list/<bucket>         (prefix, limit, offset, search)
+  POST /storage/v1/object/<bucket>/<path>       (multipart upload, x-upsert)
+  DELETE /storage/v1/object/<bucket>            ({"prefixes": [...]})
+  GET  /storage/v1/object/public/<bucket>/<path>
+
+Usage:
+  python bench/mock_supabase.py --port 9200 --latency-ms 20
+
+Then start the backend with SUPABASE_URL=http://127.0.0.1:9200 and any
+JWT-shaped SUPABASE_KEY (e.g. mock.mock.mock).
+"""
+
+import argparse
+import json
+from email.parser import BytesParser
+from email.policy import HTTP
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+MOCK_SUPABASE_KEY = 'mock.mock.mock'
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def _iso(value):
+    return value.isoformat()
+
+class MockSupabaseState:
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        # One lock for everything: RPCs are transactions
+        self.lock = threading.RLock()
+        self.tables = {'inventory': [], 'orders': [], 'inventory_reservations': [], 'scheduler_leases': [],
+                       'webhook_dead_letters': [], 'webhook_events': []}
+        # Storage buckets: path -> {'data', 'content_type', 'id', 'created_at'}
+        self.buckets = {'product-images': {}}
+        self.requests = 0
+
+    def seed_inventory(self, machine_id, count=10, quantity=1000):
+        """Add ``count`` products with ``quantity`` units each; returns them"""
+        items = []
+        with self.lock:
+            for slot in range(count):
+                item = {
+                    'id': str(uuid.uuid4()),
+                    'machine_id': machine_id,
+                    'name': f'Product {slot + 1}',
+                    'price': 10 + slot,
+                    'quantity': quantity,
+                    'reserved_quantity': 0,
+                    'category': 'Snacks',
+                    'slot': f'A{slot + 1}',
+                    'image': '/product_img/download.png',
+                    'description': '',
+                    'created_at': _iso(_now()),
+                    'updated_at': _iso(_now())
+                }
+                self.tables['inventory'].append(item)
+                items.append(dict(item))
+        return items
+
+    # RPCs (same contracts as the SQL functions in the *_migration.sql files)
+    def _find(self, table, **match):
+        return [row for row in self.tables[table] if all(row.get(k) == v for k, v in match.items())]
+
+    def _order_deltas(self, items):
+        deltas = {}
+        for line in items or []:
+            if line.get('id') is not None:
+                deltas[str(line['id'])] = deltas.get(str(line['id']), 0) + int(line.get('quantity') or 0)
+        return {item_id: qty for item_id, qty in deltas.items() if qty > 0}
+
+    def rpc_create_order_with_reservation(self, p_order, p_hold_seconds=180):
+        machine_id = p_order.get('machine_id')
+        deltas = self._order_deltas(p_order.get('items'))
+        stock = {str(row['id']): row for row in self._find('inventory', machine_id=machine_id)}
+        unavailable = [
+            {'id': item_id, 'requested': qty, 'available': stock[item_id]['quantity'] if item_id in stock else 0}
+            for item_id, qty in deltas.items()
+            if item_id not in stock or stock[item_id]['quantity'] < qty
+        ]
+        if unavailable:
+            return {'success': False, 'unavailable': unavailable}
+        if self._find('orders', order_id=p_order.get('order_id')):
+            raise MockError(409, '23505', 'duplicate key value violates unique constraint "orders_pkey"')
+
+        now = _now()
+        expires_at = _iso(now + timedelta(seconds=p_hold_seconds))
+        changed = []
+        for item_id, qty in deltas.items():
+            row = stock[item_id]
+            row['quantity'] -= qty
+            row['reserved_quantity'] = row.get('reserved_quantity', 0) + qty
+            row['updated_at'] = _iso(now)
+            changed.append({'id': row['id'], 'quantity': row['quantity'], 'reserved_quantity': row['reserved_quantity']})
+            self.tables['inventory_reservations'].append({
+                'order_id': p_order.get('order_id'), 'machine_id': machine_id, 'item_id': item_id,
+                'quantity': qty, 'status': 'held', 'expires_at': expires_at
+            })
+
+        order = {
+            'order_id': p_order.get('order_id'),
+            'machine_id': machine_id,
+            'items': p_order.get('items') or [],
+            'total_amount': float(p_order.get('total_amount') or 0),
+            'payment_status': 'pending',
+            'customer_name': p_order.get('customer_name'),
+            'customer_phone': p_order.get('customer_phone'),
+            'created_at': _iso(now),
+            'updated_at': _iso(now),
+            'hold_expires_at': expires_at,
+            'rolled_up_at': None
+        }
+        self.tables['orders'].append(order)
+        return {'success': True, 'order': dict(order), 'expires_at': expires_at, 'inventory': changed}
+
+    def rpc_commit_order_reservation(self, p_order_id):
+        changed = []
+        for reservation in self._find('inventory_reservations', order_id=p_order_id):
+            if reservation['status'] not in ('held', 'released'):
+                continue
+            late = reservation['status'] == 'released'
+            reservation['status'] = 'committed'
+            for row in self._find('inventory', machine_id=reservation['machine_id']):
+                if str(row['id']) == reservation['item_id']:
+                    if late:
+                        row['quantity'] = max(row['quantity'] - reservation['quantity'], 0)
+                    else:
+                        row['reserved_quantity'] = max(row['reserved_quantity'] - reservation['quantity'], 0)
+                    changed.append({'id': row['id'], 'quantity': row['quantity'], 'reserved_quantity': row['reserved_quantity']})
+        return changed
+
+    def rpc_cancel_order_and_restore_inventory(self, p_machine_id, p_order_id):
+        orders = self._find('orders', machine_id=p_machine_id, order_id=p_order_id)
+        if not orders or orders[0]['payment_status'] != 'pending':
+            return {'found': bool(orders), 'cancelled': False,
+                    'status': orders[0]['payment_status'] if orders else None, 'restored': []}
+
+        orders[0]['payment_status'] = 'cancelled'
+        orders[0]['updated_at'] = _iso(_now())
+        restored = []
+        for reservation in self._find('inventory_reservations', order_id=p_order_id, status='held'):
+            reservation['status'] = 'released'
+            for row in self._find('inventory', machine_id=p_machine_id):
+                if str(row['id']) == reservation['item_id']:
+                    row['quantity'] += reservation['quantity']
+                    row['reserved_quantity'] = max(row['reserved_quantity'] - reservation['quantity'], 0)
+                    restored.append({'id': row['id'], 'quantity': row['quantity'],
+                                     'reserved_quantity': row['reserved_quantity'], 'delta': reservation['quantity']})
+        return {'found': True, 'cancelled': True, 'status': 'cancelled', 'restored': restored}
+
+    def rpc_cancel_orders_and_restore_inventory(self, p_orders):
+        return [
+            {'machine_id': entry.get('machine_id'), 'order_id': entry.get('order_id'),
+             **self.rpc_cancel_order_and_restore_inventory(entry.get('machine_id'), entry.get('order_id'))}
+            for entry in p_orders or []
+        ]
+
+    def rpc_try_acquire_scheduler_lease(self, p_name, p_holder, p_ttl_seconds):
+        now = _now()
+        leases = self._find('scheduler_leases', name=p_name)
+        if leases and leases[0]['holder'] != p_holder and leases[0]['expires_at'] > _iso(now):
+            return False
+        lease = {'name': p_name, 'holder': p_holder, 'expires_at': _iso(now + timedelta(seconds=p_ttl_seconds))}
+        if leases:
+            leases[0].update(lease)
+        else:
+            self.tables['scheduler_leases'].append(lease)
+        return True
+
+    def rpc_claim_webhook_events(self, p_limit, p_lease_seconds, p_max_claims):
+        now = _now()
+        claimed = []
+        for event in self._find('webhook_events', status='pending'):
+            claimed_until = event.get('claimed_until') or _iso(
+                datetime.fromisoformat(event['created_at']) + timedelta(seconds=p_lease_seconds))
+            if claimed_until >= _iso(now):
+                continue
+            if event['claims'] >= p_max_claims:
+                event.update(status='dead', last_error=f"Claimed {event['claims']} times without finishing")
+                continue
+            if len(claimed) < p_limit:
+                event.update(claims=event['claims'] + 1,
+                             claimed_until=_iso(now + timedelta(seconds=p_lease_seconds)))
+                claimed.append(dict(event))
+        return claimed
+
+    def rpc_apply_order_to_sales_rollups(self, p_order_id, p_timezone=None):
+        for order in self._find('orders', order_id=p_order_id, payment_status='paid'):
+            if not order.get('rolled_up_at'):
+                order['rolled_up_at'] = _iso(_now())
+                return True
+        return False
+
+class MockError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+OPERATORS = {
+    'eq': lambda a, b: a == b,
+    'neq': lambda a, b: a != b,
+    'gt': lambda a, b: a is not None and a > b,
+    'gte': lambda a, b: a is not None and a >= b,
+    'lt': lambda a, b: a is not None and a < b,
+    'lte': lambda a, b: a is not None and a <= b,
+}
+
+def _coerce(sample, value):
+    """Compare filter values with the column's type (everything arrives as text)"""
+    if isinstance(sample, bool):
+        return value == 'true'
+    if isinstance(sample, (int, float)):
+        try:
+            return type(sample)(value)
+        except ValueError:
+            return value
+    return value
+
+def _matches(row, column, expression):
+    operator, _, value = expression.partition('.')
+    current = row.get(column)
+    if operator == 'is':
+        return (current is None) if value == 'null' else (current == (value == 'true'))
+    if operator == 'in':
+        options = [v.strip('"') for v in value.strip('()').split(',')]
+        return str(current) in options
+    if operator not in OPERATORS:
+        raise MockError(400, 'PGRST100', f'unsupported operator {operator}')
+    if isinstance(current, (int, float)) or current is None:
+        value = _coerce(current, value)
+    else:
+        current = str(current)
+    return OPERATORS[operator](current, value)
+
+class MockSupabaseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockSupabase/1.0'
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> MockSupabaseState:
+        return self.server.state
+
+    def _send(self, status, body=None, headers=None):
+        payload = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(payload)
+
+    def _send_bytes(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _handle(self):
+        with self.state.lock:
+            self.state.requests += 1
+        # Always drain the body (postgrest-py sends {} with DELETE) so keep-alive requests stay framed
+        raw = self._read_body()
+        delay = self.state.latency_ms + random.uniform(0, self.state.jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        if random.random() < self.state.error_rate:
+            return self._send(503, {'message': 'Injected failure'})
+
+        url = urlsplit(self.path)
+        if url.path.startswith('/storage/v1/object/'):
+            return self._storage(url.path[len('/storage/v1/object/'):], raw)
+        if not url.path.startswith('/rest/v1/'):
+            return self._send(404, {'message': 'Not found'})
+        body = json.loads(raw) if raw else None
+        resource = url.path[len('/rest/v1/'):]
+        params = parse_qsl(url.query, keep_blank_values=True)
+
+        try:
+            if resource.startswith('rpc/'):
+                return self._rpc(resource[4:], body or {})
+            if resource not in self.state.tables:
+                raise MockError(404, '42P01', f'relation "public.{resource}" does not exist')
+            return self._table(resource, params, body)
+        except MockError as e:
+            return self._send(e.status, {'code': e.code, 'message': str(e), 'details': None, 'hint': None})
+
+    def _rpc(self, name, args):
+        function = getattr(self.state, f'rpc_{name}', None)
+        if function is None:
+            raise MockError(404, 'PGRST202', f'Could not find the function public.{name}')
+        with self.state.lock:
+            result = function(**args)
+        return self._send(200, result)
+
+    def _storage_error(self, status, error, message):
+        # storage3 raises StorageApiError(message, error, statusCode) from this body
+        return self._send(status, {'statusCode': str(status), 'error': error, 'message': message})
+
+    def _upload_part(self, raw):
+        """(data, content type) of the multipart 'file' field storage3 uploads"""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode() + raw)
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') == 'file':
+                return part.get_payload(decode=True), part.get_content_type()
+        return raw, self.headers.get('Content-Type', 'application/octet-stream')
+
+    def _storage(self, resource, raw):
+        state = self.state
+        public = resource.startswith('public/')
+        listing = resource.startswith('list/')
+        if public or listing:
+            resource = resource.split('/', 1)[1]
+        bucket_name, _, path = resource.partition('/')
+        with state.lock:
+            bucket = state.buckets.get(bucket_name)
+            if bucket is None:
+                return self._storage_error(404, 'Bucket not found', 'Bucket not found')
+
+            if listing and self.command == 'POST':
+                options = json.loads(raw) if raw else {}
+                prefix = (options.get('prefix') or '').strip('/')
+                search = options.get('search') or ''
+                entries = {}
+                for key, obj in bucket.items():
+                    if prefix and not key.startswith(prefix + '/'):
+                        continue
+                    name, _, rest = key[len(prefix) + 1 if prefix else 0:].partition('/')
+                    if search and search not in name:
+                        continue
+                    if rest:
+                        entries.setdefault(name, {'name': name, 'id': None, 'created_at': None,
+                                                  'updated_at': None, 'metadata': None})
+                    else:
+                        entries[name] = {'name': name, 'id': obj['id'], 'created_at': obj['created_at'],
+                                         'updated_at': obj['created_at'],
+                                         'metadata': {'size': len(obj['data']), 'mimetype': obj['content_type']}}
+                names = sorted(entries)
+                offset = int(options.get('offset') or 0)
+                limit = int(options.get('limit') or 100)
+                return self._send(200, [entries[name] for name in names[offset:offset + limit]])
+
+            if public and self.command in ('GET', 'HEAD'):
+                obj = bucket.get(path)
+                if obj is None:
+                    return self._storage_error(404, 'not_found', 'Object not found')
+                return self._send_bytes(obj['data'], obj['content_type'])
+
+            if self.command == 'POST' and path:
+                if path in bucket and self.headers.get('x-upsert') != 'true':
+                    return self._storage_error(409, 'Duplicate', 'The resource already exists')
+                data, content_type = self._upload_part(raw)
+                bucket[path] = {'data': data, 'content_type': content_type, 'id': str(uuid.uuid4()),
+                                'created_at': _iso(_now())}
+                return self._send(200, {'Key': f'{bucket_name}/{path}'})
+
+            if self.command == 'DELETE' and not path:
+                removed = []
+                for key in (json.loads(raw) if raw else {}).get('prefixes', []):
+                    obj = bucket.pop(key, None)
+                    if obj is not None:
+                        removed.append({'name': key, 'id': obj['id'], 'bucket_id': bucket_name})
+                return self._send(200, removed)
+
+        return self._send(404, {'message': 'Not found'})
+
+    def _filter(self, rows, params):
+        for column, expression in params:
+            if column in ('select', 'order', 'limit', 'offset', 'columns', 'on_conflict'):
+                continue
+            rows = [row for row in rows if _matches(row, column, expression)]
+        return rows
+
+    def _table(self, table, params, body):
+        state = self.state
+        options = dict(params)
+        prefer = self.headers.get('Prefer', '')
+        with state.lock:
+            rows = state.tables[table]
+
+            if self.command == 'POST':
+                new_rows = body if isinstance(body, list) else [body]
+                now = _iso(_now())
+                created = []
+                conflict_keys = (options.get('on_conflict') or 'id').split(',')
+                for row in new_rows:
+                    if 'resolution=' in prefer:
+                        existing = next((r for r in rows if all(
+                            k in row and str(r.get(k)) == str(row[k]) for k in conflict_keys)), None)
+                        if existing is not None:
+                            if 'resolution=merge-duplicates' in prefer:
+                                existing.update(row)
+                                created.append(dict(existing))
+                            continue
+                    row = {'created_at': now, 'updated_at': now, **row}
+                    if table == 'inventory':
+                        row.setdefault('id', str(uuid.uuid4()))
+                        row.setdefault('reserved_quantity', 0)
+                    elif table == 'webhook_events':
+                        row.setdefault('status', 'pending')
+                        row.setdefault('claims', 1)
+                    rows.append(row)
+                    created.append(dict(row))
+                return self._send(201, created if 'return=minimal' not in prefer else None)
+
+            matched = self._filter(rows, params)
+
+            if self.command == 'PATCH':
+                for row in matched:
+                    row.update(body or {})
+                return self._send(200, [dict(row) for row in matched])
+
+            if self.command == 'DELETE':
+                state.tables[table] = [row for row in rows if not any(row is m for m in matched)]
+                return self._send(200, [dict(row) for row in matched])
+
+            # GET / HEAD
+            for clause in reversed((options.get('order') or '').split(',')):
+                if clause:
+                    column, _, direction = clause.partition('.')
+                    matched = sorted(matched, key=lambda row: (row.get(column) is None, str(row.get(column))),
+                                     reverse=direction.startswith('desc'))
+            total = len(matched)
+            offset = int(options.get('offset') or 0)
+            limit = int(options['limit']) if options.get('limit') else None
+            page = matched[offset:offset + limit if limit is not None else None]
+
+            select = options.get('select', '*')
+            if select != '*':
+                columns = [c.strip() for c in select.split(',')]
+                page = [{c: row.get(c) for c in columns} for row in page]
+            else:
+                page = [dict(row) for row in page]
+
+        headers = {}
+        if 'count=' in prefer:
+            end = offset + len(page) - 1
+            headers['Content-Range'] = f"{offset}-{end}/{total}" if page else f"*/{total}"
+        return self._send(200, page, headers)
+
+    do_GET = do_HEAD = do_POST = do_PATCH = do_DELETE = _handle
+
+def create_mock_supabase(host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    server = ThreadingHTTPServer((host, port), MockSupabaseHandler)
+    server.daemon_threads = True
+    server.state = MockSupabaseState(latency_ms, jitter_ms, error_rate)
+    return server
+
+def start_mock_supabase(host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    """Start the mock in a background thread; returns the server (``server.server_address`` has the port)"""
+    server = create_mock_supabase(host, port, latency_ms, jitter_ms, error_rate)
+    threading.Thread(target=server.serve_forever, name='mock-supabase', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock Supabase REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9200)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra random latency per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--seed', action='append', default=[], metavar='MACHINE_ID',
+                        help='seed a machine with sample inventory (repeatable)')
+    args = parser.parse_args()
+
+    server = create_mock_supabase(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    for machine_id in args.seed:
+        server.state.seed_inventory(machine_id)
+    print(f"🧪 Mock Supabase listening on http://{args.host}:{args.port} (key: {MOCK_SUPABASE_KEY})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Mock Supabase stopped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare the old checkout path (two sequential requests.post calls, new
+connection each) with RazorpayClient (pooled keep-alive session, order and
+QR code created concurrently) against the local mock Razorpay server.
+
+Usage:
+  python bench/razorpay_checkout_bench.py --checkouts 200 --concurrency 8 --latency-ms 80
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_razorpay import start_mock_razorpay
+from razorpay_client import RazorpayClient
+
+AUTH = ('rzp_test_bench', 'bench_secret')
+ORDER = {'amount': 2500, 'currency': 'INR', 'receipt': 'bench', 'payment_capture': 1}
+QR = {'type': 'upi_qr', 'name': 'Bench', 'usage': 'single_use', 'fixed_amount': True, 'payment_amount': 2500}
+
+def sequential_checkout(base_url):
+    order = requests.post(f"{base_url}/orders", json=ORDER, auth=AUTH, timeout=10)
+    qr = requests.post(f"{base_url}/payments/qr_codes", json=QR, auth=AUTH, timeout=10)
+    return order.status_code == 200 and qr.status_code == 200
+
+def pooled_checkout(client):
+    client.create_order_and_qr_code(ORDER, QR)
+    return True
+
+def run(label, checkout, checkouts, concurrency):
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            ok = checkout()
+        except Exception:
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(checkouts)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(ms for _, ms in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    print(f"{label:<12} {checkouts / elapsed:8.1f} checkouts/s  "
+          f"p50 {statistics.median(latencies):7.1f}ms  "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:7.1f}ms  errors {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Razorpay checkout benchmark')
+    parser.add_argument('--checkouts', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_mock_razorpay(latency_ms=args.latency_ms, error_rate=args.error_rate)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    client = RazorpayClient(*AUTH, base_url=base_url, pool_size=args.concurrency * 2)
+
+    print(f"📊 {args.checkouts} checkouts, concurrency {args.concurrency}, "
+          f"mock latency {args.latency_ms}ms, error rate {args.error_rate}")
+    run('sequential', lambda: sequential_checkout(base_url), args.checkouts, args.concurrency)
+    run('pooled', lambda: pooled_checkout(client), args.checkouts, args.concurrency)
+    print(f"client stats: {client.stats()}")
+
+    client.close()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
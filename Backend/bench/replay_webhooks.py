@@ -0,0 +1,188 @@
+"""
+Webhook replay benchmark: boots one backend worker against the mock Supabase
+server and replays a burst of signed Razorpay qr_code.credited webhooks,
+including redeliveries of the same event id like Razorpay's retries.
+
+Reports how fast the burst is acknowledged (what Razorpay sees) and how long
+the queue workers take to apply it, then checks every order ended up paid.
+
+Usage:
+  python bench/replay_webhooks.py --events 1000 --duplicate-rate 0.2
+  python bench/replay_webhooks.py --workers 0          # process inline, for comparison
+  python bench/replay_webhooks.py --capture burst.jsonl --machine-id VM-001
+
+A capture file has one webhook per line, either the raw JSON body or
+{"event_id": ..., "body": {...}}. Orders named in it are created as pending
+in the mock before the replay.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.checkout_load_test import start_backend, percentile
+from bench.mock_supabase import start_mock_supabase
+
+WEBHOOK_SECRET = 'bench_webhook_secret'
+
+def credited_webhook(order_id, machine_id, amount_paise):
+    return {
+        'entity': 'event',
+        'event': 'qr_code.credited',
+        'contains': ['qr_code', 'payment'],
+        'payload': {
+            'qr_code': {'entity': {'id': f'qr_{uuid.uuid4().hex[:14]}',
+                                   'notes': {'order_id': order_id, 'machine_id': machine_id}}},
+            'payment': {'entity': {'id': f'pay_{uuid.uuid4().hex[:14]}', 'amount': amount_paise,
+                                   'method': 'upi', 'vpa': 'bench@upi', 'status': 'captured',
+                                   'acquirer_data': {'rrn': str(random.randint(10 ** 11, 10 ** 12))}}}
+        },
+        'created_at': int(time.time())
+    }
+
+def load_capture(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            body = record.get('body', record)
+            events.append((record.get('event_id') or f'evt_{uuid.uuid4().hex[:14]}', body))
+    return events
+
+def create_pending_orders(state, machine_id, order_ids):
+    items = state.seed_inventory(machine_id, count=1, quantity=len(order_ids) + 1)
+    with state.lock:
+        for order_id in order_ids:
+            state.rpc_create_order_with_reservation({
+                'order_id': order_id, 'machine_id': machine_id, 'total_amount': items[0]['price'],
+                'items': [{'id': items[0]['id'], 'name': items[0]['name'], 'price': items[0]['price'], 'quantity': 1}]
+            })
+
+def build_burst(args, state):
+    if args.capture:
+        events = load_capture(args.capture)
+        order_ids = {body.get('payload', {}).get('qr_code', {}).get('entity', {}).get('notes', {}).get('order_id')
+                     for _, body in events}
+        create_pending_orders(state, args.machine_id, sorted(o for o in order_ids if o))
+    else:
+        order_ids = [f'BBWH{n:06d}' for n in range(args.events)]
+        create_pending_orders(state, args.machine_id, order_ids)
+        events = [(f'evt_{uuid.uuid4().hex[:14]}', credited_webhook(order_id, args.machine_id, 1000))
+                  for order_id in order_ids]
+
+    # Razorpay redelivers an event with the same id when it does not see a timely 2xx
+    burst = [(event_id, json.dumps(body).encode()) for event_id, body in events]
+    burst += random.sample(burst, int(len(burst) * args.duplicate_rate))
+    random.shuffle(burst)
+    return burst
+
+def replay(base_url, burst, concurrency):
+    def send(entry):
+        event_id, body = entry
+        signature = hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        started = time.perf_counter()
+        try:
+            response = requests.post(f"{base_url}/razorpay-webhook", data=body, timeout=30, headers={
+                'Content-Type': 'application/json',
+                'X-Razorpay-Signature': signature,
+                'X-Razorpay-Event-Id': event_id
+            })
+            status = response.status_code
+        except requests.RequestException:
+            status = None
+        return status, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, burst))
+    return results, time.perf_counter() - started
+
+def wait_for_drain(base_url, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        queue_stats = requests.get(f"{base_url}/api/health", timeout=5).json()['webhook_queue']
+        if queue_stats['depth'] == 0 and queue_stats['in_flight'] == 0:
+            return queue_stats
+        time.sleep(0.05)
+    raise RuntimeError('Webhook queue did not drain in time')
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a burst of signed Razorpay webhooks')
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--capture', help='JSONL file of captured webhook bodies')
+    parser.add_argument('--machine-id', default='VM-001')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=4, help='WEBHOOK_WORKERS (0 = process inline)')
+    parser.add_argument('--supabase-latency-ms', type=float, default=30)
+    parser.add_argument('--async-mode', choices=['gevent', 'threading'], default='gevent')
+    parser.add_argument('--server', choices=['python', 'gunicorn'], default='python')
+    parser.add_argument('--port', type=int, default=5198)
+    args = parser.parse_args()
+
+    supabase = start_mock_supabase(latency_ms=args.supabase_latency_ms)
+    burst = build_burst(args, supabase.state)
+
+    os.environ.update({
+        'RAZORPAY_WEBHOOK_SECRET': WEBHOOK_SECRET,
+        'WEBHOOK_WORKERS': str(args.workers),
+        'WEBHOOK_QUEUE_SIZE': str(len(burst)),
+        'SUPABASE_POOL_SIZE': str(max(4, args.workers))
+    })
+    workdir = tempfile.mkdtemp(prefix='webhook-replay-')
+    process, base_url = start_backend(
+        args, f"http://127.0.0.1:{supabase.server_address[1]}", 'http://127.0.0.1:9/v1', workdir
+    )
+    try:
+        started = time.perf_counter()
+        results, ack_elapsed = replay(base_url, burst, args.concurrency)
+        queue_stats = wait_for_drain(base_url)
+        applied_elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    with supabase.state.lock:
+        orders = supabase.state._find('orders', machine_id=args.machine_id)
+    latencies = sorted(ms for _, ms in results)
+    report = {
+        'server': args.server,
+        'async_mode': args.async_mode,
+        'workers': args.workers,
+        'deliveries': len(burst),
+        'unique_events': len({event_id for event_id, _ in burst}),
+        'acked': sum(1 for status, _ in results if status == 200),
+        'rejected': sum(1 for status, _ in results if status != 200),
+        'ack_elapsed_s': round(ack_elapsed, 2),
+        'ack_per_s': round(len(burst) / ack_elapsed, 1),
+        'ack_p50_ms': round(statistics.median(latencies), 1),
+        'ack_p95_ms': round(percentile(latencies, 95), 1),
+        'ack_p99_ms': round(percentile(latencies, 99), 1),
+        'applied_elapsed_s': round(applied_elapsed, 2),
+        'processed': queue_stats['processed'],
+        'retries': queue_stats['retries'],
+        'dead_lettered': queue_stats['dead_lettered'],
+        'orders_paid': sum(1 for order in orders if order['payment_status'] == 'paid'),
+        'orders': len(orders),
+        'backend_log': os.path.join(workdir, 'backend.out')
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+
+class _Load:
+    """A ``loader()`` call in progress; other misses on its key wait for its result"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.loaded = False
+        self.value = None
+        self.error = None
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ``ttl`` seconds after being stored.
+
+    ``invalidate()`` bumps a per-key generation so a loader that started before
+    the invalidation cannot write its (now stale) result back into the cache.
+    Concurrent misses on the same key share one ``get_or_load()`` call; loads
+    of different keys never wait on each other.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 30):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._loading = {}  # key -> _Load in flight
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        """Store ``value`` unless ``key`` was invalidated since ``generation`` was read"""
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return False
+
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+            return True
+
+    def generation(self, key):
+        with self._lock:
+            return (self._epoch, self._generations.get(key, 0))
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for ``key``, calling ``loader()`` on a miss"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            load = self._loading.get(key)
+            if load is None:
+                # A load that finished since our miss may already have stored the key
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    return entry[1]
+                load = self._loading[key] = _Load()
+                generation = (self._epoch, self._generations.get(key, 0))
+            else:
+                generation = None
+
+        if generation is None:
+            load.done.wait()
+            if load.error is not None:
+                raise load.error
+            if not load.loaded:
+                # The loading thread/greenlet was killed mid-load; try again ourselves
+                return self.get_or_load(key, loader)
+            return load.value
+
+        try:
+            load.value = loader()
+            load.loaded = True
+            self.set(key, load.value, generation)
+            return load.value
+        except Exception as e:
+            load.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is load:
+                    del self._loading[key]
+            load.done.set()
+
+    def invalidate(self, key=None):
+        """Drop one key, or every entry when ``key`` is None"""
+        with self._lock:
+            # Callers arriving after this start a fresh load instead of joining a stale one
+            if key is None:
+                self._entries.clear()
+                self._generations.clear()
+                self._loading.clear()
+                self._epoch += 1
+            else:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._loading.pop(key, None)
+            self._stats['invalidations'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'ttl': self.ttl, **self._stats}
@@ -1,14 +1,28 @@
 # Gunicorn configuration for Railway deployment
 import os
 
+# Must match index.py; patch before the app is preloaded so its sockets and locks are cooperative
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'gevent')
+if ASYNC_MODE == 'gevent':
+    # httpcore probes for trio on import, which fails once select.epoll is patched away
+    import httpcore  # noqa: F401
+    from gevent import monkey
+    monkey.patch_all()
+
 # Server socket
 bind = f"0.0.0.0:{os.environ.get('PORT', '3005')}"
 backlog = 2048
 
 # Worker processes
+# More than one worker needs SOCKETIO_MESSAGE_QUEUE so Socket.IO emits and machine presence are shared
 workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
-worker_class = "gevent"
-worker_connections = 1000
+if ASYNC_MODE == 'gevent':
+    # One worker serves up to worker_connections requests concurrently as greenlets
+    worker_class = "gevent"
+    worker_connections = 1000
+else:
+    worker_class = "gthread"
+    threads = int(os.environ.get('GUNICORN_THREADS', '8'))
 timeout = 30
 keepalive = 2
 
@@ -30,3 +44,16 @@ preload_app = True
 
 # Enable stats
 enable_stdio_inheritance = True
+
+# Server hooks
+def post_fork(server, worker):
+    # The preloaded app may have opened Supabase or Razorpay sessions in the master;
+    # give each worker its own pooled clients instead of sharing sockets
+    from supabase_db import reset_supabase_client_pool
+    reset_supabase_client_pool()
+    from razorpay_client import reset_razorpay_client
+    reset_razorpay_client()
+
+    # Background tasks (order expiry) must run in the worker, never in the master
+    from index import start_background_tasks
+    start_background_tasks()
@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import queue
+import socket
+import uuid
+import threading
+import logging
+from image_pipeline import parse_variant_filename
+from order_expiry import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FOLDER = 'Inventory/product_images'
+# Storage path at the end of a public storage URL or of a /<tenant>/Inventory/product_images/<file> URL
+_IMAGE_PATH = re.compile(r'([^/]+/%s/[^/]+)$' % re.escape(IMAGE_FOLDER))
+
+def image_storage_path(url):
+    """'VM-001/Inventory/product_images/<file>' for a product image URL, else None"""
+    if not url:
+        return None
+    match = _IMAGE_PATH.search(url.split('?', 1)[0])
+    return match.group(1) if match else None
+
+class ImageGarbageCollector:
+    """Deletes product images that no inventory row references.
+
+    ``discard(url)`` queues the image of a product that was edited or
+    deleted; a worker removes queued images in batches, retrying with
+    backoff, so requests never wait on storage. Content-addressed variants
+    are not queued since other products may share them.
+
+    ``sweep()`` catches everything else (failed deletes, replaced variants):
+    it lists each tenant's image folder, diffs it against the images in
+    ``inventory`` and removes the rest in chunks. Files younger than
+    ``min_age`` are kept (uploaded, product not saved yet), as are tenants
+    without any inventory rows. Only the holder of the ``image-gc`` lease
+    sweeps, at most once per ``sweep_interval``.
+    """
+
+    LEASE_NAME = 'image-gc'
+
+    def __init__(self, storage, load_references, acquire_lease=None, batch_size=100, maxsize=10000,
+                 max_attempts=5, backoff=1.0, sweep_interval=6 * 3600, min_age=86400, spawn=None,
+                 sleep=time.sleep):
+        self.storage = storage
+        self.load_references = load_references
+        self.acquire_lease = acquire_lease
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.sweep_interval = sweep_interval
+        self.min_age = min_age
+        self.spawn = spawn
+        self.sleep = sleep
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'queued': 0, 'rejected': 0, 'deleted': 0, 'batches': 0, 'retries': 0, 'failed': 0,
+                       'sweeps': 0, 'orphans_deleted': 0, 'last_sweep_at': None}
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for target in (self._work, self._sweep_loop):
+            if self.spawn:
+                self.spawn(target)
+            else:
+                threading.Thread(target=target, name=f'image-gc-{target.__name__.strip("_")}', daemon=True).start()
+        logger.info(f"Image GC started ({self.holder})")
+
+    def discard(self, url):
+        """Queue a product's old image for deletion; False if it is not ours to delete"""
+        path = image_storage_path(url)
+        if not path or parse_variant_filename(path):
+            return False
+        try:
+            self._queue.put_nowait(path)
+        except queue.Full:
+            # The next sweep deletes it anyway
+            self._count('rejected')
+            return False
+        self._count('queued')
+        return True
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._remove(batch)
+            except Exception as e:
+                logger.error(f"Image GC worker error: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _remove(self, paths):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.storage.remove(paths)
+                self._count('batches')
+                self._count('deleted', len(paths))
+                logger.info(f"Deleted {len(paths)} product images")
+                return True
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self._count('failed', len(paths))
+                    logger.error(f"Failed to delete {len(paths)} product images after {attempt} attempts: {e}")
+                    return False
+                self._count('retries')
+                delay = self.backoff * (2 ** (attempt - 1))
+                logger.warning(f"Deleting {len(paths)} product images failed (attempt {attempt}): {e}; "
+                               f"retrying in {delay:.1f}s")
+                self.sleep(delay)
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                # The lease lasts a whole interval, so other workers skip this round
+                if self.acquire_lease is None or self.acquire_lease(self.LEASE_NAME, self.holder,
+                                                                    int(self.sweep_interval)):
+                    self.sweep()
+            except Exception as e:
+                logger.error(f"Image GC sweep failed: {str(e)}")
+            self.sleep(self.sweep_interval)
+
+    def sweep(self):
+        """Delete unreferenced images in every tenant folder; returns how many were deleted"""
+        referenced_paths = set()
+        referenced_hashes = set()  # (tenant, content hash): keeps every variant of a referenced upload
+        tenants_with_rows = set()
+        for machine_id, url in self.load_references():
+            tenants_with_rows.add(machine_id)
+            path = image_storage_path(url)
+            if not path:
+                continue
+            referenced_paths.add(path)
+            variant = parse_variant_filename(path)
+            if variant:
+                referenced_hashes.add((path.split('/', 1)[0], variant[0]))
+
+        cutoff = time.time() - self.min_age
+        deleted = 0
+        for tenant in self.storage.list_objects(''):
+            if not tenant['folder'] or tenant['name'] not in tenants_with_rows:
+                continue
+            folder = f"{tenant['name']}/{IMAGE_FOLDER}"
+            orphans = []
+            for entry in self.storage.list_objects(folder):
+                if entry['folder'] or not entry['created_at']:
+                    continue
+                path = f"{folder}/{entry['name']}"
+                variant = parse_variant_filename(entry['name'])
+                if path in referenced_paths or (variant and (tenant['name'], variant[0]) in referenced_hashes):
+                    continue
+                try:
+                    if parse_timestamp(entry['created_at']) > cutoff:
+                        continue
+                except (TypeError, ValueError):
+                    continue
+                orphans.append(path)
+
+            for start in range(0, len(orphans), self.batch_size):
+                chunk = orphans[start:start + self.batch_size]
+                if self._remove(chunk):
+                    deleted += len(chunk)
+            if orphans:
+                logger.info(f"Image GC: {len(orphans)} unreferenced images in {folder}")
+
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['orphans_deleted'] += deleted
+            self._stats['last_sweep_at'] = time.time()
+        return deleted
+
+    def join(self):
+        """Block until every queued delete has been attempted (tests, shutdown)"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(depth=self._queue.qsize(), holder=self.holder)
+        return stats
@@ -0,0 +1,111 @@
+import io
+import os
+import re
+import hashlib
+import logging
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels and the most bytes each variant may take
+VARIANTS = {
+    'thumb': {'size': 160, 'max_bytes': 20 * 1024},
+    'card': {'size': 480, 'max_bytes': 80 * 1024},
+    'full': {'size': 1200, 'max_bytes': 300 * 1024}
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'content_type': 'image/webp', 'options': {'method': 4}},
+    'jpg': {'format': 'JPEG', 'content_type': 'image/jpeg', 'options': {'optimize': True, 'progressive': True}}
+}
+# Qualities tried in order until a variant fits its byte cap
+QUALITIES = (82, 72, 62, 50, 40)
+# Decoding bombs: refuse images with more pixels than this
+MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(40 * 1000 * 1000)))
+
+class ImageProcessingError(Exception):
+    """The upload is not an image we can decode"""
+
+def content_hash(file_data: bytes) -> str:
+    """Name for an upload: re-uploading the same file yields the same name"""
+    return hashlib.sha256(file_data).hexdigest()[:32]
+
+def variant_filename(digest: str, variant: str, ext: str) -> str:
+    return f"{digest}_{variant}.{ext}"
+
+VARIANT_FILENAME = re.compile(r'^([0-9a-f]{32})_(%s)\.(%s)$' % ('|'.join(VARIANTS), '|'.join(FORMATS)))
+
+def parse_variant_filename(name: str):
+    """(hash, variant, ext) for a pipeline file name (or URL), else None"""
+    match = VARIANT_FILENAME.match(name.rsplit('/', 1)[-1].split('?', 1)[0])
+    return match.groups() if match else None
+
+def variant_filenames(digest: str):
+    return [variant_filename(digest, variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+def _encode(img, fmt, max_bytes):
+    spec = FORMATS[fmt]
+    if spec['format'] == 'JPEG' and img.mode != 'RGB':
+        # JPEG has no alpha: flatten onto white
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A') if 'A' in img.getbands() else None)
+        img = background
+    data = b''
+    for quality in QUALITIES:
+        buffer = io.BytesIO()
+        # Nothing from the source (EXIF, GPS, ICC, comments) is passed on
+        img.save(buffer, format=spec['format'], quality=quality, **spec['options'])
+        data = buffer.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return data
+
+def process_image(file_data: bytes, max_size_mb=5):
+    """Decode an upload once and encode every variant in every format.
+
+    Returns {'hash', 'width', 'height', 'files': [{'variant', 'format',
+    'filename', 'content_type', 'data', 'width', 'height'}, ...]}.
+    """
+    max_size_bytes = max_size_mb * 1024 * 1024
+    if len(file_data) > max_size_bytes:
+        raise ImageProcessingError(
+            f"File size ({len(file_data)/1024/1024:.1f}MB) exceeds maximum allowed size ({max_size_mb}MB)")
+
+    try:
+        img = Image.open(io.BytesIO(file_data))
+        width, height = img.size
+        if width * height > MAX_PIXELS:
+            raise ImageProcessingError(f"Invalid image file: {width}x{height} is too large")
+        # JPEG can decode straight at a reduced scale, which is most of the work for big photos
+        largest = max(spec['size'] for spec in VARIANTS.values())
+        img.draft('RGB', (largest, largest))
+        img.load()
+    except ImageProcessingError:
+        raise
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageProcessingError(f"Invalid image file: {str(e)}")
+
+    # Apply the camera's rotation before EXIF is dropped
+    img = ImageOps.exif_transpose(img)
+    has_alpha = img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+    img = img.convert('RGBA' if has_alpha else 'RGB')
+
+    digest = content_hash(file_data)
+    files = []
+    # Largest first, each variant resized from the previous one
+    current = img
+    for variant, spec in sorted(VARIANTS.items(), key=lambda kv: -kv[1]['size']):
+        if max(current.size) > spec['size']:
+            current = current.copy()
+            current.thumbnail((spec['size'], spec['size']), Image.LANCZOS)
+        for ext in FORMATS:
+            files.append({
+                'variant': variant,
+                'format': ext,
+                'filename': variant_filename(digest, variant, ext),
+                'content_type': FORMATS[ext]['content_type'],
+                'data': _encode(current, ext, spec['max_bytes']),
+                'width': current.width,
+                'height': current.height
+            })
+
+    return {'hash': digest, 'width': width, 'height': height, 'files': files}
@@ -0,0 +1,176 @@
+import os
+import time
+import atexit
+import tempfile
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from image_pipeline import process_image
+
+logger = logging.getLogger(__name__)
+
+# Uploads handed to workers are spooled here; /dev/shm keeps them in memory
+SPOOL_DIR = os.getenv('IMAGE_SPOOL_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+def _process_spooled(path, max_size_mb):
+    with open(path, 'rb') as f:
+        return process_image(f.read(), max_size_mb)
+
+class ImagePoolSaturated(Exception):
+    """Every worker is busy and the queue is full; the caller should retry later"""
+
+class ImageJobTimeout(Exception):
+    """A job did not finish in time"""
+
+class ImageWorkerPool:
+    """Bounded pool of worker processes for CPU-bound image work.
+
+    Decoding and encoding in the request worker would hold the GIL and, under
+    gevent, stall every other greenlet on it (checkouts included). Jobs run
+    in ``workers`` separate processes instead; at most ``max_pending`` may be
+    queued or running, beyond that ``run`` raises ImagePoolSaturated.
+    Workers are started with "spawn" so they inherit neither gevent's hub nor
+    the listening socket, and the pool is created lazily per process
+    (gunicorn forks after preloading the app). A job still running after
+    ``timeout`` seconds is killed by replacing the pool. With ``workers=0``
+    jobs run inline.
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=30):
+        self.workers = max(0, workers)
+        self.max_pending = max(1, max_pending)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0,
+                       'pool_restarts': 0, 'busy_seconds': 0.0, 'max_seconds': 0.0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _restart(self, executor, terminate=False):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._stats['pool_restarts'] += 1
+        # ProcessPoolExecutor has no public way to stop a running job (before Python 3.14);
+        # shutdown() would leave it running, so its processes are killed outright
+        processes = list((getattr(executor, '_processes', None) or {}).values()) if terminate else []
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _finished(self, started, ok):
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._pending -= 1
+            self._stats['completed' if ok else 'failed'] += 1
+            self._stats['busy_seconds'] += elapsed
+            self._stats['max_seconds'] = max(self._stats['max_seconds'], elapsed)
+
+    def run(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` in a worker process and return its result.
+
+        ``fn`` must be a module-level function. Exceptions it raises are re-raised here.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise ImagePoolSaturated(f"{self._pending} image jobs already pending")
+            self._pending += 1
+            self._stats['submitted'] += 1
+
+        started = time.monotonic()
+        if not self.workers:
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                self._finished(started, False)
+                raise
+            self._finished(started, True)
+            return result
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._restart(executor)
+            self._finished(started, False)
+            raise
+        # The slot is freed when the job really ends, even after the caller gave up waiting
+        future.add_done_callback(lambda f: self._finished(started, not f.cancelled() and f.exception() is None))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            if not future.cancel():
+                # Already running: it would hold its worker and slot until it ends. Start a
+                # fresh pool and kill this one; its other jobs fail with BrokenProcessPool
+                logger.error(f"Image job exceeded {self.timeout}s, recycling the worker pool")
+                self._restart(executor, terminate=True)
+            raise ImageJobTimeout(f"Image job did not finish within {self.timeout}s")
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory on a hostile image); start fresh ones next time
+            logger.error("Image worker process died, restarting the pool")
+            self._restart(executor)
+            raise
+
+    def process_image(self, file_data: bytes, max_size_mb=5):
+        """image_pipeline.process_image in a worker process.
+
+        The upload goes through a spool file rather than the pipe: under gevent
+        the pipe write blocks the whole hub, and a multi-megabyte photo fills
+        the pipe while the worker is busy writing its previous result.
+        """
+        if not self.workers:
+            return self.run(process_image, file_data, max_size_mb)
+        with tempfile.NamedTemporaryFile(prefix='upload-', dir=SPOOL_DIR) as spool:
+            spool.write(file_data)
+            spool.flush()
+            return self.run(_process_spooled, spool.name, max_size_mb)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(workers=self.workers, max_pending=self.max_pending, pending=self._pending)
+        finished = stats['completed'] + stats['failed']
+        stats['avg_seconds'] = round(stats['busy_seconds'] / finished, 3) if finished else 0.0
+        stats['busy_seconds'] = round(stats['busy_seconds'], 3)
+        stats['max_seconds'] = round(stats['max_seconds'], 3)
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_image_pool() -> ImageWorkerPool:
+    """Process-wide pool configured from IMAGE_WORKERS, IMAGE_QUEUE_SIZE and IMAGE_JOB_TIMEOUT"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.getenv('IMAGE_WORKERS', '2'))
+            _pool = ImageWorkerPool(
+                workers=workers,
+                max_pending=workers + int(os.getenv('IMAGE_QUEUE_SIZE', '4')),
+                timeout=float(os.getenv('IMAGE_JOB_TIMEOUT', '30'))
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -1,34 +1,70 @@
 
 import os
+
+# Concurrency model, chosen before anything else opens sockets or creates locks.
+# 'gevent' (the default, matching the gunicorn gevent worker) makes sockets, ssl,
+# threads and sleeps cooperative, so Supabase/Razorpay/storage calls yield to
+# other requests; 'threading' runs plain threads (handy under a debugger).
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'gevent')
+if ASYNC_MODE == 'gevent':
+    # httpcore probes for trio on import, which fails once select.epoll is patched away
+    import httpcore  # noqa: F401
+    from gevent import monkey
+    monkey.patch_all()
+
 import json
 import uuid
 from datetime import datetime
 from functools import wraps
-from flask import Flask, request, jsonify, send_from_directory, abort, redirect
+from flask import Flask, request, jsonify, send_from_directory, abort, redirect, has_request_context
 from flask_cors import CORS
 from dotenv import load_dotenv
-import requests
 from pathlib import Path
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import logging
 from flask import Response
 from werkzeug.middleware.proxy_fix import ProxyFix
 import threading
 import time
+import hashlib
+import hmac
+import marshal
+from cache import TTLCache
+from order_expiry import OrderExpiryScheduler, parse_timestamp
+from razorpay_client import get_razorpay_client, RazorpayError, RazorpayTimeout
+from live_updates import UpdateCoalescer, tenant_room
+from presence import create_presence_registry
+from image_pipeline import (
+    ImageProcessingError, content_hash, parse_variant_filename, variant_filenames
+)
+from webhook_queue import WebhookQueue, verify_webhook_signature, webhook_event_id
+from image_workers import ImageJobTimeout, ImagePoolSaturated, get_image_pool
+from image_gc import ImageGarbageCollector
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, ROUTE_KEY as METRICS_ROUTE_KEY, MetricsMiddleware, render_metrics, set_tenant_source
+from tracing import create_tracing, profile_text, span as trace_span
+from logging_setup import (
+    configure_logging, get_log_buffer, get_log_file, logging_stats, record_filter, tail_lines
+)
 
 # Load environment variables
 load_dotenv()
 # Force redeploy - UUID fix applied
 
-# Setup structured logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+def request_tenant():
+    """X-Tenant-ID of the request being handled, if any"""
+    if has_request_context():
+        return request.headers.get('x-tenant-id')
+    return None
+
+def log_context():
+    """Tenant of the request being handled, attached to every record it logs"""
+    tenant_id = request_tenant()
+    return {'tenant': tenant_id} if tenant_id else None
+
+# Setup structured logging: records are written by a background thread (see logging_setup.py)
+configure_logging(context=log_context)
+# Supabase and Razorpay call metrics are labelled with the tenant of the request making them
+set_tenant_source(request_tenant)
 logger = logging.getLogger(__name__)
 
 # JSON Safety Helper
@@ -60,8 +96,17 @@ try:
         get_inventory, add_inventory, update_inventory,
         delete_inventory_item, get_orders, add_order,
         get_order, update_order, get_single_product,
-        delete_old_product_image, upload_image, validate_image_file,
-        get_image_url, get_supabase_client
+        upload_image,
+        get_image_url, get_supabase_client, get_supabase_pool_stats,
+        get_orders_page, decode_order_cursor, ORDER_COLUMNS,
+        get_dashboard_aggregates, get_machine_timezone,
+        apply_order_to_sales_rollups, get_sales_timeseries,
+        cancel_order_and_restore_inventory, create_order_with_reservation,
+        commit_order_reservation, get_pending_orders_for_expiry, cancel_orders_batch,
+        try_acquire_scheduler_lease, mark_order_paid, record_webhook_dead_letter,
+        save_webhook_event, finish_webhook_event, claim_webhook_events,
+        get_inventory_items, upsert_inventory_items, delete_inventory_items,
+        add_orders, new_order_row, update_orders_status, list_image_files, get_storage, get_inventory_images
     )
     logger.info("[SUCCESS] Supabase connection established successfully!")
 except Exception as e:
@@ -86,7 +131,9 @@ if custom_frontend_url:
 
 CORS(app, origins=allowed_origins,
      supports_credentials=True,
-     allow_headers=['Content-Type', 'Authorization', 'x-tenant-id', 'x-api-key', 'X-Tenant-ID', 'X-API-Key'],
+     allow_headers=['Content-Type', 'Authorization', 'x-tenant-id', 'x-api-key', 'X-Tenant-ID', 'X-API-Key',
+                    'X-Trace-Id', 'X-Profile'],
+     expose_headers=['X-Trace-Id'],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
 
 PORT = int(os.getenv('PORT', 3005))
@@ -105,34 +152,128 @@ app.config.update(
     MAX_CONTENT_LENGTH=5 * 1024 * 1024,  # 5MB max file size
     JSON_SORT_KEYS=False
 )
+# Latency, status and in-flight metrics for every HTTP request, served on /metrics
+app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+# Trace spans per request (X-Trace-Id header); the slowest are kept for /api/admin/traces
+tracer = create_tracing(app.wsgi_app, API_KEY)
+app.wsgi_app = tracer
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp'}
+IMAGE_MAX_UPLOAD_MB = 5
+# Variant files never change (their name is their content hash), so clients may cache them for a year
+IMAGE_CACHE_SECONDS = 365 * 86400
+# How long clients may cache the /<tenant>/Inventory/product_images/<file> redirect
+IMAGE_REDIRECT_CACHE_SECONDS = int(os.getenv('IMAGE_REDIRECT_CACHE_SECONDS', str(30 * 86400)))
+# Content hashes known to be stored, per tenant, so repeat uploads skip the storage listing
+uploaded_images = TTLCache(maxsize=1024, ttl=3600)
+# Seconds a client is told to wait when every image worker is busy
+IMAGE_RETRY_AFTER = int(os.getenv('IMAGE_RETRY_AFTER', '5'))
+# Entries accepted by /api/inventory/bulk and /api/orders/bulk-status in one request
+BULK_MAX_ITEMS = 500
+# Statuses /api/orders/bulk-status may set, and the statuses an order may move from.
+# Cancelling goes through cancel_orders_batch, which restores held stock of pending orders.
+BULK_ORDER_TRANSITIONS = {
+    'paid': ('pending',),
+    'cancelled': ('pending',)
+}
+
+# Dashboard stats: memoized briefly per tenant so many open Admin tabs share one aggregate query
+dashboard_stats_cache = TTLCache(maxsize=64, ttl=float(os.getenv('DASHBOARD_STATS_TTL', '10')))
+LOW_STOCK_THRESHOLD = 5
+CRITICAL_STOCK_THRESHOLD = 2
+
+# Sales chart series are served from the rollup tables and memoized briefly
+sales_timeseries_cache = TTLCache(maxsize=256, ttl=float(os.getenv('SALES_TIMESERIES_TTL', '15')))
+SALES_TIMESERIES_DEFAULT_RANGE = {'hour': 48 * 3600, 'day': 30 * 86400}
+
+# Stock is held for an unpaid order this long; matches the kiosk's QR countdown
+ORDER_HOLD_SECONDS = int(os.getenv('ORDER_HOLD_SECONDS', '180'))
+# Razorpay rejects a QR code whose close_by is less than two minutes away
+QR_MIN_LIFETIME_SECONDS = 120
+# A captured payment settles an order in these states; a cancelled order's stock is taken again
+LATE_PAYABLE_STATUSES = ('pending', 'cancelled')
+
+# GET /api/orders pagination
+ORDERS_PAGE_SIZE = 50
+ORDERS_PAGE_MAX = 200
+ORDERS_QUERY_PARAMS = ('limit', 'cursor', 'status', 'from', 'to', 'phone', 'fields', 'includeTotal')
+
+# Read-through inventory cache, keyed by tenant. Entries are dropped whenever
+# inventory changes in this process; the TTL bounds staleness across workers.
+inventory_cache = TTLCache(
+    maxsize=int(os.getenv('INVENTORY_CACHE_SIZE', '64')),
+    ttl=float(os.getenv('INVENTORY_CACHE_TTL', '30'))
+)
+
+# Settled payment results, so kiosk polls and late subscribers are answered from memory
+payment_status_cache = TTLCache(
+    maxsize=int(os.getenv('PAYMENT_STATUS_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('PAYMENT_STATUS_TTL', '900'))
+)
+# Pending QR code states from Razorpay, shared by polls that arrive close together
+payment_check_cache = TTLCache(
+    maxsize=int(os.getenv('PAYMENT_STATUS_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('PAYMENT_CHECK_TTL', '5'))
+)
+
+# Razorpay webhooks: signed with RAZORPAY_WEBHOOK_SECRET (required), stored in webhook_events before the ack
+RAZORPAY_WEBHOOK_SECRET = os.getenv('RAZORPAY_WEBHOOK_SECRET')
+if not RAZORPAY_WEBHOOK_SECRET:
+    logger.warning("⚠️ RAZORPAY_WEBHOOK_SECRET is not set - Razorpay webhooks will be rejected")
 
 # WebSocket
-socketio = SocketIO(app, cors_allowed_origins='*', async_mode='threading')
-machine_socket_map = {}
-single_machine = {'id': 'VM-001', 'status': 'offline', 'lastHeartbeat': None}
+# With several workers or nodes, set SOCKETIO_MESSAGE_QUEUE (e.g. redis://host:6379/0) so an
+# emit from any worker reaches sockets connected to the others; load balancers need sticky sessions
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
+socketio = SocketIO(app, cors_allowed_origins='*', async_mode=ASYNC_MODE,
+                    message_queue=SOCKETIO_MESSAGE_QUEUE,
+                    channel=os.getenv('SOCKETIO_CHANNEL', 'flask-socketio'))
+# Which socket each machine is connected on, shared across workers when a queue is configured
+machine_presence = create_presence_registry(os.getenv('PRESENCE_URL') or SOCKETIO_MESSAGE_QUEUE)
+# ordersUpdated/inventoryUpdated go to tenant rooms, bursts merged into one emit
+realtime_updates = UpdateCoalescer(
+    emit=socketio.emit,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+    window=float(os.getenv('BROADCAST_COALESCE_MS', '100')) / 1000
+)
+DEFAULT_MACHINE_ID = 'VM-001'
+# Kiosks send {"type": "heartbeat"} on the message channel; silent machines go offline after the timeout
+MACHINE_HEARTBEAT_TIMEOUT = float(os.getenv('MACHINE_HEARTBEAT_TIMEOUT', '90'))
+PRESENCE_SWEEP_INTERVAL = float(os.getenv('PRESENCE_SWEEP_INTERVAL', '15'))
+MACHINES_ROOM = 'machines'
+# Admins following the logs: sid -> record filter (None for everything)
+log_subscribers = {}
+LOG_STREAM_INTERVAL = float(os.getenv('LOG_STREAM_INTERVAL', '0.5'))
+LOG_STREAM_BACKLOG = 100
+# Log endpoints: no tenant id, the API key instead
+API_KEY_PATHS = ('/api/logs', '/api/logs/stream')
 
 # Middleware
+# Registered first so requests the tenant check rejects are labelled with their route too
+@app.before_request
+def metrics_route():
+    rule = request.url_rule
+    if rule is not None:
+        request.environ[METRICS_ROUTE_KEY] = rule.rule
+
 @app.before_request
 def tenant_db_middleware():
     if request.method == 'OPTIONS':
         resp = Response('', status=204)
         resp.headers['Access-Control-Allow-Origin'] = request.headers.get('Origin', '*')
         resp.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, x-tenant-id, x-api-key, X-Tenant-ID, X-API-Key'
+        resp.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, x-tenant-id, x-api-key, X-Tenant-ID, X-API-Key, X-Trace-Id, X-Profile'
         resp.headers['Access-Control-Max-Age'] = '86400'
         return resp
     
     # Skip tenant ID check for certain endpoints
-    excluded_paths = ['/api/machine/status', '/api/health', '/api/logs', '/api/razorpay/webhook', '/razorpay-webhook', '/debug/razorpay', '/api/railway/test-razorpay', '/api/test/qr-generation']
-    
-    # Debug logging
-    logger.debug(f"Request path: {request.path}")
-    logger.debug(f"Excluded paths: {excluded_paths}")
+    excluded_paths = ['/api/machine/status', '/api/health', '/api/razorpay/webhook', '/razorpay-webhook', '/debug/razorpay', '/api/railway/test-razorpay', '/api/test/qr-generation']
     
     # Check if path should be excluded
-    is_excluded = any(request.path == path for path in excluded_paths)
-    logger.debug(f"Is excluded: {is_excluded}")
+    # /api/admin/* and the logs are machine-independent and authenticate with the API key instead
+    is_excluded = any(request.path == path for path in excluded_paths) or request.path.startswith('/api/admin/') \
+        or request.path in API_KEY_PATHS
+    logger.debug("Request path: %s (excluded: %s)", request.path, is_excluded)
     
     if request.path.startswith('/api') and not is_excluded:
         # Check both lowercase and uppercase variants
@@ -152,38 +293,262 @@ def handle_connect():
 
 @socketio.on('message')
 def handle_message(data):
-    global single_machine
     try:
         if isinstance(data, str):
             data = json.loads(data)
         
-        if data.get('type') == 'register':
+        if data.get('type') in ('register', 'heartbeat'):
+            # A heartbeat on an unregistered socket (e.g. after a server restart) registers it
             machine_id = data.get('machine_id')
             if machine_id:
-                machine_socket_map[machine_id] = request.sid
-                if machine_id == single_machine['id']:
-                    single_machine['status'] = 'online'
-                    single_machine['lastHeartbeat'] = datetime.now().isoformat()
-                logger.info(f'Machine {machine_id} registered via WebSocket')
+                info = data.get('info') if isinstance(data.get('info'), dict) else None
+                record, came_online = machine_presence.heartbeat(machine_id, request.sid, info)
+                join_room(tenant_room(machine_id))
+                if data.get('type') == 'register':
+                    logger.info(f'Machine {machine_id} registered via WebSocket')
+                if came_online:
+                    publish_machine_status(record)
+
+        elif data.get('type') == 'subscribe_machines':
+            # Admin UI: current status of every machine, then machineStatus on each transition
+            join_room(MACHINES_ROOM)
+            emit('machineStatuses', [machine_status_payload(record) for record in machine_presence.all()])
+
+        elif data.get('type') == 'subscribe_tenant':
+            # Dashboards: receive the tenant's updates without registering as the machine
+            machine_id = data.get('machine_id')
+            if machine_id:
+                join_room(tenant_room(machine_id))
+
+        elif data.get('type') == 'subscribe_order':
+            # Kiosk showing a QR code: receive paymentStatus for this order
+            order_id = data.get('order_id')
+            if order_id:
+                join_room(order_room(order_id))
+                # The payment may have landed before the kiosk subscribed
+                settled = payment_status_cache.get(('order', order_id))
+                if settled:
+                    emit('paymentStatus', settled)
+
+        elif data.get('type') == 'unsubscribe_order':
+            order_id = data.get('order_id')
+            if order_id:
+                leave_room(order_room(order_id))
+
+        elif data.get('type') == 'subscribe_logs':
+            # Admin log drawer: recent records now, then logRecords batches as they are logged
+            if not valid_api_key(data.get('api_key')):
+                logger.warning(f'[WebSocket] Log subscription without a valid API key from {request.sid}')
+                return
+            match = record_filter(data.get('level'), data.get('tenant'))
+            log_subscribers[request.sid] = match
+            emit('logRecords', get_log_buffer().since(0, match, limit=LOG_STREAM_BACKLOG))
+
+        elif data.get('type') == 'unsubscribe_logs':
+            log_subscribers.pop(request.sid, None)
     except Exception as e:
         logger.error(f'[WebSocket] Error processing message: {e}')
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    for mid, sid in list(machine_socket_map.items()):
-        if sid == request.sid:
-            del machine_socket_map[mid]
-            if mid == single_machine['id']:
-                single_machine['status'] = 'offline'
-                single_machine['lastHeartbeat'] = datetime.now().isoformat()
-            break
+    log_subscribers.pop(request.sid, None)
+    try:
+        record = machine_presence.disconnect(request.sid)
+        if record:
+            logger.info(f"Machine {record['machine_id']} disconnected")
+            publish_machine_status(record)
+    except Exception as e:
+        logger.error(f'[WebSocket] Failed to record disconnect: {e}')
 
 # Helper functions
-def broadcast_orders_update():
-    socketio.emit('ordersUpdated')
+def valid_api_key(api_key):
+    """Whether ``api_key`` is the backend API key"""
+    return bool(API_KEY) and isinstance(api_key, str) and hmac.compare_digest(api_key, API_KEY)
+
+def require_api_key(f):
+    """Only let through requests carrying the backend API key in X-API-Key"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not valid_api_key(request.headers.get('x-api-key', '')):
+            return jsonify({'error': 'Valid X-API-Key header required'}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+def require_api_key_or_token(f):
+    """Like require_api_key, but also accept the key as a ``token`` query parameter (EventSource cannot set headers)"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not (valid_api_key(request.headers.get('x-api-key', '')) or valid_api_key(request.args.get('token', ''))):
+            return jsonify({'error': 'Valid X-API-Key header or token parameter required'}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+def broadcast_orders_update(tenant_id, orders=None):
+    """Tell the tenant's clients which orders changed (rows keyed by order_id)"""
+    with trace_span('broadcast ordersUpdated'):
+        realtime_updates.publish('ordersUpdated', tenant_id, changed=orders, key='order_id', full=orders is None)
+
+def broadcast_inventory_update(tenant_id=None, items=None, removed=None):
+    """Invalidate cached inventory and tell the tenant's clients which items changed.
+
+    Without ``items``/``removed`` clients are told to refetch (``full``).
+    """
+    inventory_cache.invalidate(tenant_id)
+    if tenant_id is None:
+        socketio.emit('inventoryUpdated', {'full': True})
+        return
+
+    changed = []
+    for item in items or []:
+        row = dict(item)
+        row.pop('delta', None)  # cancel results carry how much was restored
+        # Same derived fields as GET /api/inventory
+        if 'quantity' in row:
+            row['available'] = row['quantity']
+        if 'reserved_quantity' in row:
+            row['reserved'] = row['reserved_quantity'] or 0
+        changed.append(row)
+    with trace_span('broadcast inventoryUpdated'):
+        realtime_updates.publish('inventoryUpdated', tenant_id, changed=changed, removed=removed,
+                                 full=items is None and removed is None)
+
+def order_room(order_id):
+    return f'order:{order_id}'
+
+def publish_payment_status(order_id, machine_id=None, qr_code_id=None, status='paid', amount=None, source=None):
+    """Remember a settled payment and push it to the order's room and the machine's socket.
+
+    ``source`` is what confirmed it ('webhook' or 'razorpay'); verify-payment only
+    answers from memory for confirmed results.
+    """
+    payload = {
+        'orderId': order_id,
+        'qrCodeId': qr_code_id,
+        'machineId': machine_id,
+        'status': status,
+        'amount': amount,
+        'source': source,
+        'timestamp': datetime.now().isoformat()
+    }
+    if order_id:
+        payment_status_cache.set(('order', order_id), payload)
+    if qr_code_id:
+        payment_status_cache.set(('qr', qr_code_id), payload)
+
+    targets = [order_room(order_id)] if order_id else []
+    sid = machine_presence.get_sid(machine_id) if machine_id else None
+    if sid:
+        targets.append(sid)
+    if targets:
+        # A list of rooms reaches each client once, even if it is in several of them
+        socketio.emit('paymentStatus', payload, to=targets)
+
+def machine_status_payload(record, machine_id=None):
+    """Presence record in the shape of /api/machine/status"""
+    if not record:
+        return {'id': machine_id, 'status': 'offline', 'lastHeartbeat': None}
+    payload = {
+        'id': record['machine_id'],
+        'status': record['status'],
+        'lastHeartbeat': record.get('last_seen'),
+        'connectedAt': record.get('connected_at')
+    }
+    if record.get('info'):
+        payload['info'] = record['info']
+    return payload
+
+def publish_machine_status(record):
+    """Push an online/offline transition to admins and the machine's tenant room"""
+    socketio.emit('machineStatus', machine_status_payload(record),
+                  to=[MACHINES_ROOM, tenant_room(record['machine_id'])])
+
+def sweep_machine_presence():
+    """Mark machines whose heartbeats stopped as offline"""
+    while True:
+        socketio.sleep(PRESENCE_SWEEP_INTERVAL)
+        try:
+            for record in machine_presence.expire(MACHINE_HEARTBEAT_TIMEOUT):
+                logger.warning(f"Machine {record['machine_id']} missed heartbeats, marking offline")
+                publish_machine_status(record)
+        except Exception as e:
+            logger.error(f'Presence sweep failed: {e}')
+
+def push_log_records():
+    """Send records logged since the last round to each log subscriber"""
+    last_seq = get_log_buffer().seq
+    while True:
+        socketio.sleep(LOG_STREAM_INTERVAL)
+        try:
+            records = get_log_buffer().since(last_seq)
+            if not records:
+                continue
+            last_seq = records[-1]['seq']
+            for sid, match in list(log_subscribers.items()):
+                matching = [entry for entry in records if match is None or match(entry)]
+                if matching:
+                    socketio.emit('logRecords', matching, to=sid)
+        except Exception as e:
+            logger.error(f'Log push failed: {e}')
+
+def fetch_qr_payment_state(qr_code_id):
+    """Current status of a QR code from Razorpay, or None if it could not be read"""
+    response = get_razorpay_client().request('GET', f'/payments/qr_codes/{qr_code_id}')
+    if response.status_code != 200:
+        logger.warning(f"Razorpay QR lookup for {qr_code_id} returned {response.status_code}")
+        return None
+    qr_data = response.json()
+    return {
+        'status': qr_data.get('status'),
+        'payments_amount_received': qr_data.get('payments_amount_received', 0),
+        # Razorpay returns [] for empty notes
+        'order_id': (qr_data.get('notes') or {}).get('order_id')
+    }
 
-def broadcast_inventory_update():
-    socketio.emit('inventoryUpdated')
+def order_total_paise(order):
+    return round(float(order.get('total_amount') or 0) * 100)
+
+def load_inventory_payload(tenant_id):
+    """Serialize a tenant's inventory once and return (body, etag), reading through the cache"""
+    def load():
+        result = get_inventory(tenant_id)
+        for item in result.get('inventory') or []:
+            # quantity is what customers can still buy; reserved is held for unpaid orders
+            item['available'] = item.get('quantity', 0)
+            item['reserved'] = item.get('reserved_quantity') or 0
+        body = app.json.dumps(result)
+        return body, hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+    return inventory_cache.get_or_load(tenant_id, load)
+
+def record_paid_order(order_id, machine_id=None):
+    """Commit a newly paid order's stock hold and count it into the sales rollups.
+
+    Both steps are idempotent, so the webhook and verify-payment may both call this.
+    """
+    order_expiry.discard(order_id)
+    try:
+        changed = commit_order_reservation(order_id)
+        if changed:
+            logger.info(f"Stock reservation committed for order {order_id}")
+            broadcast_inventory_update(machine_id, changed)
+    except Exception as e:
+        logger.error(f"Failed to commit stock reservation for order {order_id}: {str(e)}")
+
+    try:
+        if apply_order_to_sales_rollups(order_id, machine_id):
+            logger.info(f"Sales rollups updated for order {order_id}")
+    except Exception as e:
+        # Rollups can be rebuilt with backfill_sales_rollups.py; never fail a payment over them
+        logger.error(f"Failed to update sales rollups for order {order_id}: {str(e)}")
+
+def discard_product_image(old_image_url):
+    """Queue a product's previous image for deletion, keeping the default and shared images"""
+    if not old_image_url:
+        return
+    if image_gc.discard(old_image_url):
+        logger.info(f"Queued old image for deletion: {old_image_url}")
+    else:
+        logger.info(f"Keeping image: {old_image_url}")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -198,6 +563,54 @@ def validate_inventory_item(data):
         return False, "Invalid quantity"
     return True, None
 
+def parse_iso_datetime(value):
+    """Normalize an ISO-8601 date/datetime query value, returning None if it is invalid"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        return None
+
+def parse_orders_query(args):
+    """Validate pagination/filter query parameters for GET /api/orders"""
+    try:
+        limit = int(args.get('limit', ORDERS_PAGE_SIZE))
+    except ValueError:
+        return None, 'Invalid limit'
+    if limit < 1 or limit > ORDERS_PAGE_MAX:
+        return None, f'limit must be between 1 and {ORDERS_PAGE_MAX}'
+
+    cursor = args.get('cursor') or None
+    if cursor:
+        try:
+            decode_order_cursor(cursor)
+        except ValueError:
+            return None, 'Invalid cursor'
+
+    dates = {}
+    for param in ('from', 'to'):
+        if args.get(param):
+            dates[param] = parse_iso_datetime(args[param])
+            if not dates[param]:
+                return None, f'Invalid {param} date'
+
+    columns = None
+    if args.get('fields'):
+        columns = [c.strip() for c in args['fields'].split(',') if c.strip()]
+        unknown = [c for c in columns if c not in ORDER_COLUMNS]
+        if unknown:
+            return None, f'Unknown fields: {", ".join(unknown)}'
+
+    return {
+        'limit': limit,
+        'cursor': cursor,
+        'payment_status': [st for st in args.get('status', '').split(',') if st] or None,
+        'date_from': dates.get('from'),
+        'date_to': dates.get('to'),
+        'customer_phone': args.get('phone') or None,
+        'columns': columns,
+        'include_total': args.get('includeTotal', 'true').lower() != 'false'
+    }, None
+
 def validate_order_item(data):
     required = ['items', 'totalAmount']
     if not all(k in data for k in required):
@@ -217,7 +630,14 @@ def inventory():
         return jsonify({'error': 'Tenant ID is required'}), 400
 
     if request.method == 'GET':
-        return jsonify(get_inventory(tenant_id))
+        body, etag = load_inventory_payload(tenant_id)
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(body, mimetype='application/json')
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
 
     if request.method == 'POST':
         item = request.json
@@ -225,7 +645,7 @@ def inventory():
         if not is_valid:
             return jsonify({'success': False, 'error': error_msg}), 400
         result = add_inventory(tenant_id, item)
-        broadcast_inventory_update()
+        broadcast_inventory_update(tenant_id, result.get('data'))
         return jsonify(result)
 
     if request.method == 'PUT':
@@ -245,20 +665,10 @@ def inventory():
 
             # If new image URL differs from the current, delete old image
             if 'image' in updates and updates['image'] != old_image_url and old_image_url:
-                logger.info(f"Deleting old image: {old_image_url}")
                 logger.info(f"New image: {updates['image']}")
+                discard_product_image(old_image_url)
 
-                # Don't delete default images
-                if not old_image_url.endswith('/product_img/download.png') and '/product-images/' in old_image_url:
-                    deletion_success = delete_old_product_image(old_image_url)
-                    if deletion_success:
-                        logger.info(f"Successfully deleted old image: {old_image_url}")
-                    else:
-                        logger.warning(f"Failed to delete old image: {old_image_url}")
-                else:
-                    logger.info(f"Skipping deletion of default/local image: {old_image_url}")
-
-            broadcast_inventory_update()
+            broadcast_inventory_update(tenant_id, result.get('data'))
             return jsonify(result)
 
         return jsonify({'error': 'Product not found'}), 404
@@ -277,20 +687,94 @@ def inventory():
             result = delete_inventory_item(tenant_id, item_id)
 
             # If deletion was successful, also delete the image
-            if result.get('success') and old_image_url:
-                # Don't delete default images
-                if not old_image_url.endswith('/product_img/download.png') and '/product-images/' in old_image_url:
-                    deletion_success = delete_old_product_image(old_image_url)
-                    if deletion_success:
-                        logger.info(f"Successfully deleted image for deleted product: {old_image_url}")
-                    else:
-                        logger.warning(f"Failed to delete image for deleted product: {old_image_url}")
+            if result.get('success'):
+                discard_product_image(old_image_url)
 
-            broadcast_inventory_update()
+            broadcast_inventory_update(tenant_id, removed=[item_id])
             return jsonify(result)
         else:
             return jsonify({'error': 'Product not found'}), 404
 
+@app.route('/api/inventory/bulk', methods=['POST'])
+def bulk_inventory():
+    """Create, update and delete many items in one round trip each.
+
+    Body: {"upsert": [item, ...], "delete": [id, ...]}. Items with the id of
+    an existing product are merged into it; the rest are created. Each entry
+    gets its own result, so one bad item does not reject the batch.
+    """
+    tenant_id = request.headers.get('x-tenant-id') or request.headers.get('X-Tenant-ID')
+    if not tenant_id:
+        return jsonify({'error': 'Tenant ID is required'}), 400
+
+    data = request.get_json(silent=True) or {}
+    upserts = data.get('upsert') or []
+    deletes = data.get('delete') or []
+    if not isinstance(upserts, list) or not isinstance(deletes, list) \
+            or not all(isinstance(item_id, (str, int)) for item_id in deletes):
+        return jsonify({'success': False, 'error': 'upsert must be a list of items and delete a list of ids'}), 400
+    deletes = [str(item_id) for item_id in deletes]
+    if len(upserts) + len(deletes) > BULK_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {BULK_MAX_ITEMS} items per request'}), 400
+
+    try:
+        ids = {item.get('id') for item in upserts if isinstance(item, dict) and item.get('id')} | set(deletes)
+        existing = {str(row['id']): row for row in get_inventory_items([str(i) for i in ids])}
+
+        results = []
+        rows = []
+        replaced_images = []
+        seen = set()
+        for item in upserts:
+            if not isinstance(item, dict):
+                results.append({'id': None, 'action': 'upsert', 'success': False, 'error': 'Item must be an object'})
+                continue
+            item_id = str(item.get('id') or uuid.uuid4())
+            current = existing.get(item_id)
+            if item_id in seen or item_id in deletes:
+                error = 'Item listed more than once'
+            elif current and current.get('machine_id') != tenant_id:
+                error = 'Product not found'
+            else:
+                error = validate_inventory_item({**(current or {}), **item})[1]
+            seen.add(item_id)
+            action = 'update' if current else 'create'
+            if error:
+                results.append({'id': item_id, 'action': action, 'success': False, 'error': error})
+                continue
+            rows.append({**(current or {}), **item, 'id': item_id})
+            results.append({'id': item_id, 'action': action, 'success': True})
+            if current and 'image' in item and item['image'] != current.get('image'):
+                replaced_images.append(current.get('image'))
+
+        delete_ids = []
+        for item_id in deletes:
+            current = existing.get(str(item_id))
+            if not current or current.get('machine_id') != tenant_id:
+                results.append({'id': item_id, 'action': 'delete', 'success': False, 'error': 'Product not found'})
+            else:
+                delete_ids.append(str(item_id))
+
+        saved = upsert_inventory_items(tenant_id, rows)
+        deleted = delete_inventory_items(tenant_id, delete_ids)
+        deleted_ids = {str(row['id']) for row in deleted}
+        results += [{'id': item_id, 'action': 'delete', 'success': item_id in deleted_ids,
+                     **({} if item_id in deleted_ids else {'error': 'Product not found'})} for item_id in delete_ids]
+
+        for old_image_url in replaced_images + [row.get('image') for row in deleted]:
+            discard_product_image(old_image_url)
+
+        if saved or deleted:
+            broadcast_inventory_update(tenant_id, saved, removed=sorted(deleted_ids))
+        return jsonify({
+            'success': all(result['success'] for result in results),
+            'results': results,
+            'inventory': saved
+        })
+    except Exception as e:
+        logger.error(f"Bulk inventory update failed: {e}")
+        return jsonify({'success': False, 'error': 'Failed to update inventory', 'details': str(e)}), 500
+
 @app.route('/api/inventory/init', methods=['GET'])
 def init_inventory():
     tenant_id = request.headers.get('x-tenant-id') or request.headers.get('X-Tenant-ID')
@@ -315,15 +799,12 @@ def init_inventory():
             {"id": str(uuid.uuid4()), "name": "Water Bottle", "price": 20, "quantity": 40, "category": "Water", "slot": "G1", "image": "/product_img/e9280a387e8049210642406c032b6a60.jpg", "description": "Purified drinking water"}
         ]
         
-        # Add each item to inventory
-        for item in default_inventory:
-            add_inventory(tenant_id, item)
-        
-        broadcast_inventory_update()
+        saved = upsert_inventory_items(tenant_id, default_inventory)
+        broadcast_inventory_update(tenant_id, saved)
         return jsonify({
             'success': True, 
             'message': 'Inventory initialized with default products', 
-            'inventory': default_inventory
+            'inventory': saved or default_inventory
         })
         
     except Exception as e:
@@ -367,11 +848,7 @@ def init_orders():
             }
         ]
 
-        created_orders = []
-        for order in sample_orders:
-            result = add_order(tenant_id, order)
-            if result.get('success'):
-                created_orders.append(result.get('order'))
+        created_orders = add_orders(tenant_id, sample_orders)
 
         return jsonify({
             'success': True,
@@ -433,6 +910,17 @@ def orders():
 
     if request.method == 'GET':
         try:
+            # Paginated/filtered listing when any query parameter is given;
+            # the bare endpoint keeps returning the full list for older clients
+            if any(param in request.args for param in ORDERS_QUERY_PARAMS):
+                query, error_msg = parse_orders_query(request.args)
+                if error_msg:
+                    return jsonify({'success': False, 'error': error_msg}), 400
+                result = get_orders_page(tenant_id, **query)
+                if not result.get('success'):
+                    raise Exception(result.get('error'))
+                return jsonify(result)
+
             result = get_orders(tenant_id)
             if result is None:
                 return jsonify({'success': True, 'orders': []})
@@ -451,57 +939,52 @@ def orders():
             if not order:
                 return jsonify({'success': False, 'error': 'No order data provided'}), 400
 
-            logging.info(f"Creating order for tenant {tenant_id}")
-
-            # Create order in database with minimal data to avoid recursion
-            from datetime import datetime
-            order_id = f"BB{int(datetime.now().timestamp() * 1000)}"
-
-            # Create simple order data structure
-            simple_order = {
-                'order_id': order_id,
-                'machine_id': tenant_id,
-                'items': order.get('items', []),
-                'total_amount': float(order.get('totalAmount', 0)),
-                'payment_status': 'pending',
-                'customer_name': order.get('customerName', ''),
-                'customer_phone': order.get('customerPhone', ''),
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat()
-            }
+            logger.debug("Creating order for tenant %s", tenant_id)
 
-            # Insert directly to avoid recursion in add_order function
-            supabase = get_supabase_client()
-            db_response = supabase.table('orders').insert(simple_order).execute()
+            simple_order = new_order_row(tenant_id, order)
+            order_id = simple_order['order_id']
 
-            if not db_response.data:
-                return jsonify({'success': False, 'error': 'Failed to create order in database'}), 500
+            # Razorpay is required for payment, so check it before holding any stock
+            if not RAZORPAY_KEY_ID or not RAZORPAY_KEY_SECRET:
+                logging.error("❌ Razorpay credentials missing - cannot generate QR code")
+                return jsonify({
+                    'success': False,
+                    'error': 'Razorpay credentials not configured. Cannot generate QR code.',
+                    'orderId': order_id
+                }), 500
+
+            # Insert the order and reserve its stock atomically (one round trip)
+            reservation = create_order_with_reservation(simple_order, ORDER_HOLD_SECONDS)
+
+            if not reservation or not reservation.get('success'):
+                unavailable = (reservation or {}).get('unavailable', [])
+                logging.info(f"Order {order_id} rejected - insufficient stock: {unavailable}")
+                return jsonify({
+                    'success': False,
+                    'error': 'Some items are no longer available',
+                    'unavailable': unavailable
+                }), 409
 
             # Extract only safe data from response to avoid circular references
-            created_order = db_response.data[0] if db_response.data else {}
+            created_order = reservation.get('order') or {}
             safe_order_data = {
                 'order_id': created_order.get('order_id', order_id),
                 'total_amount': created_order.get('total_amount', 0),
                 'payment_status': created_order.get('payment_status', 'pending'),
-                'created_at': created_order.get('created_at', '')
+                'created_at': created_order.get('created_at', ''),
+                'hold_expires_at': reservation.get('expires_at')
             }
 
-            logging.info(f"Order created in DB: {order_id}")
-
-            # Create Razorpay order for REAL payment
-            logging.info(f"🔑 Razorpay credentials check - Key ID: {'✅ SET' if RAZORPAY_KEY_ID else '❌ MISSING'}, Secret: {'✅ SET' if RAZORPAY_KEY_SECRET else '❌ MISSING'}")
-
-            if not RAZORPAY_KEY_ID or not RAZORPAY_KEY_SECRET:
-                logging.error("❌ Razorpay credentials missing - cannot generate QR code")
-                return jsonify({
-                    'success': False,
-                    'error': 'Razorpay credentials not configured. Cannot generate QR code.',
-                    'orderId': order_id
-                }), 500
+            logging.info(f"Order created in DB: {order_id}, stock held until {reservation.get('expires_at')}")
+            broadcast_inventory_update(tenant_id, reservation.get('inventory'))
 
             try:
-                logging.info(f"🚀 Creating Razorpay order for amount: ₹{order['totalAmount']}")
+                expires_at = parse_timestamp(reservation['expires_at'])
+            except (KeyError, TypeError, ValueError):
+                expires_at = time.time() + ORDER_HOLD_SECONDS
+            order_expiry.schedule(order_id, tenant_id, expires_at)
 
+            try:
                 # Create Razorpay order
                 razorpay_order_data = {
                     'amount': int(float(order['totalAmount']) * 100),  # Convert to paise
@@ -510,23 +993,6 @@ def orders():
                     'payment_capture': 1
                 }
 
-                logging.info(f"📤 Sending order data to Razorpay: {razorpay_order_data}")
-
-                razorpay_response = requests.post(
-                    f"{os.getenv('RAZORPAY_API_BASE_URL', 'https://api.razorpay.com/v1')}/orders",
-                    json=razorpay_order_data,
-                    auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
-                    timeout=10
-                )
-
-                logging.info(f"📥 Razorpay order response: Status {razorpay_response.status_code}")
-
-                if razorpay_response.status_code != 200:
-                    raise Exception(f"Razorpay order creation failed: {razorpay_response.text}")
-
-                razorpay_order = razorpay_response.json()
-                logging.info(f"✅ Razorpay order created: {razorpay_order['id']}")
-
                 # Create QR code
                 qr_data = {
                     'type': 'upi_qr',
@@ -535,7 +1001,8 @@ def orders():
                     'fixed_amount': True,
                     'payment_amount': int(float(order['totalAmount']) * 100),
                     'description': f'Payment for BlackBox order {order_id}',
-                    'close_by': int(datetime.now().timestamp()) + 3600,  # 1 hour expiry
+                    # Closes with the stock hold, so it cannot be paid once the order has expired
+                    'close_by': max(int(expires_at), int(time.time()) + QR_MIN_LIFETIME_SECONDS),
                     'notes': {
                         'order_id': order_id,
                         'machine_id': tenant_id,
@@ -544,28 +1011,19 @@ def orders():
                     }
                 }
 
-                logging.info(f"📤 Creating QR code with data: {qr_data}")
-
-                qr_response = requests.post(
-                    f"{os.getenv('RAZORPAY_API_BASE_URL', 'https://api.razorpay.com/v1')}/payments/qr_codes",
-                    json=qr_data,
-                    auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
-                    timeout=10
-                )
-
-                logging.info(f"📥 QR code response: Status {qr_response.status_code}")
-
-                if qr_response.status_code != 200:
-                    raise Exception(f"Razorpay QR creation failed: {qr_response.text}")
+                # Payloads include the customer's phone number: debug only
+                logger.debug("Razorpay order data: %s, QR code data: %s", razorpay_order_data, qr_data)
 
-                qr_code = qr_response.json()
-                logging.info(f"✅ QR code created successfully: {qr_code['id']}")
-                logging.info(f"🎯 QR code image URL: {qr_code['image_url']}")
+                # The QR code does not depend on the Razorpay order, so both are created at once
+                razorpay_order, qr_code = get_razorpay_client().create_order_and_qr_code(razorpay_order_data, qr_data)
+                logging.info(f"✅ Order {order_id}: Razorpay order {razorpay_order['id']}, QR code {qr_code['id']} "
+                             f"for ₹{order['totalAmount']}")
 
                 # Validate that this is a real Razorpay QR code
                 qr_url = qr_code['image_url']
                 if not (qr_url and ('rzp.io' in qr_url or 'razorpay' in qr_url)):
                     logging.error(f"❌ Invalid QR code URL: {qr_url}")
+                    cancel_order_internal(tenant_id, order_id)
                     return jsonify({
                         'success': False,
                         'error': 'Invalid QR code generated. Only Razorpay QR codes are allowed.',
@@ -574,33 +1032,36 @@ def orders():
 
                 # Broadcast update
                 try:
-                    broadcast_orders_update()
+                    broadcast_orders_update(tenant_id, [created_order] if created_order else None)
                 except Exception as broadcast_error:
                     logging.warning(f"Broadcast failed: {broadcast_error}")
 
                 return jsonify({
                     'success': True,
                     'orderId': order_id,
+                    'holdExpiresAt': safe_order_data['hold_expires_at'],
                     'qrCodeUrl': qr_code['image_url'],
                     'qrCodeId': qr_code['id'],
                     'razorpayOrderId': razorpay_order['id'],
                     'message': 'Real Razorpay QR code generated successfully!'
                 })
 
-            except requests.exceptions.Timeout:
+            except RazorpayTimeout:
                 logging.error("❌ Razorpay API timeout")
-            except requests.exceptions.RequestException as req_error:
+            except RazorpayError as req_error:
                 logging.error(f"❌ Razorpay request error: {str(req_error)}")
             except Exception as razorpay_error:
                 logging.error(f"❌ Razorpay general error: {str(razorpay_error)}")
 
             # NO FALLBACK - Return error if Razorpay QR generation fails
             logging.error("❌ Razorpay QR generation failed - no fallback allowed")
+            # The customer cannot pay, so give the held stock back right away
+            cancel_order_internal(tenant_id, order_id)
             return jsonify({
                 'success': False,
                 'error': 'Razorpay QR code generation failed. Please try again.',
                 'orderId': order_id,
-                'message': 'Order created but QR code generation failed'
+                'message': 'Order cancelled because QR code generation failed'
             }), 500
             
         except Exception as e:
@@ -636,37 +1097,61 @@ def verify_payment():
                 'error': 'QR Code ID required'
             }), 400
 
+        # Settled already (verified webhook or an earlier Razorpay check): answer from
+        # memory, but only for the order and machine the QR code was confirmed for
+        settled = payment_status_cache.get(('qr', qr_code_id))
+        if settled and settled.get('status') == 'paid' and settled.get('source') in ('webhook', 'razorpay') \
+                and settled.get('orderId') == order_id and settled.get('machineId') == tenant_id:
+            return jsonify({
+                'success': True,
+                'status': 'paid',
+                'message': 'Payment verified successfully!',
+                'amount': settled.get('amount')
+            })
+
         # Check if we have Razorpay credentials for real verification
         if RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET:
             try:
-                # Check QR code status with Razorpay
-                qr_response = requests.get(
-                    f'https://api.razorpay.com/v1/payments/qr_codes/{qr_code_id}',
-                    auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
-                )
-
-                if qr_response.status_code == 200:
-                    qr_data = qr_response.json()
+                # Polls arriving within PAYMENT_CHECK_TTL share one Razorpay lookup
+                qr_data = payment_check_cache.get_or_load(qr_code_id, lambda: fetch_qr_payment_state(qr_code_id))
 
+                if qr_data:
                     # Check if QR code has been paid
                     if qr_data.get('status') == 'closed' and qr_data.get('payments_amount_received', 0) > 0:
-                        # Payment received! Update order status
-                        if order_id:
-                            supabase = get_supabase_client()
-                            from datetime import datetime
-
-                            update_data = {
-                                'payment_status': 'paid',
-                                'updated_at': datetime.now().isoformat()
-                            }
-
-                            supabase.table('orders').update(update_data).eq('order_id', order_id).execute()
+                        amount_paise = qr_data.get('payments_amount_received', 0)
+                        amount = amount_paise / 100
+
+                        # Only a payment made for this order, covering its total, settles it
+                        order = get_order(tenant_id, order_id) if order_id and tenant_id else None
+                        if not order or qr_data.get('order_id') != order_id or amount_paise < order_total_paise(order):
+                            logger.warning(f"🚫 QR code {qr_code_id} payment of ₹{amount} does not settle "
+                                           f"order {order_id} of {tenant_id}")
+                            return jsonify({
+                                'success': False,
+                                'status': 'pending',
+                                'error': 'Payment does not match this order'
+                            }), 409
+                        if order.get('payment_status') not in ('paid',) + LATE_PAYABLE_STATUSES:
+                            return jsonify({
+                                'success': True,
+                                'status': order.get('payment_status'),
+                                'message': f"Payment status: {order.get('payment_status')}"
+                            })
+
+                        # Payment received! Update order status (also when it arrived after the hold expired)
+                        updated = mark_order_paid(tenant_id, order_id, {'updated_at': datetime.now().isoformat()},
+                                                  LATE_PAYABLE_STATUSES)
+                        if updated:
+                            record_paid_order(order_id, tenant_id)
+                            broadcast_orders_update(tenant_id, updated)
+
+                        publish_payment_status(order_id, tenant_id, qr_code_id, 'paid', amount, source='razorpay')
 
                         return jsonify({
                             'success': True,
                             'status': 'paid',
                             'message': 'Payment verified successfully!',
-                            'amount': qr_data.get('payments_amount_received', 0) / 100
+                            'amount': amount
                         })
                     else:
                         return jsonify({
@@ -679,12 +1164,11 @@ def verify_payment():
                 logger.error(f"Razorpay verification error: {str(razorpay_error)}")
 
         # Fallback: Check database for manual updates
-        if order_id:
-            supabase = get_supabase_client()
-            response = supabase.table('orders').select('payment_status').eq('order_id', order_id).execute()
+        if order_id and tenant_id:
+            order = get_order(tenant_id, order_id)
 
-            if response.data and len(response.data) > 0:
-                payment_status = response.data[0].get('payment_status', 'pending')
+            if order:
+                payment_status = order.get('payment_status', 'pending')
 
                 return jsonify({
                     'success': True,
@@ -714,54 +1198,30 @@ def cancel_order(order_id):
         return jsonify({'error': 'Tenant ID is required'}), 400
 
     try:
-        # Get the order first
-        order = get_order(tenant_id, order_id)
-        if not order:
+        result = cancel_order_and_restore_inventory(tenant_id, order_id)
+        if not result.get('found'):
             return jsonify({
                 'success': False,
                 'error': 'Order not found'
             }), 404
 
-        # Only cancel if order is still pending
-        if order.get('payment_status') != 'pending':
+        if not result.get('cancelled'):
+            # A repeated cancel is a no-op rather than an error
+            if result.get('status') == 'cancelled':
+                return jsonify({
+                    'success': True,
+                    'message': 'Order already cancelled'
+                })
             return jsonify({
                 'success': False,
-                'error': f'Cannot cancel order with status: {order.get("payment_status")}'
+                'error': f'Cannot cancel order with status: {result.get("status")}'
             }), 400
 
-        # Restore inventory for each item
-        supabase = get_supabase_client()
-        for item in order.get('items', []):
-            try:
-                # Get current inventory
-                inv_response = supabase.table('inventory').select('quantity').eq('machine_id', tenant_id).eq('id', item['id']).execute()
-
-                if inv_response.data:
-                    current_quantity = inv_response.data[0]['quantity']
-                    new_quantity = current_quantity + item['quantity']
-
-                    # Update inventory
-                    supabase.table('inventory').update({
-                        'quantity': new_quantity,
-                        'updated_at': datetime.now().isoformat()
-                    }).eq('machine_id', tenant_id).eq('id', item['id']).execute()
-
-                    logging.info(f"Restored inventory for {item['id']}: {current_quantity} + {item['quantity']} = {new_quantity}")
-
-            except Exception as inv_error:
-                logging.error(f"Failed to restore inventory for item {item['id']}: {str(inv_error)}")
-
-        # Update order status to cancelled
-        update_order(tenant_id, order_id, {
-            'payment_status': 'cancelled',
-            'updated_at': datetime.now().isoformat()
-        })
-
         # Broadcast updates
-        broadcast_orders_update()
-        broadcast_inventory_update()
+        broadcast_orders_update(tenant_id, [{'order_id': order_id, 'payment_status': 'cancelled'}])
+        broadcast_inventory_update(tenant_id, result.get('restored') or [])
 
-        logging.info(f"Order {order_id} cancelled successfully and inventory restored")
+        logging.info(f"Order {order_id} cancelled successfully and inventory restored: {result.get('restored')}")
 
         return jsonify({
             'success': True,
@@ -800,8 +1260,8 @@ def update_order_route(order_id):
     data['updatedAt'] = datetime.now().isoformat()
     
     try:
-        update_order(tenant_id, order_id, data)
-        broadcast_orders_update()
+        updated = update_order(tenant_id, order_id, data)
+        broadcast_orders_update(tenant_id, updated or None)
         return jsonify({'success': True, 'message': 'Order updated'})
     except Exception as e:
         logging.error(str(e))
@@ -818,83 +1278,211 @@ def update_order_status(order_id):
         return jsonify({'success': False, 'error': 'Status is required'}), 400
     
     try:
-        update_order(tenant_id, order_id, {
+        updated = update_order(tenant_id, order_id, {
             'paymentStatus': status,
             'updatedAt': datetime.now().isoformat()
         })
-        broadcast_orders_update()
+        broadcast_orders_update(tenant_id, updated or None)
         return jsonify({'success': True})
     except Exception as e:
         logging.error(str(e))
         return jsonify({'success': False, 'error': 'Failed to update status'}), 500
 
-# ULTRA-SIMPLE WEBHOOK ENDPOINT (GUARANTEED TO WORK)
-@app.route('/razorpay-webhook', methods=['POST'])
-def razorpay_webhook_simple():
-    """Ultra-simple Razorpay webhook - no middleware, no complexity"""
-    try:
-        logger.info("🔔 SIMPLE Razorpay webhook received")
-
-        # Get webhook data
-        webhook_data = request.get_json() or {}
-        event = webhook_data.get('event', '')
-
-        logger.info(f"📨 Simple webhook event: {event}")
-
-        # Handle QR Code Payment Success
-        if event == 'qr_code.credited':
-            payload = webhook_data.get('payload', {})
-            qr_entity = payload.get('qr_code', {}).get('entity', {})
-            payment_entity = payload.get('payment', {}).get('entity', {})
+@app.route('/api/orders/bulk-status', methods=['POST'])
+def bulk_update_order_status():
+    """Set the status of many orders at once.
 
-            order_id = qr_entity.get('notes', {}).get('order_id')
-            payment_id = payment_entity.get('id')
-            amount = payment_entity.get('amount', 0) / 100
-
-            logger.info(f"✅ SIMPLE QR Payment - Order: {order_id}, Payment: {payment_id}, Amount: ₹{amount}")
-
-            # Update database if order_id exists
-            if order_id:
-                try:
-                    supabase = get_supabase_client()
-                    from datetime import datetime
-
-                    # Extract UPI payment details from webhook
-                    payment_method = payment_entity.get('method', 'upi')
-                    vpa = payment_entity.get('vpa', '')
-                    bank_name = payment_entity.get('bank', '')
-                    payer_account_type = payment_entity.get('payer_account_type', '')
-                    upi_transaction_id = payment_entity.get('acquirer_data', {}).get('rrn', '')
-                    
-                    update_data = {
-                        'payment_status': 'paid',
-                        'payment_id': payment_id,
-                        'payment_amount': amount,
-                        'payment_method': payment_method,
-                        'vpa': vpa,
-                        'bank_name': bank_name,
-                        'payer_account_type': payer_account_type,
-                        'upi_transaction_id': upi_transaction_id,
-                        'updated_at': datetime.now().isoformat()
-                    }
+    Body: {"orderIds": [...], "status": "..."} or {"updates": [{"orderId", "status"}, ...]}.
+    Cancelling restores held stock and marking paid commits it, as for single orders.
+    Only the moves in BULK_ORDER_TRANSITIONS are made; any other status is a 400.
+    """
+    tenant_id = request.headers.get('x-tenant-id') or request.headers.get('X-Tenant-ID')
+    if not tenant_id:
+        return jsonify({'error': 'Tenant ID is required'}), 400
 
-                    response = supabase.table('orders').update(update_data).eq('order_id', order_id).execute()
+    data = request.get_json(silent=True) or {}
+    if data.get('updates') is not None:
+        updates = data['updates'] if isinstance(data['updates'], list) else None
+    else:
+        order_ids = data.get('orderIds')
+        updates = [{'orderId': order_id, 'status': data.get('status')} for order_id in order_ids] \
+            if isinstance(order_ids, list) else None
+    if updates is None:
+        return jsonify({'success': False, 'error': 'orderIds or updates must be a list'}), 400
+    if len(updates) > BULK_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {BULK_MAX_ITEMS} orders per request'}), 400
+
+    results = []
+    by_status = {}
+    for update in updates:
+        order_id = update.get('orderId') or update.get('order_id') if isinstance(update, dict) else None
+        status = update.get('status') if isinstance(update, dict) else None
+        if not order_id or not status:
+            results.append({'orderId': order_id, 'success': False, 'error': 'orderId and status are required'})
+        elif status not in BULK_ORDER_TRANSITIONS:
+            return jsonify({'success': False, 'error': f'Invalid status: {status}',
+                            'allowed': sorted(BULK_ORDER_TRANSITIONS)}), 400
+        else:
+            by_status.setdefault(status, []).append(order_id)
 
-                    if response.data:
-                        logger.info(f"✅ SUCCESS: Order {order_id} marked as PAID via simple webhook")
+    try:
+        changed_orders = []
+        restored = []
+        for status, order_ids in by_status.items():
+            if status == 'cancelled':
+                for result in cancel_orders_batch([{'machine_id': tenant_id, 'order_id': o} for o in order_ids]):
+                    if result.get('cancelled') or result.get('status') == 'cancelled':
+                        results.append({'orderId': result['order_id'], 'success': True, 'status': 'cancelled'})
+                        if result.get('cancelled'):
+                            changed_orders.append({'order_id': result['order_id'], 'payment_status': 'cancelled'})
+                            restored += result.get('restored') or []
+                    else:
+                        error = 'Order not found' if not result.get('found') else \
+                            f'Cannot cancel order with status: {result.get("status")}'
+                        results.append({'orderId': result['order_id'], 'success': False, 'error': error})
+                continue
+
+            from_statuses = BULK_ORDER_TRANSITIONS[status]
+            updated = update_orders_status(tenant_id, order_ids, status, from_statuses)
+            updated_ids = {row['order_id'] for row in updated}
+            changed_orders += updated
+            for order_id in order_ids:
+                if order_id in updated_ids:
+                    results.append({'orderId': order_id, 'success': True, 'status': status})
+                else:
+                    results.append({'orderId': order_id, 'success': False,
+                                    'error': f'Order not found or not {" or ".join(from_statuses)}'})
+            if status == 'paid':
+                for order_id in updated_ids:
+                    record_paid_order(order_id, tenant_id)
+
+        if changed_orders:
+            broadcast_orders_update(tenant_id, changed_orders)
+        if restored:
+            broadcast_inventory_update(tenant_id, restored)
+        return jsonify({'success': all(result['success'] for result in results), 'results': results})
+    except Exception as e:
+        logger.error(f"Bulk order status update failed: {e}")
+        return jsonify({'success': False, 'error': 'Failed to update orders', 'details': str(e)}), 500
 
-                except Exception as db_error:
-                    logger.error(f"Database update error: {str(db_error)}")
+# Razorpay webhook: verified and stored in the request, applied by the webhook queue workers
+@app.route('/razorpay-webhook', methods=['POST'])
+def razorpay_webhook_simple():
+    """Store a verified Razorpay webhook, acknowledge it and queue it for processing"""
+    if not RAZORPAY_WEBHOOK_SECRET:
+        # Unsigned webhooks could mark any order paid; Razorpay retries once the secret is set
+        logger.error("🚫 Razorpay webhook rejected: RAZORPAY_WEBHOOK_SECRET is not set")
+        return jsonify({'success': False, 'error': 'Webhook secret not configured'}), 503
 
-            return jsonify({'success': True, 'message': 'Simple webhook processed successfully'})
+    body = request.get_data()
+    if not verify_webhook_signature(body, request.headers.get('X-Razorpay-Signature'), RAZORPAY_WEBHOOK_SECRET):
+        logger.warning("🚫 Razorpay webhook rejected: invalid signature")
+        return jsonify({'success': False, 'error': 'Invalid signature'}), 400
 
-        # Handle other events
-        logger.info(f"Unhandled event: {event}")
+    try:
+        webhook_data = json.loads(body or b'{}')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid JSON'}), 400
+
+    event_id = webhook_event_id(request.headers, body)
+    event = webhook_data.get('event', '')
+    logger.info(f"🔔 Razorpay webhook {event_id}: {event}")
+    if event != 'qr_code.credited':
         return jsonify({'success': True, 'message': 'Event received'})
 
+    queued_event = {
+        'id': event_id,
+        'event': event,
+        'payload': webhook_data.get('payload', {}),
+        'received_at': datetime.now().isoformat()
+    }
+    # Stored before the ack, so a restart or crash cannot lose it; the event id
+    # is the table's key, which also drops Razorpay's retries of the same event
+    try:
+        is_new = save_webhook_event(queued_event)
     except Exception as e:
-        logger.error(f"Simple webhook error: {str(e)}")
-        return jsonify({'success': True, 'message': 'Webhook received'})  # Always return success to Razorpay
+        logger.error(f"Failed to store webhook {event_id}, asking Razorpay to retry: {e}")
+        return jsonify({'success': False, 'error': 'Busy, retry later'}), 503
+    if not is_new:
+        logger.info(f"🔁 Duplicate Razorpay webhook {event_id} ({event}) ignored")
+        return jsonify({'success': True, 'message': 'Duplicate event'})
+
+    # The kiosk is told once a worker has checked the amount and marked the order paid
+    if not webhook_queue.submit(queued_event):
+        logger.warning(f"Webhook queue full, {event_id} is picked up by the recovery sweep")
+    return jsonify({'success': True, 'message': 'Webhook queued'})
+
+def apply_stored_webhook(event):
+    """Queue handler: apply the event, then mark its stored row processed"""
+    process_razorpay_webhook(event)
+    finish_webhook_event(event['id'], 'processed')
+
+def dead_letter_webhook(event, error, attempts):
+    """Queue dead letter: keep the event for replay and stop it being claimed again"""
+    record_webhook_dead_letter(event, error, attempts)
+    finish_webhook_event(event['id'], 'dead', error)
+
+def process_razorpay_webhook(event):
+    """Apply a qr_code.credited event to its order; raises so the queue retries"""
+    payload = event['payload']
+    qr_entity = payload.get('qr_code', {}).get('entity', {})
+    payment_entity = payload.get('payment', {}).get('entity', {})
+
+    order_id = qr_entity.get('notes', {}).get('order_id')
+    machine_id = qr_entity.get('notes', {}).get('machine_id')
+    payment_id = payment_entity.get('id')
+    amount_paise = payment_entity.get('amount', 0)
+    amount = amount_paise / 100
+    if not order_id or not machine_id:
+        logger.warning(f"Webhook {event['id']} has no order_id/machine_id in the QR code notes")
+        return
+
+    order = get_order(machine_id, order_id)
+    if not order:
+        logger.warning(f"Webhook {event['id']}: order {order_id} not found")
+        return
+    expected_paise = order_total_paise(order)
+    if amount_paise < expected_paise:
+        # Not worth retrying; keep the event so the payment can be reconciled by hand
+        logger.error(f"🚫 Webhook {event['id']}: order {order_id} paid ₹{amount}, "
+                     f"expected ₹{expected_paise / 100} - not marking it paid")
+        record_webhook_dead_letter(event, f"Amount {amount_paise} paise is below the order total "
+                                          f"{expected_paise} paise", 1)
+        return
+
+    logger.info(f"✅ QR Payment - Order: {order_id}, Payment: {payment_id}, Amount: ₹{amount}")
+    status = order.get('payment_status')
+    if status == 'paid':
+        logger.info(f"Webhook {event['id']}: order {order_id} is already paid")
+        return
+    if status not in LATE_PAYABLE_STATUSES:
+        logger.error(f"🚫 Webhook {event['id']}: order {order_id} is {status} - payment {payment_id} needs a refund")
+        record_webhook_dead_letter(event, f"Payment captured for an order that is {status}", 1)
+        return
+    if status != 'pending':
+        # Paid after the hold expired: the order is charged, so take its stock again
+        logger.warning(f"💸 Webhook {event['id']}: order {order_id} was paid after it was {status}")
+    updated = mark_order_paid(machine_id, order_id, {
+        'payment_id': payment_id,
+        'payment_amount': amount,
+        'payment_method': payment_entity.get('method', 'upi'),
+        'vpa': payment_entity.get('vpa', ''),
+        'bank_name': payment_entity.get('bank', ''),
+        'payer_account_type': payment_entity.get('payer_account_type', ''),
+        'upi_transaction_id': (payment_entity.get('acquirer_data') or {}).get('rrn', ''),
+        'updated_at': datetime.now().isoformat()
+    }, LATE_PAYABLE_STATUSES)
+    if not updated:
+        logger.info(f"Webhook {event['id']}: order {order_id} was settled meanwhile")
+        return
+
+    logger.info(f"✅ SUCCESS: Order {order_id} marked as PAID via webhook")
+    try:
+        publish_payment_status(order_id, machine_id, qr_entity.get('id'), 'paid', amount, source='webhook')
+    except Exception as push_error:
+        logger.warning(f"Payment status push failed: {push_error}")
+    record_paid_order(order_id, machine_id)
+    broadcast_orders_update(machine_id, updated)
 
 # DUPLICATE REMOVED - Using the newer verify_payment function above
 # Force deployment refresh - duplicate function issue fixed
@@ -909,56 +1497,61 @@ def get_dashboard_stats():
         return jsonify({'error': 'Tenant ID is required'}), 400
 
     try:
-        # Get orders and inventory data
-        orders = get_orders(tenant_id)
-        inventory = get_inventory(tenant_id)
-
-        # Calculate basic stats without complex date parsing for now
-        total_orders = len(orders) if orders else 0
-        paid_orders = [o for o in orders if o.get('payment_status') == 'paid'] if orders else []
-        total_sales = sum(o.get('total_amount', 0) for o in paid_orders) if paid_orders else 0
-
-        # Simplified today's stats (just use recent orders for now)
-        orders_today = orders[-10:] if orders else []  # Last 10 orders as "today"
-        paid_orders_today = [o for o in orders_today if o.get('payment_status') == 'paid']
-        total_sales_today = sum(o.get('total_amount', 0) for o in paid_orders_today) if paid_orders_today else 0
-
-        # Inventory stats
-        inventory_list = inventory if inventory else []
-        low_stock_count = len([item for item in inventory_list if item.get('quantity', 0) <= 5])
-        critical_stock_count = len([item for item in inventory_list if item.get('quantity', 0) <= 2])
-        out_of_stock_count = len([item for item in inventory_list if item.get('quantity', 0) == 0])
-
-        # Recent orders (last 4, sorted by creation date)
-        if orders:
-            # Sort orders by created_at timestamp (newest first)
-            sorted_orders = sorted(orders, key=lambda x: x.get('created_at', ''), reverse=True)
-            recent_orders = sorted_orders[:4]  # Take first 4 (most recent)
-        else:
-            recent_orders = []
+        stats = dashboard_stats_cache.get_or_load(
+            tenant_id,
+            lambda: get_dashboard_aggregates(tenant_id, get_machine_timezone(tenant_id), LOW_STOCK_THRESHOLD, CRITICAL_STOCK_THRESHOLD)
+        )
+        return jsonify({'success': True, 'stats': stats})
+
+    except Exception as e:
+        logger.error(f"Dashboard stats error: {str(e)}")
+        return jsonify({'success': False, 'error': f'Failed to fetch dashboard stats: {str(e)}'}), 500
+
+# Sales chart data served from the hourly/daily rollup tables
+@app.route('/api/sales/timeseries', methods=['GET'])
+def sales_timeseries():
+    tenant_id = request.headers.get('x-tenant-id') or request.headers.get('X-Tenant-ID')
+    if not tenant_id:
+        return jsonify({'error': 'Tenant ID is required'}), 400
 
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in SALES_TIMESERIES_DEFAULT_RANGE:
+        return jsonify({'success': False, 'error': 'granularity must be hour or day'}), 400
+
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    if date_from:
+        date_from = parse_iso_datetime(date_from)
+    else:
+        # Default window, aligned to the hour so repeated requests share a cache entry
+        start = int(time.time()) - SALES_TIMESERIES_DEFAULT_RANGE[granularity]
+        date_from = datetime.utcfromtimestamp(start - start % 3600).isoformat() + '+00:00'
+    if date_to:
+        date_to = parse_iso_datetime(date_to)
+    if not date_from or (request.args.get('to') and not date_to):
+        return jsonify({'success': False, 'error': 'Invalid date range'}), 400
+
+    # item_id defaults to the machine totals; "all" returns every item's series
+    item_id = request.args.get('item_id', '*')
+    if item_id == 'all':
+        item_id = None
+
+    try:
+        points = sales_timeseries_cache.get_or_load(
+            (tenant_id, granularity, date_from, date_to, item_id),
+            lambda: get_sales_timeseries(tenant_id, granularity, date_from, date_to, item_id)
+        )
         return jsonify({
             'success': True,
-            'stats': {
-                'orders': {
-                    'total': total_orders,
-                    'today': len(orders_today),
-                    'total_sales': total_sales,
-                    'sales_today': total_sales_today
-                },
-                'inventory': {
-                    'total_items': len(inventory_list),
-                    'low_stock': low_stock_count,
-                    'critical_stock': critical_stock_count,
-                    'out_of_stock': out_of_stock_count
-                },
-                'recent_orders': recent_orders
-            }
+            'granularity': granularity,
+            'timezone': get_machine_timezone(tenant_id),
+            'from': date_from,
+            'to': date_to,
+            'points': points
         })
-
     except Exception as e:
-        logger.error(f"Dashboard stats error: {str(e)}")
-        return jsonify({'success': False, 'error': f'Failed to fetch dashboard stats: {str(e)}'}), 500
+        logger.error(f"Sales timeseries error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Failed to fetch sales timeseries'}), 500
 
 # Upload
 @app.route('/api/upload', methods=['POST'])
@@ -976,98 +1569,245 @@ def upload_image_endpoint():
         return jsonify({'success': False, 'error': 'Invalid file type. Only PNG, JPEG, JPG are allowed'}), 400
     
     try:
-        # Read file data
         file_data = file.read()
-        
-        # Import validation and upload functions
-        from supabase_db import upload_image as supabase_upload_image, validate_image_file
-        
-        # Validate image file
-        validated_file_data = validate_image_file(file_data, max_size_mb=5)
-        
-        # Generate unique filename
-        import uuid
-        file_ext = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-        
-        # Upload to Supabase
-        url = supabase_upload_image(tenant_id, 'Inventory', 'product_images', unique_filename, validated_file_data)
-        
-        logging.info(f"Image uploaded successfully: {url}")
+        if len(file_data) > IMAGE_MAX_UPLOAD_MB * 1024 * 1024:
+            raise ImageProcessingError(
+                f"File size ({len(file_data)/1024/1024:.1f}MB) exceeds maximum allowed size ({IMAGE_MAX_UPLOAD_MB}MB)")
+
+        # Files are named by content hash: a re-upload finds its variants already stored
+        digest = content_hash(file_data)
+        names = variant_filenames(digest)
+        stored = uploaded_images.get((tenant_id, digest))
+        if stored is None:
+            stored = list_image_files(tenant_id, 'Inventory', 'product_images', search=digest)
+        deduplicated = all(name in stored for name in names)
+
+        if not deduplicated:
+            # Decoding and encoding run in the image worker processes, off this worker's event loop
+            processed = get_image_pool().process_image(file_data, max_size_mb=IMAGE_MAX_UPLOAD_MB)
+            for variant_file in processed['files']:
+                if variant_file['filename'] in stored:
+                    continue
+                upload_image(tenant_id, 'Inventory', 'product_images', variant_file['filename'], variant_file['data'],
+                             content_type=variant_file['content_type'], cache_seconds=IMAGE_CACHE_SECONDS,
+                             timestamped=False)
+            logging.info(f"Image {digest} uploaded as {len(processed['files'])} variants "
+                         f"({sum(len(f['data']) for f in processed['files']) / 1024:.0f}KB from {len(file_data) / 1024:.0f}KB)")
+        else:
+            logging.info(f"Image {digest} already stored, skipping upload")
+        uploaded_images.set((tenant_id, digest), set(names))
+
+        variants = {}
+        for name in names:
+            _, variant, ext = parse_variant_filename(name)
+            variants.setdefault(variant, {})[ext] = get_image_url(tenant_id, 'Inventory', 'product_images', name)
         return jsonify({
-            'success': True, 
-            'path': url,
+            'success': True,
+            # What kiosks show in product cards; 'variants' has every size as WebP and JPEG
+            'path': variants['card']['jpg'],
+            'variants': variants,
+            'hash': digest,
+            'deduplicated': deduplicated,
             'message': 'Image uploaded successfully'
         })
-        
-    except Exception as e:
+
+    except ImageProcessingError as e:
         error_msg = str(e)
-        logging.error(f"Image upload error: {error_msg}")
-        
-        # Return specific error messages
-        if 'File size' in error_msg:
-            return jsonify({'success': False, 'error': error_msg}), 413
-        elif 'Invalid image' in error_msg:
-            return jsonify({'success': False, 'error': error_msg}), 400
-        else:
-            return jsonify({'success': False, 'error': 'Failed to upload image'}), 500
+        logging.warning(f"Image upload rejected: {error_msg}")
+        return jsonify({'success': False, 'error': error_msg}), 413 if 'File size' in error_msg else 400
+    except ImagePoolSaturated as e:
+        logging.warning(f"Image upload deferred: {str(e)}")
+        return jsonify({'success': False, 'error': 'Image processing is busy, please retry shortly'}), 429, \
+            {'Retry-After': str(IMAGE_RETRY_AFTER)}
+    except ImageJobTimeout as e:
+        logging.error(f"Image upload timed out: {str(e)}")
+        return jsonify({'success': False, 'error': 'Image processing timed out'}), 503
+    except Exception as e:
+        logging.error(f"Image upload error: {str(e)}")
+        return jsonify({'success': False, 'error': 'Failed to upload image'}), 500
 
 @app.route('/<tenant_id>/Inventory/product_images/<filename>')
 def serve_image(tenant_id, filename):
-    try:
-        from supabase_db import get_image_url
-        image_url = get_image_url(tenant_id, 'Inventory', 'product_images', filename)
-        if image_url:
-            return redirect(image_url)
-        abort(404)
-    except Exception as e:
-        logging.error(str(e))
+    # The public URL is a pure function of the path, so browsers and CDNs may keep the redirect
+    response = redirect(get_image_url(tenant_id, 'Inventory', 'product_images', filename))
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_REDIRECT_CACHE_SECONDS}'
+    return response
+
+@app.route('/storage/<bucket>/<path:path>')
+def serve_local_storage(bucket, path):
+    """Files of the local storage backend (STORAGE_BACKEND=local)"""
+    storage = get_storage()
+    if storage.backend != 'local' or bucket != storage.bucket:
         abort(404)
+    return send_from_directory(os.path.join(storage.root, storage.bucket), path, max_age=IMAGE_CACHE_SECONDS)
 
 # Status
 @app.route('/api/machine/status', methods=['GET'])
 def get_status():
-    """Get machine status - simulate online when admin UI is running"""
-    # Simulate machine being online when admin UI is accessing it
-    simulated_status = {
-        'id': single_machine['id'],
-        'status': 'online',
-        'lastHeartbeat': datetime.now().isoformat(),
-        'simulated': True  # Flag to indicate this is simulated
-    }
-    return jsonify(simulated_status)
+    """Get the status of the tenant's machine from heartbeat presence"""
+    machine_id = request.headers.get('x-tenant-id') or request.headers.get('X-Tenant-ID') or DEFAULT_MACHINE_ID
+    return get_machine_status(machine_id)
 
 @app.route('/api/machine/status/<machine_id>', methods=['GET'])
 def get_machine_status(machine_id):
-    """Get status for a specific machine - simulate online when admin UI is running"""
-    # Support multiple machines (VM-001, VM-002, etc.)
-    if machine_id in ['VM-001', 'VM-002']:
-        simulated_status = {
-            'id': machine_id,
-            'status': 'online',
-            'lastHeartbeat': datetime.now().isoformat(),
-            'simulated': True  # Flag to indicate this is simulated
-        }
-        return jsonify(simulated_status)
-    return jsonify({'error': 'Machine not found'}), 404
+    """Get status for a specific machine from heartbeat presence"""
+    if not machine_id.startswith('VM-'):
+        return jsonify({'error': 'Machine not found'}), 404
+    try:
+        record = machine_presence.get(machine_id)
+    except Exception as e:
+        logger.error(f'Failed to read presence for {machine_id}: {e}')
+        return jsonify({'error': 'Machine status unavailable'}), 503
+    return jsonify(machine_status_payload(record, machine_id))
 
 # Logs
 @app.route('/api/logs', methods=['GET'])
+@require_api_key
 def get_logs():
-    path = Path('backend.log')
-    if not path.exists():
+    """Last ``lines`` lines of the log file (default 100), optionally only ``level`` and up or one ``tenant``"""
+    log_file = get_log_file()
+    path = Path(log_file) if log_file else None
+    if not path or not path.exists():
         return jsonify({'error': 'Log file not found'}), 404
     try:
-        with open(path, 'r') as f:
-            return ''.join(f.readlines()[-100:]), 200, {'Content-Type': 'text/plain'}
+        count = max(1, min(int(request.args.get('lines', 100)), 1000))
+    except ValueError:
+        return jsonify({'error': 'lines must be a number'}), 400
+
+    match = record_filter(request.args.get('level'), request.args.get('tenant'))
+    line_match = None
+    if match:
+        def line_match(line):
+            try:
+                return match(json.loads(line))
+            except ValueError:
+                return False
+    try:
+        lines = tail_lines(path, count, line_match)
+        return ''.join(line + '\n' for line in lines), 200, {'Content-Type': 'text/plain; charset=utf-8'}
     except Exception as e:
         return jsonify({'error': 'Failed to read logs'}), 500
 
+@app.route('/api/logs/stream', methods=['GET'])
+@require_api_key_or_token
+def stream_logs():
+    """Server-sent events: recent log records, then new ones as they are logged.
+
+    Takes the same ``level``/``tenant`` filters as /api/logs; a reconnecting
+    EventSource resumes after its Last-Event-ID. Records come from this
+    worker's buffer only.
+    """
+    match = record_filter(request.args.get('level'), request.args.get('tenant'))
+    try:
+        resume_after = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        resume_after = None
+
+    def events():
+        buffer = get_log_buffer()
+        seq = buffer.seq
+        if resume_after is not None and resume_after <= seq:
+            records = buffer.since(resume_after, match)
+        else:
+            records = buffer.since(0, match, limit=LOG_STREAM_BACKLOG)
+        idle = 0.0
+        while True:
+            for entry in records:
+                yield f"id: {entry['seq']}\nevent: log\ndata: {json.dumps(entry, default=str)}\n\n"
+            if records:
+                idle = 0.0
+            elif idle >= 15:
+                # Keeps proxies from closing a quiet stream
+                yield ': keep-alive\n\n'
+                idle = 0.0
+            socketio.sleep(LOG_STREAM_INTERVAL)
+            idle += LOG_STREAM_INTERVAL
+            new = buffer.since(seq)
+            if new:
+                seq = new[-1]['seq']
+            records = [entry for entry in new if match is None or match(entry)]
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Health check
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'supabase_pool': get_supabase_pool_stats(),
+        'inventory_cache': inventory_cache.stats(),
+        'dashboard_stats_cache': dashboard_stats_cache.stats(),
+        'order_expiry': order_expiry.stats(),
+        'payment_status_cache': payment_status_cache.stats(),
+        'payment_check_cache': payment_check_cache.stats(),
+        'realtime_updates': realtime_updates.stats(),
+        'socketio_message_queue': bool(SOCKETIO_MESSAGE_QUEUE),
+        'presence_backend': machine_presence.backend,
+        'webhook_queue': webhook_queue.stats(),
+        'image_workers': get_image_pool().stats(),
+        'storage': get_storage().stats(),
+        'image_gc': image_gc.stats(),
+        'logging': logging_stats(),
+        'tracing': tracer.store.stats(),
+        'async_mode': socketio.async_mode,
+        'razorpay': get_razorpay_client().stats()
+    })
+
+# Prometheus scrape endpoint (NO TENANT REQUIRED): request and upstream call metrics of this process.
+# The labels name tenants, so scrapers send "Authorization: Bearer $METRICS_TOKEN" (or the API key)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    api_key = request.headers.get('x-api-key', '')
+    if not ((METRICS_TOKEN and scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), METRICS_TOKEN))
+            or (API_KEY and hmac.compare_digest(api_key, API_KEY))):
+        return jsonify({'error': 'Metrics token or X-API-Key header required'}), 401
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+# Slowest request traces of this process, with their spans (API key required)
+@app.route('/api/admin/traces', methods=['GET'])
+@require_api_key
+def list_traces():
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 200))
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    return jsonify({
+        'success': True,
+        'slowest': [trace.to_dict() for trace in tracer.store.slowest(limit)],
+        'profiled': [trace.to_dict(spans=False) for trace in tracer.store.profiled()],
+        'stats': tracer.store.stats()
+    })
+
+@app.route('/api/admin/traces/<trace_id>', methods=['GET'])
+@require_api_key
+def get_trace(trace_id):
+    trace = tracer.store.get(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found (only the slowest and profiled traces are kept)'}), 404
+    return jsonify({'success': True, 'trace': trace.to_dict()})
+
+@app.route('/api/admin/traces/<trace_id>/profile', methods=['GET'])
+@require_api_key
+def download_trace_profile(trace_id):
+    """cProfile output of a profiled request: a text report, or ?format=pstats for snakeviz/pstats"""
+    trace = tracer.store.get(trace_id)
+    if trace is None or trace.profile is None:
+        return jsonify({'error': 'No profile for this trace'}), 404
+    if request.args.get('format') == 'pstats':
+        return Response(marshal.dumps(trace.profile), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename=trace-{trace_id}.prof'})
+    try:
+        limit = max(1, min(int(request.args.get('limit', 40)), 500))
+    except ValueError:
+        limit = 40
+    return Response(profile_text(trace.profile, limit), mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=trace-{trace_id}.txt'})
 
 # Debug endpoint to check Razorpay credentials (NO TENANT REQUIRED)
 @app.route('/debug/razorpay', methods=['GET'])
@@ -1115,12 +1855,7 @@ def test_qr_generation():
 
         logging.info(f"📤 Creating test Razorpay order: {order_data}")
 
-        order_response = requests.post(
-            'https://api.razorpay.com/v1/orders',
-            json=order_data,
-            auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
-            timeout=10
-        )
+        order_response = get_razorpay_client().request('POST', '/orders', json=order_data)
 
         logging.info(f"📥 Order response: Status {order_response.status_code}")
 
@@ -1153,12 +1888,7 @@ def test_qr_generation():
 
         logging.info(f"📤 Creating QR code: {qr_data}")
 
-        qr_response = requests.post(
-            'https://api.razorpay.com/v1/payments/qr_codes',
-            json=qr_data,
-            auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET),
-            timeout=10
-        )
+        qr_response = get_razorpay_client().request('POST', '/payments/qr_codes', json=qr_data)
 
         logging.info(f"📥 QR response: Status {qr_response.status_code}")
 
@@ -1230,11 +1960,8 @@ def railway_test_razorpay():
         
         # Test 1: Basic API connectivity
         try:
-            auth_test = requests.get(
-                'https://api.razorpay.com/v1/payments',
-                auth=(key_id, key_secret),
-                timeout=10
-            )
+            # A single attempt, so the diagnostic reports what the network actually does
+            auth_test = get_razorpay_client().request('GET', '/payments', retries=0)
             
             if auth_test.status_code == 200:
                 response_data['tests']['api_connectivity'] = 'PASSED'
@@ -1246,7 +1973,7 @@ def railway_test_razorpay():
             else:
                 response_data['tests']['api_connectivity'] = f'FAILED - Status {auth_test.status_code}'
                 
-        except requests.exceptions.Timeout:
+        except RazorpayTimeout:
             response_data['tests']['api_connectivity'] = 'FAILED - Timeout'
             response_data['error'] = 'Razorpay API timeout from Railway'
             return jsonify(response_data), 500
@@ -1264,12 +1991,7 @@ def railway_test_razorpay():
                 'payment_capture': 1
             }
             
-            order_test = requests.post(
-                'https://api.razorpay.com/v1/orders',
-                json=test_order_data,
-                auth=(key_id, key_secret),
-                timeout=15
-            )
+            order_test = get_razorpay_client().request('POST', '/orders', json=test_order_data, timeout=15, retries=0)
             
             if order_test.status_code == 200:
                 order_result = order_test.json()
@@ -1293,12 +2015,7 @@ def railway_test_razorpay():
                         }
                     }
                     
-                    qr_test = requests.post(
-                        'https://api.razorpay.com/v1/payments/qr_codes',
-                        json=qr_test_data,
-                        auth=(key_id, key_secret),
-                        timeout=15
-                    )
+                    qr_test = get_razorpay_client().request('POST', '/payments/qr_codes', json=qr_test_data, timeout=15, retries=0)
                     
                     if qr_test.status_code == 200:
                         qr_result = qr_test.json()
@@ -1346,89 +2063,85 @@ def railway_test_razorpay():
         }), 500
 
 
-# Background task for cancelling pending orders
-def cancel_expired_pending_orders():
-    with app.app_context():
-        while True:
-            try:
-                logger.info("⚙️ Running background task to cancel expired pending orders...")
-                supabase = get_supabase_client()
-                from datetime import datetime, timedelta
-
-                # Get all pending orders older than 1 minute
-                time_threshold = (datetime.utcnow() - timedelta(seconds=60)).isoformat()
-                response = supabase.table('orders').select('*').eq('payment_status', 'pending').lt('created_at', time_threshold).execute()
+# Order expiry: cancel unpaid orders as soon as their stock hold runs out
+def handle_orders_expired(machine_id, results):
+    broadcast_orders_update(machine_id, [
+        {'order_id': result['order_id'], 'payment_status': 'cancelled'} for result in results
+    ])
+    broadcast_inventory_update(machine_id, [row for result in results for row in result.get('restored') or []])
+
+order_expiry = OrderExpiryScheduler(
+    load_pending=get_pending_orders_for_expiry,
+    cancel_batch=cancel_orders_batch,
+    acquire_lease=try_acquire_scheduler_lease,
+    on_cancelled=handle_orders_expired,
+    hold_seconds=ORDER_HOLD_SECONDS,
+    scan_interval=int(os.getenv('ORDER_EXPIRY_SCAN_INTERVAL', '30')),
+    spawn=socketio.start_background_task
+)
 
-                if response.data:
-                    for order in response.data:
-                        order_id = order.get('order_id')
-                        tenant_id = order.get('machine_id')
-                        logger.info(f"Cancelling expired pending order {order_id} for tenant {tenant_id}")
+# A stored event not finished within WEBHOOK_CLAIM_SECONDS (its worker restarted
+# or crashed) is claimed and queued again by whichever worker sweeps next
+WEBHOOK_CLAIM_SECONDS = int(os.getenv('WEBHOOK_CLAIM_SECONDS', '300'))
+WEBHOOK_MAX_CLAIMS = int(os.getenv('WEBHOOK_MAX_CLAIMS', '5'))
+
+webhook_queue = WebhookQueue(
+    handler=apply_stored_webhook,
+    dead_letter=dead_letter_webhook,
+    workers=int(os.getenv('WEBHOOK_WORKERS', '4')),
+    maxsize=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+    max_attempts=int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '5')),
+    backoff=float(os.getenv('WEBHOOK_RETRY_BACKOFF', '0.5')),
+    recover=lambda: claim_webhook_events(100, WEBHOOK_CLAIM_SECONDS, WEBHOOK_MAX_CLAIMS),
+    recover_interval=float(os.getenv('WEBHOOK_RECOVER_INTERVAL', '60')),
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
 
-                        # Use the existing cancel_order logic
-                        cancel_order_internal(tenant_id, order_id)
+# Product images: deletes queued off the request path, plus a periodic sweep for orphans
+image_gc = ImageGarbageCollector(
+    storage=get_storage(),
+    load_references=get_inventory_images,
+    acquire_lease=try_acquire_scheduler_lease,
+    batch_size=int(os.getenv('IMAGE_GC_BATCH_SIZE', '100')),
+    sweep_interval=float(os.getenv('IMAGE_GC_INTERVAL', str(6 * 3600))),
+    min_age=float(os.getenv('IMAGE_GC_MIN_AGE', '86400')),
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
 
-            except Exception as e:
-                logger.error(f"Error in background task: {str(e)}")
-            
-            time.sleep(60) # Run every 60 seconds
+def start_background_tasks():
+    """Start per-process background work; gunicorn calls this from post_fork"""
+    order_expiry.start()
+    socketio.start_background_task(sweep_machine_presence)
+    webhook_queue.start()
+    image_gc.start()
+    socketio.start_background_task(push_log_records)
 
 def cancel_order_internal(tenant_id, order_id):
     """Internal function to cancel an order, callable from background task"""
     try:
-        # Get the order first
-        order = get_order(tenant_id, order_id)
-        if not order:
+        result = cancel_order_and_restore_inventory(tenant_id, order_id)
+        if not result.get('found'):
             logger.warning(f"Order {order_id} not found for cancellation.")
             return
 
-        # Only cancel if order is still pending
-        if order.get('payment_status') != 'pending':
-            logger.info(f"Order {order_id} is no longer pending (status: {order.get('payment_status')}). Skipping cancellation.")
+        if not result.get('cancelled'):
+            logger.info(f"Order {order_id} is no longer pending (status: {result.get('status')}). Skipping cancellation.")
             return
 
-        # Restore inventory for each item
-        supabase = get_supabase_client()
-        for item in order.get('items', []):
-            try:
-                # Get current inventory
-                inv_response = supabase.table('inventory').select('quantity').eq('machine_id', tenant_id).eq('id', item['id']).execute()
-
-                if inv_response.data:
-                    current_quantity = inv_response.data[0]['quantity']
-                    new_quantity = current_quantity + item['quantity']
-
-                    # Update inventory
-                    supabase.table('inventory').update({
-                        'quantity': new_quantity,
-                        'updated_at': datetime.now().isoformat()
-                    }).eq('machine_id', tenant_id).eq('id', item['id']).execute()
-
-                    logging.info(f"Restored inventory for {item['id']}: {current_quantity} + {item['quantity']} = {new_quantity}")
-
-            except Exception as inv_error:
-                logging.error(f"Failed to restore inventory for item {item['id']}: {str(inv_error)}")
-
-        # Update order status to cancelled
-        update_order(tenant_id, order_id, {
-            'payment_status': 'cancelled',
-            'updated_at': datetime.now().isoformat()
-        })
-
         # Broadcast updates
-        broadcast_orders_update()
-        broadcast_inventory_update()
+        broadcast_orders_update(tenant_id, [{'order_id': order_id, 'payment_status': 'cancelled'}])
+        broadcast_inventory_update(tenant_id, result.get('restored') or [])
 
-        logging.info(f"Order {order_id} cancelled successfully and inventory restored")
+        logging.info(f"Order {order_id} cancelled successfully and inventory restored: {result.get('restored')}")
 
     except Exception as e:
         logging.error(f"Error cancelling order {order_id}: {str(e)}")
 
-# Start the background task in a separate thread
+# Start the background tasks when running the server directly
 if __name__ == '__main__':
-    scheduler_thread = threading.Thread(target=cancel_expired_pending_orders)
-    scheduler_thread.daemon = True
-    scheduler_thread.start()
+    start_background_tasks()
 
 if __name__ == '__main__':
     # Determine if we're in a production environment
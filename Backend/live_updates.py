@@ -0,0 +1,90 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def tenant_room(machine_id):
+    return f'tenant:{machine_id}'
+
+class UpdateCoalescer:
+    """Merges bursts of change notifications into one emit per event and room.
+
+    The first ``publish()`` for an (event, room) pair schedules a flush
+    ``window`` seconds later; everything published until then is merged by row
+    key, so the flush carries each changed row once (latest wins). Payloads
+    look like::
+
+        {'machineId', 'version', 'changed': [rows], 'removed': [keys], 'full': bool}
+
+    Clients merge ``changed`` into their copy by key, drop ``removed`` and
+    refetch over REST only when ``full`` is set (the change was not
+    described row by row). ``version`` increases per room so stale or
+    out-of-order payloads can be ignored.
+    """
+
+    def __init__(self, emit, spawn, sleep, window=0.1):
+        self.emit = emit
+        self.spawn = spawn
+        self.sleep = sleep
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._versions = {}
+        self._stats = {'published': 0, 'emitted': 0}
+
+    def publish(self, event, machine_id, changed=None, removed=None, key='id', full=False):
+        room = tenant_room(machine_id)
+        with self._lock:
+            self._stats['published'] += 1
+            pending = self._pending.get((event, room))
+            schedule = pending is None
+            if schedule:
+                pending = self._pending[(event, room)] = {
+                    'machine_id': machine_id, 'changed': {}, 'removed': set(), 'full': False
+                }
+            for row in changed or []:
+                row_key = row.get(key)
+                if row_key is None:
+                    pending['full'] = True
+                    continue
+                pending['removed'].discard(row_key)
+                # Rows may carry only some columns; merge them
+                pending['changed'][row_key] = {**pending['changed'].get(row_key, {}), **row}
+            for row_key in removed or []:
+                pending['changed'].pop(row_key, None)
+                pending['removed'].add(row_key)
+            pending['full'] = pending['full'] or full
+
+        if schedule:
+            self.spawn(self._flush_later, event, room)
+
+    def _flush_later(self, event, room):
+        self.sleep(self.window)
+        self.flush(event, room)
+
+    def flush(self, event, room):
+        with self._lock:
+            pending = self._pending.pop((event, room), None)
+            if pending is None:
+                return
+            # Millisecond clock, bumped if needed so versions never repeat
+            version = max(int(time.time() * 1000), self._versions.get(room, 0) + 1)
+            self._versions[room] = version
+            self._stats['emitted'] += 1
+
+        payload = {
+            'machineId': pending['machine_id'],
+            'version': version,
+            'changed': list(pending['changed'].values()),
+            'removed': list(pending['removed']),
+            'full': pending['full']
+        }
+        try:
+            self.emit(event, payload, to=room)
+        except Exception as e:
+            logger.error(f"Failed to emit {event} to {room}: {str(e)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'window': self.window, 'pending': len(self._pending), **self._stats}
@@ -0,0 +1,309 @@
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import multiprocessing
+from collections import deque
+from logging.handlers import (QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler,
+                              WatchedFileHandler)
+
+try:
+    from gevent import monkey as _gevent_monkey
+except ImportError:
+    _gevent_monkey = None
+
+DEFAULT_LOG_FILE = 'backend.log'
+# Chatty libraries stay quiet unless LOG_LEVELS asks for them
+DEFAULT_LEVELS = {
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+    'hpack': 'WARNING',
+    'urllib3': 'WARNING',
+    'engineio.server': 'WARNING',
+    'socketio.server': 'WARNING',
+    'PIL': 'INFO'
+}
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+def _original(module, name):
+    """The real (not gevent-patched) ``module.name``, so the writer is an OS thread"""
+    if _gevent_monkey is not None:
+        return _gevent_monkey.get_original(module, name)
+    return getattr(sys.modules.get(module) or __import__(module), name)
+
+# Attributes every LogRecord has; anything else came in through ``extra=``
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, plus ``extra=`` fields and exc"""
+
+    def format(self, record):
+        return json.dumps(self.to_dict(record), default=str, ensure_ascii=False)
+
+    def to_dict(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text or record.exc_info:
+            entry['exc'] = record.exc_text or self.formatException(record.exc_info)
+        return entry
+
+class SamplingFilter(logging.Filter):
+    """Passes every INFO+ record and 1 in ``every`` DEBUG records from each call site"""
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, every)
+        self.dropped = 0
+        self._counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self._counts.get(site, 0)
+        self._counts[site] = count + 1
+        if count % self.every == 0:
+            return True
+        self.dropped += 1
+        return False
+
+class LogBuffer(logging.Handler):
+    """The most recent records as dicts, numbered by ``seq``, for /api/logs streaming.
+
+    Filled by the writer thread; readers poll ``since()`` for what is new.
+    """
+
+    def __init__(self, maxlen=1000):
+        super().__init__()
+        self.setFormatter(JsonFormatter())
+        self.seq = 0
+        self._records = deque(maxlen=maxlen)
+        self._records_lock = _original('_thread', 'allocate_lock')()
+
+    def emit(self, record):
+        # Entries go out over Socket.IO as they are, so extras must serialize
+        entry = {key: value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+                 for key, value in self.formatter.to_dict(record).items()}
+        with self._records_lock:
+            self.seq += 1
+            entry['seq'] = self.seq
+            self._records.append(entry)
+
+    def since(self, seq=0, match=None, limit=None):
+        """Records after ``seq`` (oldest first) for which ``match(entry)`` holds, at most the last ``limit``"""
+        with self._records_lock:
+            records = [entry for entry in self._records if entry['seq'] > seq]
+        if match is not None:
+            records = [entry for entry in records if match(entry)]
+        return records[-limit:] if limit else records
+
+def record_filter(level=None, tenant=None):
+    """match(entry) for log dicts at ``level`` or above and, if given, for ``tenant``; None when unfiltered"""
+    levelno = logging.getLevelName(level.upper()) if level else None
+    if not isinstance(levelno, int):
+        levelno = None
+    if levelno is None and not tenant:
+        return None
+
+    def match(entry):
+        if levelno is not None and logging.getLevelName(entry.get('level')) < levelno:
+            return False
+        return not tenant or entry.get('tenant') == tenant
+    return match
+
+def tail_lines(path, count, match=None, chunk_size=8192, max_scan=8 * 1024 * 1024):
+    """Last ``count`` lines of ``path``, oldest first, read backwards from the end of the file.
+
+    With ``match``, only lines for which ``match(line)`` holds are counted;
+    at most ``max_scan`` bytes are read looking for them.
+    """
+    lines = []
+    with open(path, 'rb') as f:
+        end = position = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while position > 0 and len(lines) < count and end - position < max_scan:
+            size = min(chunk_size, position)
+            position -= size
+            f.seek(position)
+            parts = (f.read(size) + remainder).split(b'\n')
+            # The first part may be the end of a line that starts in the previous chunk
+            remainder = parts.pop(0) if position > 0 else b''
+            for raw in reversed(parts):
+                line = raw.decode('utf-8', 'replace')
+                if line and (match is None or match(line)):
+                    lines.append(line)
+                    if len(lines) == count:
+                        break
+    return lines[::-1]
+
+class _QueueHandler(QueueHandler):
+    context = None
+
+    def prepare(self, record):
+        # Request details (e.g. the tenant) are only known on the calling thread
+        if self.context is not None:
+            for key, value in (self.context() or {}).items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        # Only what the writer cannot do later: resolve args and tracebacks now
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class _NativeQueueListener(QueueListener):
+    """QueueListener whose writer is an OS thread even under gevent.
+
+    A greenlet writer would still do its file writes on the hub; a real
+    thread releases the GIL while writing, so requests keep running.
+    """
+
+    def start(self):
+        self._done = _original('_thread', 'allocate_lock')()
+        self._done.acquire()
+
+        def run():
+            try:
+                self._monitor()
+            finally:
+                self._done.release()
+
+        _original('_thread', 'start_new_thread')(run, ())
+        self._thread = True
+
+    def stop(self):
+        if self._thread:
+            self.enqueue_sentinel()
+            # Bounded wait: at exit the writer may already be gone
+            self._done.acquire(timeout=5)
+            self._thread = None
+
+_state = {'listener': None, 'queue': None, 'sampler': None, 'buffer': None, 'file': None, 'pid': None}
+
+def _levels_from_env():
+    levels = dict(DEFAULT_LEVELS)
+    # LOG_LEVELS="index=DEBUG,supabase_db=WARNING,httpx=INFO"
+    for entry in os.getenv('LOG_LEVELS', '').split(','):
+        name, _, level = entry.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _external_rotation():
+    """LOG_ROTATE=external, the default with more than one gunicorn worker (WEB_CONCURRENCY)"""
+    default = 'external' if int(os.getenv('WEB_CONCURRENCY', '1')) > 1 else 'internal'
+    return os.getenv('LOG_ROTATE', default) == 'external'
+
+def _build_handlers():
+    handlers = []
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT', 'text') == 'json' else logging.Formatter(TEXT_FORMAT))
+    handlers.append(console)
+    _state['buffer'] = LogBuffer(int(os.getenv('LOG_BUFFER_SIZE', '1000')))
+    handlers.append(_state['buffer'])
+
+    log_file = os.getenv('LOG_FILE', DEFAULT_LOG_FILE)
+    # Image worker processes re-import the app; only the server process writes (and rotates) the file
+    if log_file and multiprocessing.parent_process() is None:
+        when = os.getenv('LOG_ROTATE_WHEN')
+        if _external_rotation():
+            # Several gunicorn workers append to the same file and would race to rotate
+            # it; logrotate moves it instead and each writer reopens it on its next record
+            file_handler = WatchedFileHandler(log_file, encoding='utf-8')
+        elif when:
+            file_handler = TimedRotatingFileHandler(log_file, when=when, encoding='utf-8',
+                                                    backupCount=int(os.getenv('LOG_BACKUP_COUNT', '5')))
+        else:
+            file_handler = RotatingFileHandler(log_file, encoding='utf-8',
+                                               maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+                                               backupCount=int(os.getenv('LOG_BACKUP_COUNT', '5')))
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+        _state['file'] = log_file
+
+    for handler in handlers:
+        # Only the writer thread takes these locks
+        handler.lock = _original('_thread', 'RLock')()
+    return handlers
+
+def _start_listener():
+    log_queue = _original('queue', 'SimpleQueue')()
+    listener = _NativeQueueListener(log_queue, *_build_handlers(), respect_handler_level=True)
+    listener.start()
+    _state.update(listener=listener, queue=log_queue, pid=os.getpid())
+    return log_queue
+
+def _restart_after_fork():
+    # Threads do not survive fork (gunicorn workers): the child needs its own writer
+    if _state['listener'] is not None and _state['pid'] != os.getpid():
+        log_queue = _start_listener()
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, _QueueHandler):
+                handler.queue = log_queue
+
+def configure_logging(context=None):
+    """Send every record through a queue to a background writer thread.
+
+    The writer logs to stderr (LOG_FORMAT=text|json), as JSON lines to
+    LOG_FILE, rotated at LOG_MAX_BYTES or on LOG_ROTATE_WHEN (e.g. 'midnight'),
+    and into the last LOG_BUFFER_SIZE records kept for streaming. With
+    LOG_ROTATE=external (the default for several workers) the file is only
+    reopened after an external tool such as logrotate has moved it.
+    LOG_LEVEL sets the root level and LOG_LEVELS per-logger overrides;
+    LOG_DEBUG_SAMPLE=N keeps 1 in N debug lines per call site.
+    ``context()`` may return fields to attach to each record (e.g. the tenant).
+    """
+    if _state['listener'] is not None:
+        return
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in _levels_from_env().items():
+        logging.getLogger(name).setLevel(level)
+
+    queue_handler = _QueueHandler(_start_listener())
+    queue_handler.context = context
+    _state['sampler'] = SamplingFilter(int(os.getenv('LOG_DEBUG_SAMPLE', '1')))
+    queue_handler.addFilter(_state['sampler'])
+    root.addHandler(queue_handler)
+
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Flush queued records and stop the writer"""
+    listener = _state['listener']
+    if listener is not None and _state['pid'] == os.getpid():
+        listener.stop()
+
+def get_log_file():
+    """Path of the JSON log file, or None when logging only to stderr"""
+    return _state['file']
+
+def get_log_buffer():
+    """LogBuffer of recent records, or None before configure_logging()"""
+    return _state['buffer']
+
+def logging_stats():
+    log_queue = _state['queue']
+    return {
+        'file': _state['file'],
+        'rotation': 'external' if _external_rotation() else 'internal',
+        'level': logging.getLevelName(logging.getLogger().level),
+        'queued': log_queue.qsize() if log_queue is not None else 0,
+        'debug_sampled_out': _state['sampler'].dropped if _state['sampler'] else 0,
+        'last_seq': _state['buffer'].seq if _state['buffer'] else 0
+    }
@@ -0,0 +1,195 @@
+import os
+import time
+from bisect import bisect_left
+
+try:
+    from gevent.monkey import get_original as _get_original
+except ImportError:
+    _get_original = None
+
+def _lock():
+    # Nothing blocks while a metric lock is held, so the native lock is safe (and cheaper) under gevent
+    if _get_original is not None:
+        return _get_original('_thread', 'allocate_lock')()
+    import _thread
+    return _thread.allocate_lock()
+
+# Seconds; covers cached reads (ms) up to slow upstream calls with retries
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Tenant labels come from request headers; past this many, new tenants are counted as 'other'
+METRICS_MAX_TENANTS = int(os.getenv('METRICS_MAX_TENANTS', '1000'))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count per label tuple, e.g. ``inc(('GET', '/api/orders', '200'))``"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self._lock = _lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _labels(self.labelnames, labels), value) for labels, value in sorted(values.items())]
+
+class Gauge(Counter):
+    """A value that goes up and down (in-flight requests)"""
+
+    kind = 'gauge'
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value=0):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram:
+    """Bucketed observations per label tuple, exposed as _bucket/_sum/_count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = _lock()
+        self._values = {}  # labels -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        samples = []
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                samples.append((f'{self.name}_bucket', _labels(self.labelnames, labels, f'le="{le}"'), cumulative))
+            samples.append((f'{self.name}_sum', _labels(self.labelnames, labels), total))
+            samples.append((f'{self.name}_count', _labels(self.labelnames, labels), cumulative))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests by route template and status', ('method', 'route', 'status')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency in seconds', ('method', 'route')))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests being handled right now'))
+UPSTREAM_REQUESTS = REGISTRY.register(Counter(
+    'upstream_requests_total', 'Calls to Supabase and Razorpay by outcome (ok, http_<status>, timeout, error, circuit_open)',
+    ('service', 'operation', 'tenant', 'outcome')))
+UPSTREAM_LATENCY = REGISTRY.register(Histogram(
+    'upstream_request_duration_seconds', 'Latency of calls to Supabase and Razorpay in seconds',
+    ('service', 'operation', 'tenant')))
+
+_tenant = {'source': None, 'seen': set()}
+
+def set_tenant_source(source):
+    """``source()`` returns the tenant of the work in progress (or None); used to label upstream calls"""
+    _tenant['source'] = source
+
+def current_tenant():
+    source = _tenant['source']
+    tenant = source() if source is not None else None
+    if not tenant:
+        return ''
+    seen = _tenant['seen']
+    if tenant not in seen:
+        if len(seen) >= METRICS_MAX_TENANTS:
+            return 'other'
+        seen.add(tenant)
+    return tenant
+
+def observe_request(method, route, status, seconds):
+    HTTP_REQUESTS.inc((method, route, str(status)))
+    HTTP_LATENCY.observe((method, route), seconds)
+
+def observe_upstream(service, operation, outcome, seconds=None):
+    """Count one upstream call and, if it was actually made, its latency"""
+    labels = (service, operation, current_tenant())
+    UPSTREAM_REQUESTS.inc(labels + (outcome,))
+    if seconds is not None:
+        UPSTREAM_LATENCY.observe(labels, seconds)
+
+ROUTE_KEY = 'metrics.route'
+
+class MetricsMiddleware:
+    """WSGI wrapper recording latency, status and in-flight count of every request.
+
+    The route label is the URL rule the app matched ('/api/orders/<order_id>'),
+    which it stores in ``environ['metrics.route']`` (see ``ROUTE_KEY``).
+    Streaming responses are timed until the app returns them.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = []
+
+        def record_status(code, headers, *exc_info):
+            status.append(code)
+            return start_response(code, headers, *exc_info)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            return self.wsgi_app(environ, record_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            observe_request(environ.get('REQUEST_METHOD', 'GET'), environ.get(ROUTE_KEY, 'unmatched'),
+                            status[-1].split(' ', 1)[0] if status else '500', time.perf_counter() - started)
+
+def render_metrics():
+    return REGISTRY.render()
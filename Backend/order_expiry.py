@@ -0,0 +1,254 @@
+import heapq
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+_FRACTION = re.compile(r'\.(\d+)')
+
+def parse_timestamp(value: str) -> float:
+    """Epoch seconds from a Postgres/ISO-8601 timestamp (naive values are UTC)"""
+    value = value.replace('Z', '+00:00').replace(' ', 'T', 1)
+    # Postgres trims trailing zeros from fractional seconds; fromisoformat wants 6 digits
+    value = _FRACTION.sub(lambda m: '.' + m.group(1)[:6].ljust(6, '0'), value, count=1)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+class OrderExpiryScheduler:
+    """Cancels unpaid orders the moment their stock hold expires.
+
+    Orders sit in a min-heap keyed on their expiry time and the worker thread
+    sleeps until the earliest one is due. Only the process holding the
+    ``order-expiry`` lease cancels orders; it also scans the database on
+    startup and periodically afterwards, so orders created by other workers
+    or before a restart are picked up too. Cancellation is idempotent, so an
+    order that was paid in the meantime is simply skipped.
+    """
+
+    LEASE_NAME = 'order-expiry'
+    # load_pending() returns at most this many rows per call, oldest first
+    SCAN_PAGE_SIZE = 1000
+    MAX_SCAN_PAGES = 20
+
+    def __init__(self, load_pending, cancel_batch, acquire_lease, on_cancelled=None,
+                 hold_seconds=180, batch_size=50, scan_interval=30, lease_ttl=30, retry_delay=5, spawn=None):
+        self.load_pending = load_pending
+        self.cancel_batch = cancel_batch
+        self.acquire_lease = acquire_lease
+        self.on_cancelled = on_cancelled
+        self.hold_seconds = hold_seconds
+        self.batch_size = batch_size
+        self.scan_interval = scan_interval
+        self.lease_ttl = lease_ttl
+        self.retry_delay = retry_delay
+        # How the worker loop is started (e.g. socketio.start_background_task for a greenlet)
+        self.spawn = spawn
+
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._heap = []
+        self._expiry = {}  # order_id -> expires_at of its live heap entry
+        self._cond = threading.Condition()
+        self._running = False
+        self._stopped = False
+        self._next_lease_check = 0.0
+        self._next_scan = 0.0
+        self._scan_watermark = None
+        self._stats = {
+            'scheduled': 0, 'cancelled': 0, 'skipped': 0, 'batches': 0, 'errors': 0,
+            'scans': 0, 'last_scan_at': None,
+            'lag_last': None, 'lag_max': 0.0, 'lag_total': 0.0
+        }
+
+    def start(self):
+        """Start the worker loop (once per process)"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._stopped = False
+        if self.spawn:
+            self.spawn(self._run)
+        else:
+            threading.Thread(target=self._run, name='order-expiry', daemon=True).start()
+        logger.info(f"Order expiry scheduler started ({self.holder})")
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def schedule(self, order_id, machine_id, expires_at):
+        """Queue an order for cancellation at ``expires_at`` (epoch seconds)"""
+        with self._cond:
+            if self._expiry.get(order_id) == expires_at:
+                return
+            self._expiry[order_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, order_id, machine_id))
+            self._stats['scheduled'] += 1
+            # Wake the worker if this order is now the next one due
+            if self._heap[0][1] == order_id:
+                self._cond.notify()
+
+    def discard(self, order_id):
+        """Forget an order that was paid or cancelled elsewhere"""
+        with self._cond:
+            self._expiry.pop(order_id, None)
+
+    def stats(self) -> dict:
+        with self._cond:
+            cancelled = self._stats['cancelled']
+            return {
+                'leader': self.is_leader,
+                'holder': self.holder,
+                'queued': len(self._expiry),
+                'next_due_in': round(self._heap[0][0] - time.time(), 3) if self._heap else None,
+                'lag_avg': round(self._stats['lag_total'] / cancelled, 3) if cancelled else None,
+                **{k: v for k, v in self._stats.items() if k != 'lag_total'}
+            }
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            with self._cond:
+                self._running = False
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+
+            now = time.time()
+            try:
+                if now >= self._next_lease_check:
+                    self._refresh_leadership()
+                if self.is_leader and now >= self._next_scan:
+                    self._scan()
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Order expiry bookkeeping failed: {str(e)}")
+
+            due = self._pop_due(time.time())
+            if due:
+                self._cancel(due)
+                continue
+
+            with self._cond:
+                wake_at = min(self._next_lease_check, self._next_scan if self.is_leader else float('inf'))
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                timeout = wake_at - time.time()
+                if timeout > 0 and not self._stopped:
+                    self._cond.wait(timeout)
+
+    def _refresh_leadership(self):
+        try:
+            leader = self.acquire_lease(self.LEASE_NAME, self.holder, self.lease_ttl)
+        except Exception as e:
+            # Without a confirmed lease another process may take over; stand down
+            logger.error(f"Order expiry lease check failed: {str(e)}")
+            leader = False
+
+        if leader and not self.is_leader:
+            logger.info(f"Order expiry scheduler is now the leader ({self.holder})")
+            self._scan_watermark = None  # cold start: pick up every pending order
+            self._next_scan = 0.0
+        elif self.is_leader and not leader:
+            logger.info(f"Order expiry scheduler lost leadership ({self.holder})")
+        self.is_leader = leader
+        self._next_lease_check = time.time() + self.lease_ttl / 3
+
+    def _scan(self):
+        """Load pending orders created since the last scan (all of them on a cold start)"""
+        started = time.time()
+        # Overlap the previous window slightly so commits that landed late are not missed
+        created_after = None
+        if self._scan_watermark is not None:
+            created_after = datetime.fromtimestamp(self._scan_watermark - self.scan_interval, timezone.utc).isoformat()
+
+        rows = []
+        for _ in range(self.MAX_SCAN_PAGES):
+            page = self.load_pending(created_after)
+            rows.extend(page)
+            if len(page) < self.SCAN_PAGE_SIZE:
+                break
+            created_after = page[-1]['created_at']
+
+        for row in rows:
+            try:
+                if row.get('hold_expires_at'):
+                    expires_at = parse_timestamp(row['hold_expires_at'])
+                else:
+                    expires_at = parse_timestamp(row['created_at']) + self.hold_seconds
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping order {row.get('order_id')} with unparseable timestamps")
+                continue
+            self.schedule(row['order_id'], row['machine_id'], expires_at)
+
+        self._scan_watermark = started
+        self._next_scan = started + self.scan_interval
+        self._stats['scans'] += 1
+        self._stats['last_scan_at'] = datetime.now(timezone.utc).isoformat()
+        logger.debug(f"Order expiry scan loaded {len(rows)} pending orders")
+
+    def _pop_due(self, now):
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                expires_at, order_id, machine_id = heapq.heappop(self._heap)
+                # Skip entries superseded by a later schedule() or discarded
+                if self._expiry.get(order_id) != expires_at:
+                    continue
+                del self._expiry[order_id]
+                due.append((expires_at, order_id, machine_id))
+        # Non-leaders drop due entries: the leader's scans cover them
+        return due if self.is_leader else []
+
+    def _cancel(self, due):
+        expiry_by_order = {order_id: expires_at for expires_at, order_id, _ in due}
+        try:
+            results = self.cancel_batch([
+                {'machine_id': machine_id, 'order_id': order_id} for _, order_id, machine_id in due
+            ])
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Failed to cancel {len(due)} expired orders, retrying in {self.retry_delay}s: {str(e)}")
+            retry_at = time.time() + self.retry_delay
+            for _, order_id, machine_id in due:
+                self.schedule(order_id, machine_id, retry_at)
+            return
+
+        now = time.time()
+        cancelled = 0
+        cancelled_by_machine = {}
+        with self._cond:
+            self._stats['batches'] += 1
+            for result in results:
+                if not result.get('cancelled'):
+                    self._stats['skipped'] += 1
+                    continue
+                lag = now - expiry_by_order.get(result.get('order_id'), now)
+                self._stats['cancelled'] += 1
+                self._stats['lag_last'] = round(lag, 3)
+                self._stats['lag_max'] = max(self._stats['lag_max'], round(lag, 3))
+                self._stats['lag_total'] += lag
+                cancelled += 1
+                cancelled_by_machine.setdefault(result.get('machine_id'), []).append(result)
+
+        logger.info(f"Expired {len(due)} pending orders: {cancelled} cancelled, {len(due) - cancelled} already settled")
+        if self.on_cancelled:
+            for machine_id, machine_results in cancelled_by_machine.items():
+                try:
+                    self.on_cancelled(machine_id, machine_results)
+                except Exception as e:
+                    logger.error(f"Expiry broadcast failed for {machine_id}: {str(e)}")
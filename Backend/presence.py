@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import socket
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Identifies this worker in presence records (which node holds a machine's socket)
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _new_record(machine_id, sid, now):
+    return {
+        'machine_id': machine_id,
+        'sid': sid,
+        'node': NODE_ID,
+        'status': 'online',
+        'connected_at': now,
+        'last_seen': now
+    }
+
+class LocalPresenceRegistry:
+    """Machine presence kept in process memory (single worker, tests)"""
+
+    backend = 'local'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._machines = {}
+        self._sids = {}
+        # Online machines -> monotonic time of their last heartbeat, oldest first
+        self._online = OrderedDict()
+
+    def register(self, machine_id, sid):
+        """Record that ``machine_id`` is connected on socket ``sid``"""
+        return self.heartbeat(machine_id, sid)[0]
+
+    def heartbeat(self, machine_id, sid, info=None):
+        """Refresh ``machine_id``'s last-seen time; returns ``(record, came_online)``"""
+        now = _now()
+        with self._lock:
+            record = self._machines.get(machine_id)
+            came_online = record is None or record.get('status') != 'online'
+            if record is None or record.get('sid') != sid:
+                if record and record.get('sid'):
+                    self._sids.pop(record['sid'], None)
+                record = _new_record(machine_id, sid, now)
+                self._machines[machine_id] = record
+                self._sids[sid] = machine_id
+            record.update(status='online', last_seen=now)
+            if info is not None:
+                record['info'] = info
+            self._online[machine_id] = time.monotonic()
+            self._online.move_to_end(machine_id)
+            return dict(record), came_online
+
+    def expire(self, timeout):
+        """Mark machines silent for ``timeout`` seconds offline; returns their records"""
+        cutoff = time.monotonic() - timeout
+        expired = []
+        with self._lock:
+            while self._online:
+                machine_id, seen = next(iter(self._online.items()))
+                if seen > cutoff:
+                    break
+                self._online.popitem(last=False)
+                record = self._machines.get(machine_id)
+                if record and record.get('status') == 'online':
+                    record['status'] = 'offline'
+                    expired.append(dict(record))
+        return expired
+
+    def disconnect(self, sid):
+        """Mark the machine on ``sid`` offline; returns its record or None if ``sid`` was not a machine"""
+        with self._lock:
+            machine_id = self._sids.pop(sid, None)
+            record = self._machines.get(machine_id)
+            # The machine may already have reconnected on a newer socket
+            if record is None or record.get('sid') != sid:
+                return None
+            self._online.pop(machine_id, None)
+            record.update(sid=None, status='offline', last_seen=_now())
+            return dict(record)
+
+    def get(self, machine_id):
+        with self._lock:
+            record = self._machines.get(machine_id)
+            return dict(record) if record else None
+
+    def get_sid(self, machine_id):
+        with self._lock:
+            record = self._machines.get(machine_id)
+            return record.get('sid') if record else None
+
+    def all(self):
+        with self._lock:
+            return [dict(record) for record in self._machines.values()]
+
+class RedisPresenceRegistry:
+    """Machine presence shared by every worker and node through Redis hashes.
+
+    ``presence:machines`` maps machine id -> JSON record,
+    ``presence:sids`` maps socket id -> machine id and the sorted set
+    ``presence:heartbeats`` scores online machines by their last heartbeat.
+    """
+
+    backend = 'redis'
+    MACHINES_KEY = 'presence:machines'
+    SIDS_KEY = 'presence:sids'
+    HEARTBEATS_KEY = 'presence:heartbeats'
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url, socket_timeout=5, health_check_interval=30)
+
+    def _load(self, raw):
+        return json.loads(raw) if raw else None
+
+    def register(self, machine_id, sid):
+        return self.heartbeat(machine_id, sid)[0]
+
+    def heartbeat(self, machine_id, sid, info=None):
+        now = _now()
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.HEARTBEATS_KEY, {machine_id: time.time()})
+        pipe.hget(self.MACHINES_KEY, machine_id)
+        added, raw = pipe.execute()
+        record = self._load(raw)
+        came_online = bool(added) or record is None or record.get('status') != 'online'
+
+        pipe = self.redis.pipeline()
+        if record is None or record.get('sid') != sid:
+            if record and record.get('sid'):
+                pipe.hdel(self.SIDS_KEY, record['sid'])
+            record = _new_record(machine_id, sid, now)
+            pipe.hset(self.SIDS_KEY, sid, machine_id)
+        record.update(status='online', last_seen=now)
+        if info is not None:
+            record['info'] = info
+        pipe.hset(self.MACHINES_KEY, machine_id, json.dumps(record))
+        pipe.execute()
+        return record, came_online
+
+    def expire(self, timeout):
+        stale = self.redis.zrangebyscore(self.HEARTBEATS_KEY, '-inf', time.time() - timeout)
+        expired = []
+        for raw_id in stale:
+            # Every worker sweeps; only the one whose ZREM wins reports the transition.
+            # A heartbeat landing in between is lost and the next one brings the machine back.
+            if not self.redis.zrem(self.HEARTBEATS_KEY, raw_id):
+                continue
+            machine_id = raw_id.decode('utf-8')
+            record = self.get(machine_id)
+            if record is None or record.get('status') != 'online':
+                continue
+            record['status'] = 'offline'
+            self.redis.hset(self.MACHINES_KEY, machine_id, json.dumps(record))
+            expired.append(record)
+        return expired
+
+    def disconnect(self, sid):
+        machine_id = self.redis.hget(self.SIDS_KEY, sid)
+        if machine_id is None:
+            return None
+        machine_id = machine_id.decode('utf-8')
+        self.redis.hdel(self.SIDS_KEY, sid)
+
+        # Not atomic with register(): a reconnect landing in between can be
+        # marked offline until the machine's next registration
+        record = self.get(machine_id)
+        if record is None or record.get('sid') != sid:
+            return None
+        record.update(sid=None, status='offline', last_seen=_now())
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.HEARTBEATS_KEY, machine_id)
+        pipe.hset(self.MACHINES_KEY, machine_id, json.dumps(record))
+        pipe.execute()
+        return record
+
+    def get(self, machine_id):
+        return self._load(self.redis.hget(self.MACHINES_KEY, machine_id))
+
+    def get_sid(self, machine_id):
+        record = self.get(machine_id)
+        return record.get('sid') if record else None
+
+    def all(self):
+        return [self._load(raw) for raw in self.redis.hgetall(self.MACHINES_KEY).values()]
+
+def create_presence_registry(url=None):
+    """Redis-backed registry for redis:// URLs, otherwise in-process"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        logger.info(f"Machine presence shared through {url.split('@')[-1]}")
+        return RedisPresenceRegistry(url)
+    return LocalPresenceRegistry()
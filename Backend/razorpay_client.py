@@ -0,0 +1,315 @@
+import os
+import re
+import random
+import contextvars
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from dotenv import load_dotenv
+from metrics import observe_upstream
+from tracing import record_span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RAZORPAY_API_BASE_URL = os.getenv('RAZORPAY_API_BASE_URL', 'https://api.razorpay.com/v1')
+RAZORPAY_POOL_SIZE = int(os.getenv('RAZORPAY_POOL_SIZE', '10'))
+RAZORPAY_CONNECT_TIMEOUT = float(os.getenv('RAZORPAY_CONNECT_TIMEOUT', '3'))
+RAZORPAY_TIMEOUT = float(os.getenv('RAZORPAY_TIMEOUT', '10'))
+RAZORPAY_MAX_RETRIES = int(os.getenv('RAZORPAY_MAX_RETRIES', '2'))
+RAZORPAY_BREAKER_THRESHOLD = int(os.getenv('RAZORPAY_BREAKER_THRESHOLD', '5'))
+RAZORPAY_BREAKER_RESET = float(os.getenv('RAZORPAY_BREAKER_RESET', '30'))
+
+# Statuses worth retrying: Razorpay rate limits and server-side failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Razorpay has no idempotency keys for orders or QR codes: a POST that may have
+# been processed (read timeout, dropped connection, 5xx) is not sent again
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+# A rate-limited request was turned away before it was processed
+UNPROCESSED_STATUSES = {429}
+# Razorpay ids in paths ('/payments/qr_codes/qr_Mx1...') collapse to ':id' in metric labels
+_RAZORPAY_ID = re.compile(r'/[a-z]+_[A-Za-z0-9]{6,}')
+
+class RazorpayError(Exception):
+    """A Razorpay call failed; ``status_code`` and ``body`` are set for HTTP errors"""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+class RazorpayTimeout(RazorpayError):
+    pass
+
+class CircuitOpenError(RazorpayError):
+    pass
+
+def _never_sent(error):
+    """True if the request failed before reaching Razorpay (connect timeout, refused, DNS)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+class CircuitBreaker:
+    """Fails fast after ``threshold`` consecutive failures.
+
+    After ``reset_timeout`` seconds one trial call is let through (half-open);
+    it closes the circuit on success and re-opens it on failure.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Razorpay circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            reopen = self._trial_in_flight
+            self._trial_in_flight = False
+            if reopen or (self._opened_at is None and self._failures >= self.threshold):
+                if self._opened_at is None:
+                    self._times_opened += 1
+                    logger.warning(f"Razorpay circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self._state(),
+                'consecutive_failures': self._failures,
+                'times_opened': self._times_opened
+            }
+
+class RazorpayClient:
+    """Razorpay REST client sharing one keep-alive connection pool per process.
+
+    Every call has a connect/read timeout, is retried with jittered
+    exponential backoff on timeouts, connection errors, 429 and 5xx, and goes
+    through a circuit breaker so an outage fails checkouts fast instead of
+    tying up workers. POSTs are only retried when Razorpay cannot have
+    processed them (connect errors, 429), so a retry never creates a second
+    order or QR code. ``submit()`` runs independent calls concurrently.
+    """
+
+    def __init__(self, key_id, key_secret, base_url=RAZORPAY_API_BASE_URL, pool_size=RAZORPAY_POOL_SIZE,
+                 connect_timeout=RAZORPAY_CONNECT_TIMEOUT, timeout=RAZORPAY_TIMEOUT,
+                 max_retries=RAZORPAY_MAX_RETRIES, backoff=0.2, breaker=None):
+        self.key_id = key_id
+        self.key_secret = key_secret
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = max(1, pool_size)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker(RAZORPAY_BREAKER_THRESHOLD, RAZORPAY_BREAKER_RESET)
+        self._lock = threading.Lock()
+        self._session = None
+        self._executor = None
+        self._stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'latency_total': 0.0}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.key_id and self.key_secret)
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                # Retries are handled here so they share the backoff and breaker
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.auth = (self.key_id, self.key_secret)
+                self._session = session
+            return self._session
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='razorpay')
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Run a client call in the background and return its Future"""
+        # Carry the caller's context (its request, for metrics) into the worker thread
+        return self._get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def request(self, method, path, json=None, timeout=None, retries=None, idempotent=None):
+        """Send a request and return the ``requests.Response`` of the final attempt.
+
+        Raises CircuitOpenError while the circuit is open and RazorpayError /
+        RazorpayTimeout when every attempt failed at the transport level.
+        HTTP error statuses are returned to the caller once retries run out.
+        ``idempotent`` defaults to whether the method is safe to resend.
+        """
+        operation = f"{method} {_RAZORPAY_ID.sub('/:id', path)}"
+        if not self.breaker.allow():
+            with self._lock:
+                self._stats['rejected'] += 1
+            observe_upstream('razorpay', operation, 'circuit_open')
+            raise CircuitOpenError('Razorpay circuit is open, failing fast')
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        timeout = (self.connect_timeout, timeout or self.timeout)
+        retries = self.max_retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        session = self._get_session()
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            error = None
+            response = None
+            never_sent = False
+            try:
+                response = session.request(method, url, json=json, timeout=timeout)
+            except requests.exceptions.Timeout as e:
+                never_sent = _never_sent(e)
+                error = RazorpayTimeout(f"Razorpay {method} {path} timed out: {str(e)}")
+            except requests.exceptions.RequestException as e:
+                never_sent = _never_sent(e)
+                error = RazorpayError(f"Razorpay {method} {path} failed: {str(e)}")
+
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._stats['requests'] += 1
+                self._stats['latency_total'] += elapsed
+            if error is not None:
+                outcome = 'timeout' if isinstance(error, RazorpayTimeout) else 'error'
+            else:
+                outcome = 'ok' if response.status_code < 400 else f'http_{response.status_code}'
+            observe_upstream('razorpay', operation, outcome, elapsed)
+            record_span(f'razorpay {operation}', started, elapsed, error=None if outcome == 'ok' else outcome,
+                        attempt=attempt + 1)
+
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            if not failed:
+                self.breaker.record_success()
+                return response
+
+            safe_to_resend = idempotent or never_sent or (error is None and response.status_code in UNPROCESSED_STATUSES)
+            if attempt >= retries or not safe_to_resend:
+                self.breaker.record_failure()
+                with self._lock:
+                    self._stats['failures'] += 1
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            delay = self.backoff * (2 ** (attempt - 1))
+            delay = random.uniform(delay / 2, delay)  # jitter so retries do not arrive in lockstep
+            with self._lock:
+                self._stats['retries'] += 1
+            logger.warning(f"Razorpay {method} {path} attempt {attempt} failed "
+                           f"({error or response.status_code}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def _call(self, method, path, json=None, timeout=None, retries=None):
+        response = self.request(method, path, json=json, timeout=timeout, retries=retries)
+        if response.status_code != 200:
+            raise RazorpayError(f"Razorpay {method} {path} returned {response.status_code}: {response.text}",
+                                status_code=response.status_code, body=response.text)
+        return response.json()
+
+    def create_order(self, order_data, timeout=None):
+        return self._call('POST', '/orders', json=order_data, timeout=timeout)
+
+    def create_qr_code(self, qr_data, timeout=None):
+        return self._call('POST', '/payments/qr_codes', json=qr_data, timeout=timeout)
+
+    def fetch_qr_code(self, qr_code_id, timeout=None):
+        return self._call('GET', f'/payments/qr_codes/{qr_code_id}', timeout=timeout)
+
+    def create_order_and_qr_code(self, order_data, qr_data, timeout=None):
+        """Create the Razorpay order and the UPI QR code concurrently.
+
+        The QR code does not reference the order, so both requests are in
+        flight at once and checkout pays one round trip instead of two.
+        """
+        qr_future = self.submit(self.create_qr_code, qr_data, timeout)
+        try:
+            razorpay_order = self.create_order(order_data, timeout)
+        finally:
+            # Always wait for the QR call so its error (if any) is not lost
+            qr_code = qr_future.result()
+        return razorpay_order, qr_code
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests_made = self._stats['requests']
+            stats = {k: v for k, v in self._stats.items() if k != 'latency_total'}
+            stats['avg_latency_ms'] = round(self._stats['latency_total'] / requests_made * 1000, 1) if requests_made else None
+        stats['circuit'] = self.breaker.stats()
+        return stats
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_razorpay_client() -> RazorpayClient:
+    """Process-wide Razorpay client configured from the environment"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RazorpayClient(os.getenv('RAZORPAY_KEY_ID'), os.getenv('RAZORPAY_KEY_SECRET'))
+        return _client
+
+def reset_razorpay_client():
+    """Drop the client so the next call opens fresh connections (e.g. after fork)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+class StorageError(Exception):
+    """An upload, listing or delete failed"""
+
+class BucketNotFound(StorageError):
+    """The product-images bucket does not exist (or cannot be reached)"""
+
+class SupabaseStorage:
+    """Product images in a public Supabase storage bucket.
+
+    The bucket is checked once and then again every ``recheck_seconds``
+    rather than listed before every upload, and public URLs are built
+    locally (they only depend on the project URL, bucket and path).
+    """
+
+    backend = 'supabase'
+
+    def __init__(self, supabase_url, with_client, bucket='product-images', recheck_seconds=600):
+        self.base_url = f"{supabase_url}/storage/v1"
+        self.with_client = with_client
+        self.bucket = bucket
+        self.recheck_seconds = recheck_seconds
+        self._lock = threading.Lock()
+        self._bucket_checked_at = None
+        self._stats = {'bucket_checks': 0, 'uploads': 0, 'deletes': 0, 'lists': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _bucket(self, supabase):
+        return supabase.storage.from_(self.bucket)
+
+    def ensure_bucket(self):
+        """True once the bucket answered a listing within the last ``recheck_seconds``"""
+        with self._lock:
+            checked_at = self._bucket_checked_at
+        if checked_at is not None and time.monotonic() - checked_at < self.recheck_seconds:
+            return True
+
+        self._count('bucket_checks')
+        try:
+            self.with_client('storage_ensure_bucket', lambda supabase: self._bucket(supabase).list('', {'limit': 1}),
+                             idempotent=True)
+        except Exception as e:
+            if "Bucket not found" in str(e):
+                logger.error(f"❌ Storage bucket '{self.bucket}' not found - create it as a public bucket "
+                             f"in the Supabase dashboard and restart the backend")
+            else:
+                logger.error(f"❌ Bucket check error: {str(e)}")
+            self.invalidate()
+            return False
+        with self._lock:
+            if self._bucket_checked_at is None:
+                logger.info(f"✅ Storage bucket '{self.bucket}' exists")
+            self._bucket_checked_at = time.monotonic()
+        return True
+
+    def invalidate(self):
+        """Check the bucket again on the next upload"""
+        with self._lock:
+            self._bucket_checked_at = None
+
+    def public_url(self, path):
+        # Same string storage3's get_public_url returns, including its trailing '?'
+        return f"{self.base_url}/object/public/{self.bucket}/{path}?"
+
+    def upload(self, path, data, content_type=None, cache_seconds=3600):
+        if not self.ensure_bucket():
+            raise BucketNotFound("Storage bucket is not available. Please check your Supabase configuration.")
+        file_options = {"cache-control": str(cache_seconds), "upsert": "true"}
+        if content_type:
+            file_options["content-type"] = content_type
+        self._count('uploads')
+        try:
+            # storage3 pops keys out of file_options, so every attempt gets its own copy;
+            # an upsert of the same bytes is safe to send twice
+            self.with_client('storage_upload',
+                             lambda supabase: self._bucket(supabase).upload(path, data, file_options=dict(file_options)),
+                             idempotent=True)
+        except Exception as e:
+            if "Bucket not found" in str(e):
+                self.invalidate()
+                raise BucketNotFound(f"Storage bucket not found. Please create '{self.bucket}' bucket in Supabase.")
+            raise StorageError(str(e))
+        return self.public_url(path)
+
+    def list(self, folder, search=None, limit=100):
+        options = {'limit': limit}
+        if search:
+            options['search'] = search
+        self._count('lists')
+        files = self.with_client('storage_list', lambda supabase: self._bucket(supabase).list(folder, options), idempotent=True)
+        return {f.get('name') for f in files or []}
+
+    def list_objects(self, folder, page_size=1000):
+        """Every entry of ``folder`` as {'name', 'folder', 'created_at'} (ISO string, None for folders)"""
+        entries = []
+        while True:
+            options = {'limit': page_size, 'offset': len(entries), 'sortBy': {'column': 'name', 'order': 'asc'}}
+            self._count('lists')
+            page = self.with_client('storage_list_objects', lambda supabase: self._bucket(supabase).list(folder, options),
+                                    idempotent=True) or []
+            # Folders are listed without an id
+            entries.extend({'name': f.get('name'), 'folder': f.get('id') is None, 'created_at': f.get('created_at')}
+                           for f in page)
+            if len(page) < page_size:
+                return entries
+
+    def remove(self, paths):
+        self._count('deletes')
+        self.with_client('storage_remove', lambda supabase: self._bucket(supabase).remove(list(paths)), idempotent=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            checked_at = self._bucket_checked_at
+        stats.update(backend=self.backend, bucket=self.bucket,
+                     bucket_checked_ago=round(time.monotonic() - checked_at, 1) if checked_at is not None else None)
+        return stats
+
+class LocalStorage:
+    """Product images on the local filesystem, for tests and offline development.
+
+    Files live under ``root/<bucket>/<path>`` and their URLs are
+    ``<public_url>/<bucket>/<path>`` (index.py serves them under /storage).
+    """
+
+    backend = 'local'
+
+    def __init__(self, root, public_url='/storage', bucket='product-images'):
+        self.root = os.path.abspath(root)
+        self.base_url = public_url.rstrip('/')
+        self.bucket = bucket
+        self._lock = threading.Lock()
+        self._stats = {'uploads': 0, 'deletes': 0, 'lists': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _path(self, path):
+        bucket_dir = os.path.join(self.root, self.bucket)
+        full = os.path.abspath(os.path.join(bucket_dir, path))
+        if full != bucket_dir and not full.startswith(bucket_dir + os.sep):
+            raise StorageError(f"Invalid storage path: {path}")
+        return full
+
+    def ensure_bucket(self):
+        os.makedirs(os.path.join(self.root, self.bucket), exist_ok=True)
+        return True
+
+    def invalidate(self):
+        pass
+
+    def public_url(self, path):
+        return f"{self.base_url}/{self.bucket}/{path}"
+
+    def upload(self, path, data, content_type=None, cache_seconds=3600):
+        full = self._path(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        # Write then rename, so a reader never sees half a file
+        with open(full + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(full + '.tmp', full)
+        self._count('uploads')
+        return self.public_url(path)
+
+    def list(self, folder, search=None, limit=100):
+        self._count('lists')
+        try:
+            names = sorted(os.listdir(self._path(folder)))
+        except FileNotFoundError:
+            return set()
+        matching = [name for name in names if not name.endswith('.tmp') and (not search or search in name)]
+        return set(matching[:limit])
+
+    def list_objects(self, folder, page_size=1000):
+        self._count('lists')
+        try:
+            entries = sorted(os.scandir(self._path(folder)), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return []
+        return [{
+            'name': entry.name,
+            'folder': entry.is_dir(),
+            'created_at': None if entry.is_dir() else
+                datetime.fromtimestamp(entry.stat().st_mtime, timezone.utc).isoformat()
+        } for entry in entries if not entry.name.endswith('.tmp')]
+
+    def remove(self, paths):
+        self._count('deletes')
+        for path in paths:
+            try:
+                os.remove(self._path(path))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(backend=self.backend, bucket=self.bucket, root=self.root)
+        return stats
+
+def create_storage(backend='supabase', supabase_url=None, with_client=None, bucket='product-images',
+                   recheck_seconds=600, local_dir='storage', public_url='/storage'):
+    """SupabaseStorage, or LocalStorage for ``backend='local'``"""
+    if backend == 'local':
+        return LocalStorage(local_dir, public_url, bucket)
+    return SupabaseStorage(supabase_url, with_client, bucket, recheck_seconds)
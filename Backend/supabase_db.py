@@ -1,7 +1,17 @@
 import os
+import json
+import time
+import base64
+import threading
+import uuid
+from datetime import datetime
 from pathlib import Path
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
+from storage import BucketNotFound, create_storage
+from metrics import observe_upstream
+from tracing import record_span
 
 # Load environment variables
 load_dotenv()
@@ -9,94 +19,450 @@ load_dotenv()
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Day/hour boundaries for stats and rollups use the machine's local timezone.
+# MACHINE_TIMEZONES overrides it per machine, e.g. {"VM-002": "Asia/Dubai"}
+DEFAULT_MACHINE_TIMEZONE = os.getenv('MACHINE_TIMEZONE', 'Asia/Kolkata')
+try:
+    MACHINE_TIMEZONES = json.loads(os.getenv('MACHINE_TIMEZONES', '{}'))
+except ValueError:
+    print("⚠️ MACHINE_TIMEZONES is not valid JSON - using the default timezone for all machines")
+    MACHINE_TIMEZONES = {}
+
+# Connection pool settings
+SUPABASE_POOL_SIZE = int(os.getenv('SUPABASE_POOL_SIZE', '4'))
+SUPABASE_TIMEOUT = float(os.getenv('SUPABASE_TIMEOUT', '10'))
+
 print(f"🔗 Supabase URL: {SUPABASE_URL[:30]}..." if SUPABASE_URL else "❌ No Supabase URL found")
 print(f"🔑 Supabase Key: {SUPABASE_KEY[:20]}..." if SUPABASE_KEY else "❌ No Supabase Key found")
 
+# Errors where the request never reached PostgREST, so it is safe to reconnect and send it again
+RECONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+# The connection dropped mid-request (often a dead keep-alive socket); the server
+# may already have run it, so only idempotent calls are sent again
+DROPPED_ERRORS = (httpx.RemoteProtocolError,)
+
+class SupabaseClientPool:
+    """Process-wide pool of Supabase clients.
+
+    Every client keeps its own keep-alive HTTP sessions for PostgREST and
+    storage, so handing out existing clients avoids a new TLS handshake per
+    database round trip. The pool is rebuilt when the process id changes
+    (gunicorn forks workers after ``preload_app``) and after connection errors.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        # threading.Lock becomes a greenlet-aware lock once gevent monkey-patches
+        self._lock = threading.Lock()
+        self._clients = []
+        self._next = 0
+        self._pid = os.getpid()
+        self._stats = {'hits': 0, 'new_connections': 0, 'reconnects': 0}
+
+    def _create(self) -> Client:
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise Exception("Missing Supabase credentials. Please check your .env file.")
+
+        try:
+            # Create client with service role key - this should bypass RLS automatically
+            return create_client(
+                SUPABASE_URL,
+                SUPABASE_KEY,
+                options=ClientOptions(
+                    postgrest_client_timeout=SUPABASE_TIMEOUT,
+                    storage_client_timeout=SUPABASE_TIMEOUT
+                )
+            )
+        except Exception as e:
+            raise Exception(f"Failed to create Supabase client: {str(e)}")
+
+    def get(self) -> Client:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: never share sockets with the parent process
+                self._clients = []
+                self._next = 0
+                self._pid = os.getpid()
+
+            if len(self._clients) < self.size:
+                client = self._create()
+                self._clients.append(client)
+                self._stats['new_connections'] += 1
+                return client
+
+            client = self._clients[self._next % len(self._clients)]
+            self._next += 1
+            self._stats['hits'] += 1
+            return client
+
+    def reset(self, reconnect: bool = False):
+        """Drop every pooled client; the next call to get() opens fresh sessions"""
+        with self._lock:
+            self._clients = []
+            self._next = 0
+            self._pid = os.getpid()
+            if reconnect:
+                self._stats['reconnects'] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'pool_size': self.size,
+                'open_clients': len(self._clients),
+                'pid': self._pid,
+                **self._stats
+            }
+
+_client_pool = SupabaseClientPool(SUPABASE_POOL_SIZE)
+
 def get_supabase_client() -> Client:
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise Exception("Missing Supabase credentials. Please check your .env file.")
-    
+    """Return a pooled Supabase client (shared across requests in this process)"""
+    return _client_pool.get()
+
+def reset_supabase_client_pool():
+    """Discard pooled clients - call from gunicorn's post_fork hook"""
+    _client_pool.reset()
+
+def get_machine_timezone(machine_id: str) -> str:
+    return MACHINE_TIMEZONES.get(machine_id, DEFAULT_MACHINE_TIMEZONE)
+
+def get_supabase_pool_stats() -> dict:
+    """Pool hits vs. newly opened clients, for health checks"""
+    return _client_pool.stats()
+
+def _with_client(name: str, operation, idempotent: bool = False):
+    """Run ``operation(client)``, reconnecting once if the connection was dropped.
+
+    ``name`` labels the call in metrics and trace spans (get_inventory, storage_upload, ...).
+    Writes and RPCs are only retried if the request cannot have reached the
+    server; pass ``idempotent=True`` for reads, which are also retried when the
+    connection dropped mid-request.
+    """
+    started = time.perf_counter()
+    outcome = 'error'
     try:
-        # Create client with service role key - this should bypass RLS automatically
-        client = create_client(
-            SUPABASE_URL, 
-            SUPABASE_KEY
-        )
-        return client
-    except Exception as e:
-        raise Exception(f"Failed to create Supabase client: {str(e)}")
+        try:
+            result = operation(get_supabase_client())
+        except RECONNECT_ERRORS + DROPPED_ERRORS as e:
+            _client_pool.reset(reconnect=True)
+            if not idempotent and isinstance(e, DROPPED_ERRORS):
+                print(f"⚠️ Supabase connection dropped: {str(e)} - not retrying a write")
+                raise
+            print(f"⚠️ Supabase connection error: {str(e)} - reconnecting")
+            result = operation(get_supabase_client())
+        outcome = 'ok'
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        observe_upstream('supabase', name, outcome, elapsed)
+        record_span(f'supabase {name}', started, elapsed, error=None if outcome == 'ok' else outcome)
+
+# Product images: the Supabase bucket, or the local filesystem with STORAGE_BACKEND=local (tests)
+_storage = create_storage(
+    os.getenv('STORAGE_BACKEND', 'supabase'),
+    supabase_url=SUPABASE_URL,
+    with_client=_with_client,
+    recheck_seconds=float(os.getenv('STORAGE_BUCKET_RECHECK', '600')),
+    local_dir=os.getenv('STORAGE_LOCAL_DIR', 'storage'),
+    public_url=os.getenv('STORAGE_PUBLIC_URL', '/storage')
+)
 
 def get_inventory(machine_id: str):
     """Get inventory for a machine from inventory table only - ordered by created_at"""
-    supabase = get_supabase_client()
-    
     # Get from inventory table only, ordered by creation date (newest first)
-    inventory_response = supabase.table('inventory').select('*').eq('machine_id', machine_id).order('created_at', desc=True).execute()
+    inventory_response = _with_client(
+        'get_inventory',
+        lambda supabase: supabase.table('inventory').select('*').eq('machine_id', machine_id).order('created_at', desc=True).execute(),
+        idempotent=True
+    )
     inventory_data = inventory_response.data
     
     return {'success': True, 'inventory': inventory_data}
 
 def get_single_product(machine_id: str, item_id: str):
     """Get a single product from inventory"""
-    supabase = get_supabase_client()
-    
-    response = supabase.table('inventory').select('*').eq('machine_id', machine_id).eq('id', item_id).execute()
+    response = _with_client(
+        'get_single_product',
+        lambda supabase: supabase.table('inventory').select('*').eq('machine_id', machine_id).eq('id', item_id).execute(),
+        idempotent=True
+    )
     if response.data and len(response.data) > 0:
         return response.data[0]
     return None
 
 def add_inventory(machine_id: str, item: dict):
-    supabase = get_supabase_client()
-    
     # Insert into inventory table
-    response = supabase.table('inventory').insert({'machine_id': machine_id, **item}).execute()
+    response = _with_client(
+        'add_inventory',
+        lambda supabase: supabase.table('inventory').insert({'machine_id': machine_id, **item}).execute()
+    )
     return {'success': True, 'data': response.data}
 
+# Maintained by the stock functions (or derived for clients); client updates never write them
+INVENTORY_SERVER_COLUMNS = {'reserved_quantity', 'created_at', 'available', 'reserved'}
+
 def update_inventory(machine_id: str, item_id: str, updates: dict):
-    supabase = get_supabase_client()
+    updates = {k: v for k, v in updates.items() if k not in INVENTORY_SERVER_COLUMNS}
     # First, update the `inventory` table
-    response = supabase.table('inventory').update(updates).eq('machine_id', machine_id).eq('id', item_id).execute()
+    response = _with_client(
+        'update_inventory',
+        lambda supabase: supabase.table('inventory').update(updates).eq('machine_id', machine_id).eq('id', item_id).execute()
+    )
 
     return {'success': True, 'data': response.data}
 
 def delete_inventory_item(machine_id: str, item_id: str):
-    supabase = get_supabase_client()
-    response = supabase.table('inventory').delete().eq('machine_id', machine_id).eq('id', item_id).execute()
+    response = _with_client(
+        'delete_inventory_item',
+        lambda supabase: supabase.table('inventory').delete().eq('machine_id', machine_id).eq('id', item_id).execute()
+    )
     return {'success': True, 'data': response.data}
 
+def get_inventory_items(item_ids: list):
+    """Inventory rows with the given ids, whichever machine they belong to"""
+    if not item_ids:
+        return []
+    response = _with_client(
+        'get_inventory_items',
+        lambda supabase: supabase.table('inventory').select('*').in_('id', list(item_ids)).execute(),
+        idempotent=True
+    )
+    return response.data or []
+
+def get_inventory_images(page_size: int = 1000) -> list:
+    """(machine_id, image) of every inventory row, across all machines, for the image GC"""
+    rows = []
+    last_id = None
+    while True:
+        def fetch(supabase):
+            query = supabase.table('inventory').select('id,machine_id,image')
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            return query.order('id').limit(page_size).execute()
+
+        page = _with_client('get_inventory_images', fetch, idempotent=True).data or []
+        rows.extend((row['machine_id'], row.get('image')) for row in page)
+        if len(page) < page_size:
+            return rows
+        last_id = page[-1]['id']
+
+def upsert_inventory_items(machine_id: str, items: list):
+    """Insert or update many complete inventory rows in one call; returns the stored rows.
+
+    Rows are matched on ``id``. Columns missing from a new row get their
+    database defaults, so pass existing rows merged with their changes.
+    """
+    if not items:
+        return []
+    now = datetime.now().isoformat()
+    rows = [
+        {**{k: v for k, v in item.items() if k not in INVENTORY_SERVER_COLUMNS}, 'machine_id': machine_id, 'updated_at': now}
+        for item in items
+    ]
+    try:
+        response = _with_client(
+            'upsert_inventory_items',
+            lambda supabase: supabase.table('inventory').upsert(rows, on_conflict='id', default_to_null=False).execute()
+        )
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while saving inventory: {str(e)}")
+
+def delete_inventory_items(machine_id: str, item_ids: list):
+    """Delete many of a machine's items in one call; returns the deleted rows"""
+    if not item_ids:
+        return []
+    try:
+        response = _with_client(
+            'delete_inventory_items',
+            lambda supabase: supabase.table('inventory').delete().eq('machine_id', machine_id).in_('id', list(item_ids)).execute()
+        )
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while deleting inventory: {str(e)}")
+
 def get_orders(machine_id: str):
     """Get orders for a machine from orders table - ordered by created_at"""
-    supabase = get_supabase_client()
     try:
-        response = supabase.table('orders').select('*').eq('machine_id', machine_id).order('created_at', desc=True).execute()
+        response = _with_client(
+            'get_orders',
+            lambda supabase: supabase.table('orders').select('*').eq('machine_id', machine_id).order('created_at', desc=True).execute(),
+            idempotent=True
+        )
         return {'success': True, 'orders': response.data}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-def add_order(machine_id: str, order: dict):
-    """Create a new order in the database - simplified to avoid recursion"""
+# Columns clients may request through ?fields= on the paginated orders API
+ORDER_COLUMNS = {
+    'order_id', 'machine_id', 'items', 'total_amount', 'payment_status',
+    'customer_name', 'customer_phone', 'created_at', 'updated_at',
+    'payment_id', 'payment_amount', 'payment_method', 'vpa', 'bank_name',
+    'payer_account_type', 'upi_transaction_id', 'razorpay_order_id', 'qr_code_id'
+}
+
+def encode_order_cursor(order: dict) -> str:
+    """Opaque keyset cursor pointing just past ``order``"""
+    raw = json.dumps([order.get('created_at'), order.get('order_id')])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_order_cursor(cursor: str):
+    """Return (created_at, order_id) from a cursor, raising ValueError if it is malformed"""
     try:
-        supabase = get_supabase_client()
-        from datetime import datetime
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, order_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(created_at, str) or not isinstance(order_id, str):
+        raise ValueError('Invalid cursor')
+    return created_at, order_id
 
-        # Generate a proper order ID
-        order_id = f"BB{int(datetime.now().timestamp() * 1000)}"
+def get_orders_page(machine_id: str, limit: int = 50, cursor: str = None, payment_status=None,
+                    date_from: str = None, date_to: str = None, customer_phone: str = None,
+                    columns=None, include_total: bool = True):
+    """Get one page of orders, newest first, using a keyset cursor on (created_at, order_id)"""
+    # The cursor keys are always selected so the next cursor can be built
+    selected = ','.join(sorted(set(columns) | {'created_at', 'order_id'})) if columns else '*'
+    after = decode_order_cursor(cursor) if cursor else None
 
-        # Create simple, safe order data
-        order_data = {
-            'order_id': order_id,
-            'machine_id': machine_id,
-            'items': order.get('items', []),  # Keep as-is, let Supabase handle JSON
-            'total_amount': order.get('totalAmount', 0),
-            'payment_status': 'pending',
-            'customer_name': order.get('customerName', ''),
-            'customer_phone': order.get('customerPhone', ''),
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
+    def apply_filters(query):
+        query = query.eq('machine_id', machine_id)
+        if payment_status:
+            query = query.in_('payment_status', payment_status)
+        if date_from:
+            query = query.gte('created_at', date_from)
+        if date_to:
+            query = query.lt('created_at', date_to)
+        if customer_phone:
+            query = query.eq('customer_phone', customer_phone)
+        return query
+
+    def fetch_page(supabase):
+        # The exact count comes back in Content-Range, so it costs no extra rows;
+        # on later pages the cursor would skew it, so it is counted separately
+        count = 'exact' if include_total and not after else None
+        query = apply_filters(supabase.table('orders').select(selected, count=count))
+        if after:
+            created_at, order_id = after
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",order_id.lt."{order_id}")'
+            )
+        # Fetch one extra row to know whether another page exists
+        return query.order('created_at', desc=True).order('order_id', desc=True).limit(limit + 1).execute()
+
+    def count_orders(supabase):
+        return apply_filters(supabase.table('orders').select('order_id', count='exact', head=True)).execute()
+
+    try:
+        response = _with_client('get_orders_page', fetch_page, idempotent=True)
+        rows = response.data or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        total = None
+        if include_total:
+            total = response.count if not after else _with_client('count_orders', count_orders, idempotent=True).count
+
+        return {
+            'success': True,
+            'orders': rows,
+            'hasMore': has_more,
+            'nextCursor': encode_order_cursor(rows[-1]) if has_more and rows else None,
+            'total': total
         }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def get_dashboard_aggregates(machine_id: str, timezone: str, low_stock: int = 5, critical_stock: int = 2):
+    """Aggregate order and stock stats in the database (see add_dashboard_stats_migration.sql)"""
+    response = _with_client(
+        'get_dashboard_aggregates',
+        lambda supabase: supabase.rpc('dashboard_stats', {
+            'p_machine_id': machine_id,
+            'p_timezone': timezone,
+            'p_low_stock': low_stock,
+            'p_critical_stock': critical_stock
+        }).execute(),
+        idempotent=True
+    )
+    return response.data
+
+SALES_ROLLUP_TABLES = {'hour': 'sales_rollup_hourly', 'day': 'sales_rollup_daily'}
+
+def apply_order_to_sales_rollups(order_id: str, machine_id: str = None) -> bool:
+    """Count a paid order into the hourly/daily rollups; False if it was already counted"""
+    response = _with_client(
+        'apply_order_to_sales_rollups',
+        lambda supabase: supabase.rpc('apply_order_to_sales_rollups', {
+            'p_order_id': order_id,
+            'p_timezone': get_machine_timezone(machine_id)
+        }).execute()
+    )
+    return bool(response.data)
+
+def rebuild_sales_rollups(machine_id: str = None) -> int:
+    """Rebuild rollups from the orders table; returns the number of paid orders counted"""
+    response = _with_client(
+        'rebuild_sales_rollups',
+        lambda supabase: supabase.rpc('rebuild_sales_rollups', {
+            'p_machine_id': machine_id,
+            'p_default_timezone': DEFAULT_MACHINE_TIMEZONE,
+            'p_timezones': MACHINE_TIMEZONES
+        }).execute()
+    )
+    return response.data or 0
+
+def get_sales_timeseries(machine_id: str, granularity: str, date_from: str, date_to: str = None, item_id: str = '*'):
+    """Read rollup buckets for charts, oldest first; item_id=None returns every item"""
+    table = SALES_ROLLUP_TABLES[granularity]
+
+    def fetch(supabase):
+        query = supabase.table(table).select('bucket_start,item_id,item_name,revenue,units,order_count') \
+            .eq('machine_id', machine_id).gte('bucket_start', date_from)
+        if date_to:
+            query = query.lt('bucket_start', date_to)
+        if item_id is not None:
+            query = query.eq('item_id', item_id)
+        return query.order('bucket_start').execute()
+
+    return _with_client('get_sales_timeseries', fetch, idempotent=True).data or []
+
+def new_order_row(machine_id: str, order: dict) -> dict:
+    """Build a pending order row, with a fresh order id, from a kiosk's order payload"""
+    # The random suffix keeps ids unique when several orders are created in the same millisecond
+    order_id = f"BB{int(datetime.now().timestamp() * 1000)}{uuid.uuid4().hex[:6].upper()}"
+    return {
+        'order_id': order_id,
+        'machine_id': machine_id,
+        'items': order.get('items', []),  # Keep as-is, let Supabase handle JSON
+        'total_amount': float(order.get('totalAmount', 0)),
+        'payment_status': 'pending',
+        'customer_name': order.get('customerName', ''),
+        'customer_phone': order.get('customerPhone', ''),
+        'created_at': datetime.now().isoformat(),
+        'updated_at': datetime.now().isoformat()
+    }
+
+def add_orders(machine_id: str, orders: list) -> list:
+    """Insert many pending orders in one call; returns the created rows"""
+    if not orders:
+        return []
+    rows = [new_order_row(machine_id, order) for order in orders]
+    try:
+        response = _with_client('add_orders', lambda supabase: supabase.table('orders').insert(rows).execute())
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while creating orders: {str(e)}")
+
+def add_order(machine_id: str, order: dict):
+    """Create a new order in the database - simplified to avoid recursion"""
+    try:
+        # Create simple, safe order data
+        order_data = new_order_row(machine_id, order)
+        order_id = order_data['order_id']
 
         # Insert into database
-        response = supabase.table('orders').insert(order_data).execute()
+        response = _with_client('add_order', lambda supabase: supabase.table('orders').insert(order_data).execute())
 
         if response.data and len(response.data) > 0:
             return {
@@ -118,150 +484,248 @@ def add_order(machine_id: str, order: dict):
         }
 
 def get_order(machine_id: str, order_id: str):
-    supabase = get_supabase_client()
     try:
-        response = supabase.table('orders').select('*').eq('machine_id', machine_id).eq('order_id', order_id).execute()
+        response = _with_client(
+            'get_order',
+            lambda supabase: supabase.table('orders').select('*').eq('machine_id', machine_id).eq('order_id', order_id).execute(),
+            idempotent=True
+        )
         return response.data[0] if response.data else None
     except Exception as e:
         raise Exception(f"Database error while fetching order: {str(e)}")
 
 def update_order(machine_id: str, order_id: str, update_data: dict):
-    supabase = get_supabase_client()
     try:
-        response = supabase.table('orders').update(update_data).eq('machine_id', machine_id).eq('order_id', order_id).execute()
+        response = _with_client(
+            'update_order',
+            lambda supabase: supabase.table('orders').update(update_data).eq('machine_id', machine_id).eq('order_id', order_id).execute()
+        )
         return response.data
     except Exception as e:
         raise Exception(f"Database error while updating order: {str(e)}")
 
-def create_storage_bucket_if_not_exists():
-    """Create the product-images bucket if it doesn't exist"""
-    supabase = get_supabase_client()
-    
+def mark_order_paid(machine_id: str, order_id: str, update_data: dict, from_statuses: tuple = ('pending',)):
+    """Apply a captured payment to a machine's order whose status is in ``from_statuses``; returns the updated rows"""
+    update_data = {**update_data, 'payment_status': 'paid'}
     try:
-        # Try to list files in the bucket to check if it exists
-        supabase.storage.from_("product-images").list()
-        print("✅ Storage bucket 'product-images' exists")
-        return True
+        response = _with_client(
+            'mark_order_paid',
+            lambda supabase: supabase.table('orders').update(update_data).eq('machine_id', machine_id)
+                .eq('order_id', order_id).in_('payment_status', list(from_statuses)).execute()
+        )
+        return response.data
     except Exception as e:
-        if "Bucket not found" in str(e):
-            print("❌ Storage bucket 'product-images' not found")
-            print("💡 Please create the bucket manually in Supabase dashboard:")
-            print("   1. Go to https://app.supabase.com/project/[your-project]/storage/buckets")
-            print("   2. Click 'New Bucket'")
-            print("   3. Name: 'product-images'")
-            print("   4. Make it 'Public bucket' (checked)")
-            print("   5. Click 'Save'")
-            print("   6. Then restart your backend server")
-            return False
-        else:
-            print(f"❌ Bucket check error: {str(e)}")
-            return False
+        raise Exception(f"Database error while marking order paid: {str(e)}")
 
-def upload_image(machine_id: str, table_name: str, column_name: str, filename: str, file_data):
-    """Upload image to Supabase storage with enhanced error handling"""
-    supabase = get_supabase_client()
-    
-    # Ensure bucket exists
-    if not create_storage_bucket_if_not_exists():
-        raise Exception("Storage bucket is not available. Please check your Supabase configuration.")
-    
-    # Create storage path with timestamp for uniqueness
-    import time
-    timestamp = int(time.time())
-    file_path = f"{machine_id}/{table_name}/{column_name}/{timestamp}_{filename}"
-    
+def record_webhook_dead_letter(event: dict, error: str, attempts: int):
+    """Keep a webhook event that could not be applied, for inspection and replay"""
+    _with_client(
+        'record_webhook_dead_letter',
+        lambda supabase: supabase.table('webhook_dead_letters').insert({
+            'event_id': event.get('id'),
+            'event': event.get('event'),
+            'payload': event.get('payload'),
+            'error': error,
+            'attempts': attempts,
+            'received_at': event.get('received_at')
+        }).execute()
+    )
+
+def save_webhook_event(event: dict) -> bool:
+    """Persist a verified webhook before it is acknowledged; False if its event id is already stored"""
+    # Not retried on a dropped connection: if the first insert landed, the retry would find the row
+    # and report a duplicate that nobody queued. Failing lets Razorpay redeliver instead, and a
+    # stored row is claimed by the recovery sweep either way.
+    response = _with_client(
+        'save_webhook_event',
+        lambda supabase: supabase.table('webhook_events').upsert({
+            'event_id': event['id'],
+            'event': event.get('event'),
+            'payload': event.get('payload'),
+            'received_at': event.get('received_at')
+        }, on_conflict='event_id', ignore_duplicates=True).execute()
+    )
+    return bool(response.data)
+
+def finish_webhook_event(event_id: str, status: str, error: str = None):
+    """Mark a stored webhook event 'processed' or 'dead' so it is not claimed again"""
+    _with_client(
+        'finish_webhook_event',
+        lambda supabase: supabase.table('webhook_events').update({
+            'status': status,
+            'last_error': error,
+            'finished_at': datetime.now().isoformat()
+        }).eq('event_id', event_id).execute(),
+        idempotent=True
+    )
+
+def claim_webhook_events(limit: int, lease_seconds: int, max_claims: int) -> list:
+    """Claim pending webhook events nobody finished (see add_webhook_events_migration.sql), as queue events"""
+    response = _with_client(
+        'claim_webhook_events',
+        lambda supabase: supabase.rpc('claim_webhook_events', {
+            'p_limit': limit,
+            'p_lease_seconds': lease_seconds,
+            'p_max_claims': max_claims
+        }).execute()
+    )
+    return [{
+        'id': row['event_id'],
+        'event': row.get('event'),
+        'payload': row.get('payload') or {},
+        'received_at': row.get('received_at')
+    } for row in response.data or []]
+
+def update_orders_status(machine_id: str, order_ids: list, status: str, from_statuses: tuple):
+    """Move many of a machine's orders whose status is in ``from_statuses`` to ``status``; returns the updated rows"""
+    if not order_ids:
+        return []
     try:
-        # Upload to Supabase storage with upsert option to handle RLS
-        response = supabase.storage.from_("product-images").upload(
-            file_path, 
-            file_data,
-            file_options={"cache-control": "3600", "upsert": "true"}
+        response = _with_client(
+            'update_orders_status',
+            lambda supabase: supabase.table('orders').update({
+                'payment_status': status,
+                'updated_at': datetime.now().isoformat()
+            }).eq('machine_id', machine_id).in_('order_id', list(order_ids))
+                .in_('payment_status', list(from_statuses)).execute()
         )
-        
-        # Check if upload was successful - Supabase returns different response formats
-        print(f"Upload response type: {type(response)}, has data: {hasattr(response, 'data')}")
-        
-        if response and hasattr(response, 'data'):
-            if response.data or response.data is not None:  # Handle both data and None cases
-                # Get public URL
-                public_url_response = supabase.storage.from_("product-images").get_public_url(file_path)
-                print(f"Generated public URL: {public_url_response}")
-                return public_url_response
-            
-        # If we get here, check for errors
-        if hasattr(response, 'error') and response.error:
-            error_message = str(response.error)
-            print(f"Upload error from response: {error_message}")
-            raise Exception(f"Upload failed: {error_message}")
-        
-        # Try to get public URL anyway (sometimes upload succeeds but response is unclear)
-        try:
-            public_url_response = supabase.storage.from_("product-images").get_public_url(file_path)
-            print(f"Fallback - generated public URL: {public_url_response}")
-            return public_url_response
-        except Exception as url_error:
-            print(f"Could not generate public URL: {url_error}")
-            raise Exception(f"Upload may have failed or URL generation failed: {response}")
-            
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while updating orders: {str(e)}")
+
+def cancel_order_and_restore_inventory(machine_id: str, order_id: str) -> dict:
+    """Cancel a pending order and restore its stock in one transaction.
+
+    Returns {'found', 'cancelled', 'status', 'restored'}; 'cancelled' is False
+    when the order is missing or no longer pending, so repeated calls are no-ops.
+    """
+    try:
+        response = _with_client(
+            'cancel_order_and_restore_inventory',
+            lambda supabase: supabase.rpc('cancel_order_and_restore_inventory', {
+                'p_machine_id': machine_id,
+                'p_order_id': order_id
+            }).execute()
+        )
+        return response.data
+    except Exception as e:
+        raise Exception(f"Database error while cancelling order: {str(e)}")
+
+def create_order_with_reservation(order_data: dict, hold_seconds: int) -> dict:
+    """Insert a pending order and reserve its items in one round trip.
+
+    Returns {'success': True, 'order', 'expires_at'} or
+    {'success': False, 'unavailable': [...]} when any item lacks stock.
+    """
+    try:
+        response = _with_client(
+            'create_order_with_reservation',
+            lambda supabase: supabase.rpc('create_order_with_reservation', {
+                'p_order': order_data,
+                'p_hold_seconds': hold_seconds
+            }).execute()
+        )
+        return response.data
+    except Exception as e:
+        raise Exception(f"Database error while reserving inventory: {str(e)}")
+
+def commit_order_reservation(order_id: str) -> list:
+    """Mark a paid order's held stock as sold; returns the inventory rows that changed"""
+    try:
+        response = _with_client(
+            'commit_order_reservation',
+            lambda supabase: supabase.rpc('commit_order_reservation', {'p_order_id': order_id}).execute()
+        )
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while committing reservation: {str(e)}")
+
+def get_pending_orders_for_expiry(created_after: str = None, limit: int = 1000):
+    """Pending orders across all machines, projected to what the expiry scheduler needs"""
+    def fetch(supabase):
+        query = supabase.table('orders').select('order_id,machine_id,created_at,hold_expires_at') \
+            .eq('payment_status', 'pending')
+        if created_after:
+            query = query.gte('created_at', created_after)
+        return query.order('created_at').limit(limit).execute()
+
+    return _with_client('get_pending_orders_for_expiry', fetch, idempotent=True).data or []
+
+def cancel_orders_batch(orders: list) -> list:
+    """Cancel many pending orders in one call; orders are {'machine_id', 'order_id'} dicts"""
+    try:
+        response = _with_client(
+            'cancel_orders_batch',
+            lambda supabase: supabase.rpc('cancel_orders_and_restore_inventory', {'p_orders': orders}).execute()
+        )
+        return response.data or []
+    except Exception as e:
+        raise Exception(f"Database error while cancelling orders: {str(e)}")
+
+def try_acquire_scheduler_lease(name: str, holder: str, ttl_seconds: int) -> bool:
+    """Take or renew a named lease; True if ``holder`` owns it"""
+    response = _with_client(
+        'try_acquire_scheduler_lease',
+        lambda supabase: supabase.rpc('try_acquire_scheduler_lease', {
+            'p_name': name,
+            'p_holder': holder,
+            'p_ttl_seconds': ttl_seconds
+        }).execute()
+    )
+    return bool(response.data)
+
+def get_storage():
+    """Storage backend for product images (see storage.py)"""
+    return _storage
+
+def create_storage_bucket_if_not_exists():
+    """Check the product-images bucket exists (at most every STORAGE_BUCKET_RECHECK seconds)"""
+    return _storage.ensure_bucket()
+
+def image_path(machine_id: str, table_name: str, column_name: str, filename: str = None) -> str:
+    folder = f"{machine_id}/{table_name}/{column_name}"
+    return f"{folder}/{filename}" if filename else folder
+
+def upload_image(machine_id: str, table_name: str, column_name: str, filename: str, file_data,
+                 content_type: str = None, cache_seconds: int = 3600, timestamped: bool = True):
+    """Upload image to storage and return its public URL.
+
+    ``timestamped=False`` keeps ``filename`` as is (content-addressed variants).
+    """
+    # Create storage path with timestamp for uniqueness
+    if timestamped:
+        filename = f"{int(time.time())}_{filename}"
+    file_path = image_path(machine_id, table_name, column_name, filename)
+
+    try:
+        return _storage.upload(file_path, file_data, content_type=content_type, cache_seconds=cache_seconds)
+    except BucketNotFound:
+        raise
     except Exception as e:
         error_str = str(e)
         print(f"Image upload error: {error_str}")
-        
-        # More specific error messages
-        if "Bucket not found" in error_str:
-            raise Exception("Storage bucket not found. Please create 'product-images' bucket in Supabase.")
-        elif "row-level security" in error_str.lower() or "violates row-level security" in error_str.lower():
-            # Try alternative approach if RLS is blocking
-            print("RLS detected, attempting direct upload...")
-            try:
-                # Try to create service role client for bypassing RLS
-                from supabase import create_client
-                service_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-                
-                response = service_client.storage.from_("product-images").upload(
-                    file_path, 
-                    file_data,
-                    file_options={"cache-control": "3600", "upsert": "true"}
-                )
-                
-                if hasattr(response, 'data') and response.data:
-                    public_url_response = service_client.storage.from_("product-images").get_public_url(file_path)
-                    return public_url_response
-                else:
-                    raise Exception("Service role upload also failed")
-                    
-            except Exception as service_error:
-                print(f"Service role upload error: {service_error}")
-                raise Exception("Storage RLS policies are blocking uploads. Please run 'python fix_supabase_storage_rls.py' to get setup instructions.")
+        if "row-level security" in error_str.lower():
+            raise Exception("Storage RLS policies are blocking uploads. Please run 'python fix_supabase_storage_rls.py' to get setup instructions.")
         elif "permission" in error_str.lower():
             raise Exception("Permission denied. Please check your Supabase API key permissions.")
-        else:
-            raise Exception(f"Image upload failed: {error_str}")
+        raise Exception(f"Image upload failed: {error_str}")
+
+def list_image_files(machine_id: str, table_name: str, column_name: str, search: str = None) -> set:
+    """Names of the stored images in a folder, optionally only those containing ``search``"""
+    return _storage.list(image_path(machine_id, table_name, column_name), search=search)
 
 def get_image_url(machine_id: str, table_name: str, column_name: str, filename: str):
-    """Get public URL for an image"""
-    supabase = get_supabase_client()
-    
-    file_path = f"{machine_id}/{table_name}/{column_name}/{filename}"
-    public_url = supabase.storage.from_("product-images").get_public_url(file_path)
-    
-    return public_url
+    """Get public URL for an image (built locally, no request)"""
+    return _storage.public_url(image_path(machine_id, table_name, column_name, filename))
 
 def delete_image(file_path: str):
-    """Delete image from Supabase storage"""
-    print(f"DEBUG: delete_image called with file_path: {file_path}")
-    supabase = get_supabase_client()
-
+    """Delete image from storage"""
     try:
-        print(f"DEBUG: Attempting to delete from Supabase storage: {file_path}")
-        response = supabase.storage.from_("product-images").remove([file_path])
-        print(f"DEBUG: Supabase delete response: {response}")
+        _storage.remove([file_path])
         print(f"Successfully deleted image: {file_path}")
         return True
     except Exception as e:
         print(f"ERROR: Failed to delete image {file_path}: {str(e)}")
-        import traceback
-        print(f"DEBUG: Full traceback: {traceback.format_exc()}")
         return False
 
 def delete_old_product_image(old_image_url: str):
@@ -296,32 +760,3 @@ def delete_old_product_image(old_image_url: str):
         print(f"ERROR: Exception in delete_old_product_image: {str(e)}")
         return False
 
-def validate_image_file(file_data, max_size_mb=5):
-    """Validate image file size and type"""
-    import io
-    from PIL import Image
-    
-    # Check file size
-    file_size = len(file_data)
-    max_size_bytes = max_size_mb * 1024 * 1024
-    
-    if file_size > max_size_bytes:
-        raise Exception(f"File size ({file_size/1024/1024:.1f}MB) exceeds maximum allowed size ({max_size_mb}MB)")
-    
-    # Validate image format
-    try:
-        img = Image.open(io.BytesIO(file_data))
-        # Convert to RGB if needed (for JPEG compatibility)
-        if img.mode in ('RGBA', 'P'):
-            rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-            rgb_img.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            
-            # Convert back to bytes
-            buffer = io.BytesIO()
-            rgb_img.save(buffer, format='JPEG', quality=85)
-            return buffer.getvalue()
-        
-        return file_data
-        
-    except Exception as e:
-        raise Exception(f"Invalid image file: {str(e)}")
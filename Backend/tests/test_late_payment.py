@@ -0,0 +1,110 @@
+"""
+A payment that lands after an order's stock hold expired: boots one backend
+worker against the mock Supabase server, expires an order the way the expiry
+sweep does, then delivers its signed qr_code.credited webhook.
+
+Run from Backend/:
+  python -m pytest tests/test_late_payment.py
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from bench.checkout_load_test import start_backend
+from bench.mock_supabase import start_mock_supabase
+from bench.replay_webhooks import WEBHOOK_SECRET, credited_webhook, wait_for_drain
+
+MACHINE_ID = 'VM-LATE'
+
+@pytest.fixture(scope='module')
+def backend():
+    supabase = start_mock_supabase()
+    os.environ.update({'RAZORPAY_WEBHOOK_SECRET': WEBHOOK_SECRET, 'WEBHOOK_WORKERS': '1'})
+    args = argparse.Namespace(concurrency=4, async_mode='threading', port=5197, server='python')
+    process, base_url = start_backend(
+        args, f"http://127.0.0.1:{supabase.server_address[1]}", 'http://127.0.0.1:9/v1',
+        tempfile.mkdtemp(prefix='late-payment-')
+    )
+    try:
+        yield supabase.state, base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        supabase.shutdown()
+
+def create_order(state, quantity=3):
+    item = state.seed_inventory(MACHINE_ID, count=1, quantity=quantity)[0]
+    order_id = f'BBLATE{uuid.uuid4().hex[:8].upper()}'
+    with state.lock:
+        state.rpc_create_order_with_reservation({
+            'order_id': order_id, 'machine_id': MACHINE_ID, 'total_amount': item['price'],
+            'items': [{'id': item['id'], 'name': item['name'], 'price': item['price'], 'quantity': 1}]
+        })
+    return order_id, item
+
+def deliver(base_url, order_id, amount_paise):
+    body = json.dumps(credited_webhook(order_id, MACHINE_ID, amount_paise)).encode()
+    response = requests.post(f"{base_url}/razorpay-webhook", data=body, timeout=10, headers={
+        'Content-Type': 'application/json',
+        'X-Razorpay-Signature': hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest(),
+        'X-Razorpay-Event-Id': f'evt_{uuid.uuid4().hex[:14]}'
+    })
+    assert response.status_code == 200
+    wait_for_drain(base_url, timeout=10)
+
+def stock_of(state, item):
+    with state.lock:
+        row = next(r for r in state._find('inventory', machine_id=MACHINE_ID) if r['id'] == item['id'])
+        return row['quantity'], row['reserved_quantity']
+
+def order_of(state, order_id):
+    with state.lock:
+        return state._find('orders', machine_id=MACHINE_ID, order_id=order_id)[0]
+
+def test_webhook_after_expiry_marks_order_paid_and_takes_stock_again(backend):
+    state, base_url = backend
+    order_id, item = create_order(state, quantity=3)
+    with state.lock:
+        state.rpc_cancel_orders_and_restore_inventory([{'machine_id': MACHINE_ID, 'order_id': order_id}])
+    assert stock_of(state, item) == (3, 0)
+
+    deliver(base_url, order_id, int(item['price'] * 100))
+
+    order = order_of(state, order_id)
+    assert order['payment_status'] == 'paid'
+    assert order['payment_id'].startswith('pay_')
+    assert stock_of(state, item) == (2, 0)
+    with state.lock:
+        reservations = state._find('inventory_reservations', order_id=order_id)
+        dead_letters = [row for row in state.tables['webhook_dead_letters']
+                        if order_id in json.dumps(row.get('payload'))]
+    assert [r['status'] for r in reservations] == ['committed']
+    assert dead_letters == []
+
+def test_webhook_for_unpayable_order_is_dead_lettered(backend):
+    state, base_url = backend
+    order_id, item = create_order(state)
+    with state.lock:
+        order = state._find('orders', machine_id=MACHINE_ID, order_id=order_id)[0]
+        order['payment_status'] = 'failed'
+
+    deliver(base_url, order_id, int(item['price'] * 100))
+
+    assert order_of(state, order_id)['payment_status'] == 'failed'
+    with state.lock:
+        dead_letters = [row for row in state.tables['webhook_dead_letters']
+                        if order_id in json.dumps(row.get('payload'))]
+    assert len(dead_letters) == 1
+    assert 'failed' in dead_letters[0]['error']
@@ -0,0 +1,257 @@
+import io
+import os
+import re
+import hmac
+import time
+import heapq
+import uuid
+import random
+import pstats
+import cProfile
+import logging
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from metrics import ROUTE_KEY
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'X-Trace-Id'
+# Spans kept per trace; a runaway loop of upstream calls should not grow a trace without bound
+MAX_SPANS = 200
+# Incoming X-Trace-Id values are reused only if they look like ids
+_TRACE_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+_current = contextvars.ContextVar('trace', default=None)
+
+def _native_lock():
+    try:
+        from gevent.monkey import get_original
+        return get_original('_thread', 'allocate_lock')()
+    except ImportError:
+        import _thread
+        return _thread.allocate_lock()
+
+class Trace:
+    """One request: what it was, how long it took and the timed steps (spans) inside it"""
+
+    def __init__(self, trace_id, method, path):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped_spans = 0
+        self.profile = None
+
+    @property
+    def name(self):
+        return f"{self.method} {self.route or self.path}"
+
+    def add_span(self, name, started, duration, error=None, **attrs):
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        span = {
+            'name': name,
+            'start_ms': round((started - self.started) * 1000, 2),
+            'duration_ms': round(duration * 1000, 2)
+        }
+        if error:
+            span['error'] = error
+        if attrs:
+            span.update(attrs)
+        # list.append is atomic, so spans from the Razorpay worker threads need no lock
+        self.spans.append(span)
+
+    def to_dict(self, spans=True):
+        entry = {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'path': self.path,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'span_count': len(self.spans),
+            'profiled': self.profile is not None
+        }
+        if spans:
+            entry['spans'] = sorted(self.spans, key=lambda span: span['start_ms'])
+            if self.dropped_spans:
+                entry['dropped_spans'] = self.dropped_spans
+        return entry
+
+    def summary(self):
+        """'supabase create_order_with_reservation 120ms, razorpay POST /orders 2900ms, ...' (slowest first)"""
+        spans = sorted(self.spans, key=lambda span: -span['duration_ms'])[:8]
+        return ', '.join(f"{span['name']} {span['duration_ms']:.0f}ms" for span in spans) or 'no spans'
+
+def current_trace():
+    return _current.get()
+
+def record_span(name, started, duration, error=None, **attrs):
+    """Add a step timed by the caller (``started`` from time.perf_counter()) to the current trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add_span(name, started, duration, error, **attrs)
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a span of the current trace; does nothing outside a traced request"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(name, started, time.perf_counter() - started, error, **attrs)
+
+class TraceStore:
+    """The ``size`` slowest traces seen by this process, plus the last few profiled ones"""
+
+    def __init__(self, size=50, profiled_size=20):
+        self.size = max(1, size)
+        self._lock = _native_lock()
+        self._slowest = []  # min-heap of (duration, n, trace)
+        self._profiled = deque(maxlen=profiled_size)
+        self._counter = itertools.count()
+        self._stats = {'traces': 0, 'slow': 0, 'profiled': 0}
+
+    def add(self, trace, slow=False):
+        with self._lock:
+            self._stats['traces'] += 1
+            if slow:
+                self._stats['slow'] += 1
+            if trace.profile is not None:
+                self._stats['profiled'] += 1
+                self._profiled.append(trace)
+            entry = (trace.duration, next(self._counter), trace)
+            if len(self._slowest) < self.size:
+                heapq.heappush(self._slowest, entry)
+            elif trace.duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def slowest(self, limit=None):
+        with self._lock:
+            traces = [trace for _, _, trace in sorted(self._slowest, key=lambda entry: -entry[0])]
+        return traces[:limit] if limit else traces
+
+    def profiled(self):
+        with self._lock:
+            return list(reversed(self._profiled))
+
+    def get(self, trace_id):
+        with self._lock:
+            candidates = list(self._profiled) + [trace for _, _, trace in self._slowest]
+        return next((trace for trace in candidates if trace.trace_id == trace_id), None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['kept'] = len(self._slowest)
+            stats['slowest_ms'] = round(max(self._slowest)[0] * 1000, 1) if self._slowest else None
+        return stats
+
+def profile_text(profile_data, limit=40):
+    """pstats report (top ``limit`` functions by cumulative time) of a stored profile"""
+    stream = io.StringIO()
+    stats = pstats.Stats(_LoadedProfile(profile_data), stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+class _LoadedProfile:
+    # pstats.Stats accepts any object with create_stats() and a .stats dict
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+class TracingMiddleware:
+    """WSGI wrapper that traces every request.
+
+    The trace id (the caller's X-Trace-Id if it sent one) is returned in
+    the X-Trace-Id response header. Requests slower than ``slow_ms`` are
+    logged with their span breakdown; the slowest ``store.size`` are kept
+    for /api/admin/traces.
+
+    A request is run under cProfile when it sends ``X-Profile: 1`` with the
+    API key, or for a random ``profile_rate`` share of requests; sampled
+    profiles are only kept if the request turned out slow. One request is
+    profiled at a time per process, and under gevent the profile also
+    covers whatever other greenlets ran meanwhile.
+    """
+
+    def __init__(self, wsgi_app, store, api_key=None, slow_ms=1000, profile_rate=0.0):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.api_key = api_key
+        self.slow_ms = slow_ms
+        self.profile_rate = profile_rate
+        self._profiler_lock = _native_lock()
+
+    def _profile_requested(self, environ):
+        if environ.get('HTTP_X_PROFILE') not in ('1', 'true'):
+            return False
+        return bool(self.api_key) and hmac.compare_digest(environ.get('HTTP_X_API_KEY', ''), self.api_key)
+
+    def __call__(self, environ, start_response):
+        incoming = environ.get('HTTP_X_TRACE_ID', '')
+        trace_id = incoming if _TRACE_ID.match(incoming) else uuid.uuid4().hex[:16]
+        trace = Trace(trace_id, environ.get('REQUEST_METHOD', 'GET'), environ.get('PATH_INFO', ''))
+
+        def traced_start_response(status, headers, *exc_info):
+            trace.status = int(status.split(' ', 1)[0])
+            headers.append((TRACE_HEADER, trace_id))
+            return start_response(status, headers, *exc_info)
+
+        requested = self._profile_requested(environ)
+        profiler = None
+        if (requested or (self.profile_rate and random.random() < self.profile_rate)) \
+                and self._profiler_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active (e.g. a developer's); skip ours
+                self._profiler_lock.release()
+                profiler = None
+
+        token = _current.set(trace)
+        try:
+            return self.wsgi_app(environ, traced_start_response)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiler_lock.release()
+            _current.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            trace.route = environ.get(ROUTE_KEY)
+            slow = trace.duration * 1000 >= self.slow_ms
+            if profiler is not None and (requested or slow):
+                profiler.create_stats()
+                trace.profile = profiler.stats
+            self.store.add(trace, slow)
+            if slow:
+                logger.warning(f"🐢 Slow request {trace.name} {trace.duration * 1000:.0f}ms "
+                               f"(trace {trace_id}, status {trace.status}): {trace.summary()}")
+
+def create_tracing(wsgi_app, api_key=None):
+    """TracingMiddleware configured from TRACE_SLOW_MS, TRACE_KEEP and TRACE_PROFILE_RATE"""
+    store = TraceStore(int(os.getenv('TRACE_KEEP', '50')))
+    return TracingMiddleware(wsgi_app, store, api_key,
+                             slow_ms=float(os.getenv('TRACE_SLOW_MS', '1000')),
+                             profile_rate=float(os.getenv('TRACE_PROFILE_RATE', '0')))
@@ -0,0 +1,150 @@
+import hmac
+import time
+import queue
+import random
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+def verify_webhook_signature(body: bytes, signature: str, secret: str) -> bool:
+    """Check Razorpay's X-Razorpay-Signature (hex HMAC-SHA256 of the raw body)"""
+    if not signature or not secret:
+        return False
+    expected = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+def webhook_event_id(headers, body: bytes) -> str:
+    """Razorpay's X-Razorpay-Event-Id; retries resend the same body, so hash it as a fallback"""
+    return headers.get('X-Razorpay-Event-Id') or 'sha256:' + hashlib.sha256(body).hexdigest()
+
+class WebhookQueue:
+    """Bounded queue of verified webhook events drained by a fixed pool of workers.
+
+    Each event is passed to ``handler(event)``; an exception retries it with
+    jittered exponential backoff, and after ``max_attempts`` it goes to
+    ``dead_letter(event, error, attempts)``. With ``workers=0`` events are
+    handled inline by ``submit``.
+
+    The queue itself is only a fast path: events are persisted before they are
+    acknowledged, and every ``recover_interval`` seconds ``recover()`` returns
+    stored events that no live worker finished (lost to a restart or crash, or
+    rejected by a full queue) to be queued again.
+    """
+
+    def __init__(self, handler, dead_letter=None, workers=4, maxsize=1000, max_attempts=5,
+                 backoff=0.5, recover=None, recover_interval=60, spawn=None, sleep=time.sleep):
+        self.handler = handler
+        self.dead_letter = dead_letter
+        self.workers = max(0, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.recover = recover
+        self.recover_interval = recover_interval
+        self.spawn = spawn
+        self.sleep = sleep
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats = {'enqueued': 0, 'rejected': 0, 'processed': 0, 'retries': 0, 'dead_lettered': 0,
+                       'recovered': 0, 'in_flight': 0}
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def start(self):
+        with self._lock:
+            if self._started or not self.workers:
+                return
+            self._started = True
+        for n in range(self.workers):
+            self._spawn(self._work, f'webhook-worker-{n}')
+        if self.recover:
+            self._spawn(self._recover_loop, 'webhook-recovery')
+        logger.info(f"Webhook queue started with {self.workers} workers")
+
+    def _spawn(self, target, name):
+        if self.spawn:
+            self.spawn(target)
+        else:
+            threading.Thread(target=target, name=name, daemon=True).start()
+
+    def submit(self, event):
+        """Queue ``event`` for processing; False when the queue is full"""
+        if not self.workers:
+            self._count('enqueued')
+            self._process(event)
+            return True
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            try:
+                self._process(event)
+            except Exception as e:
+                logger.error(f"Webhook worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _recover_loop(self):
+        while True:
+            self.sleep(self.recover_interval)
+            try:
+                events = self.recover() or []
+            except Exception as e:
+                logger.error(f"Webhook recovery failed: {e}")
+                continue
+            requeued = 0
+            for event in events:
+                if not self.submit(event):
+                    # Still stored; claimed again once this claim lapses
+                    break
+                requeued += 1
+            if requeued:
+                self._count('recovered', requeued)
+                logger.info(f"Re-queued {requeued} unfinished webhook events")
+
+    def _process(self, event):
+        self._count('in_flight')
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    self.handler(event)
+                    self._count('processed')
+                    return
+                except Exception as e:
+                    error = e
+                    if attempt < self.max_attempts:
+                        self._count('retries')
+                        delay = self.backoff * (2 ** (attempt - 1))
+                        logger.warning(f"Webhook {event.get('id')} failed (attempt {attempt}): {e}; retrying in {delay:.1f}s")
+                        self.sleep(delay * random.uniform(0.5, 1.5))
+
+            self._count('dead_lettered')
+            logger.error(f"Webhook {event.get('id')} failed after {self.max_attempts} attempts: {error}")
+            if self.dead_letter:
+                try:
+                    self.dead_letter(event, str(error), self.max_attempts)
+                except Exception as e:
+                    logger.error(f"Failed to dead-letter webhook {event.get('id')}: {e} - payload: {event}")
+        finally:
+            self._count('in_flight', -1)
+
+    def join(self):
+        """Block until every queued event has been handled (benchmarks, shutdown)"""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(workers=self.workers, depth=self._queue.qsize(), maxsize=self._queue.maxsize)
+        return stats